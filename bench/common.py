@@ -0,0 +1,21 @@
+from typing import List, Optional
+
+# regressions smaller than this are noise
+THRESHOLD = 0.10
+
+
+def percentile(values: List[float], percent: float) -> float:
+    # values must already be sorted
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+def compare(now: float, then: Optional[float], higher: bool) -> str:
+    # `higher` is whether a bigger number is better
+    if then is None or then == 0:
+        return ""
+    change = (now - then) / then
+    regressed = change < -THRESHOLD if higher else change > THRESHOLD
+    return f" ({change:+.0%}{' REGRESSION' if regressed else ''})"
@@ -0,0 +1,190 @@
+from datetime import datetime, timedelta
+from random import Random
+from string import ascii_lowercase, digits
+from typing import Dict, Iterator, List, Tuple
+
+SERVERS = [f"{name}.libera.chat" for name in ["copper", "iron", "lead", "tin"]]
+NICKSERV = "NickServ!NickServ@services.libera.chat"
+OPERS = ["jess", "ilkme", "glguy", "kline-bot"]
+TAGS = ["spam", "botnet", "abuse", "evasion", "proxy"]
+REALNAMES = ["realname", "...", "Unknown", "webchat user", "https://kiwiirc.com"]
+QUITS = ["Quit: Leaving", "Ping timeout: 240 seconds", "Remote host closed"]
+
+# relative weight of each kind of line, roughly what a busy server sees
+MIX: Dict[str, float] = {
+    "cliconn": 40.0,
+    "cliexit": 34.0,
+    "nickchg": 12.0,
+    "klinerej": 6.0,
+    "klineadd": 1.0,
+    "klinedel": 0.5,
+    "klineexit": 0.5,
+    "nickserv": 6.0,
+}
+
+
+def _snote(server: str, ts: datetime, text: str) -> str:
+    time = ts.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+    return f"@time={time}Z :{server} NOTICE * :*** Notice -- {text}"
+
+
+class SnoteGenerator(object):
+    def __init__(self, seed: int, rate: float = 100.0):
+        self._random = Random(seed)
+        self._ts = datetime.utcnow()
+        # average gap between lines, in seconds
+        self._gap = 1 / rate
+        # so separate runs against the same database don't collide
+        self._prefix = "".join(self._random.choices(ascii_lowercase, k=3))
+        self._counter = 0
+
+        # nick -> (user, host, ip)
+        self._clients: Dict[str, Tuple[str, str, str]] = {}
+        self._nicks: List[str] = []
+        # masks of k-lines we've set and not yet removed
+        self._klines: List[str] = []
+        self._accounts: List[str] = []
+
+    def _name(self) -> str:
+        self._counter += 1
+        return f"{self._prefix}{self._counter}"
+
+    def _ip(self) -> str:
+        if self._random.random() < 0.8:
+            return ".".join(str(self._random.randint(1, 254)) for _ in range(4))
+        hextets = [f"{self._random.randint(0, 0xFFFF):x}" for _ in range(4)]
+        return "2001:db8:" + ":".join(hextets) + "::1"
+
+    def _pop_client(self) -> Tuple[str, Tuple[str, str, str]]:
+        index = self._random.randrange(len(self._nicks))
+        self._nicks[index], self._nicks[-1] = self._nicks[-1], self._nicks[index]
+        nick = self._nicks.pop()
+        return nick, self._clients.pop(nick)
+
+    def _kind(self) -> str:
+        kinds = list(MIX)
+        kind = self._random.choices(kinds, weights=[MIX[k] for k in kinds])[0]
+        if kind in {"cliexit", "nickchg", "klineexit"} and not self._nicks:
+            return "cliconn"
+        if kind in {"klinerej", "klinedel"} and not self._klines:
+            return "klineadd"
+        return kind
+
+    def _cliconn(self, server: str) -> str:
+        nick = self._name()
+        user = "~" + "".join(self._random.choices(ascii_lowercase, k=6))
+        ip = self._ip()
+        host = ip if self._random.random() < 0.5 else f"{nick}.users.example"
+        self._clients[nick] = (user, host, ip)
+        self._nicks.append(nick)
+
+        account = "*"
+        if self._accounts and self._random.random() < 0.3:
+            account = self._random.choice(self._accounts)
+        real = self._random.choice(REALNAMES)
+        return (
+            f"Client connecting: {nick} ({user}@{host}) [{ip}] {{users}}"
+            f" <{account}> [{real}]"
+        )
+
+    def _cliexit(self) -> str:
+        nick, (user, host, ip) = self._pop_client()
+        quit = self._random.choice(QUITS)
+        return f"Client exiting: {nick} ({user}@{host}) [{quit}] [{ip}]"
+
+    def _nickchg(self) -> str:
+        old, client = self._pop_client()
+        new = self._name()
+        self._clients[new] = client
+        self._nicks.append(new)
+        user, host, _ = client
+        return f"Nick change: From {old} to {new} [{user}@{host}]"
+
+    def _klineadd(self) -> str:
+        mask = f"*@{self._ip()}"
+        self._klines.append(mask)
+        oper = self._random.choice(OPERS)
+        reason = "Please email bans@libera.chat"
+        if self._random.random() < 0.7:
+            reason += f" %{self._random.choice(TAGS)}"
+        return (
+            f"{oper}!{oper}@libera/staff/{oper}{{{oper}}} added global"
+            f" {self._random.choice([60, 1440, 10080])} min. K-Line for"
+            f" [{mask}] [{reason}]"
+        )
+
+    def _klinedel(self) -> str:
+        mask = self._klines.pop(self._random.randrange(len(self._klines)))
+        oper = self._random.choice(OPERS)
+        return (
+            f"{oper}!{oper}@libera/staff/{oper}{{{oper}}} has removed the global"
+            f" K-Line for: [{mask}]"
+        )
+
+    def _klinerej(self) -> str:
+        mask = self._random.choice(self._klines)
+        ip = mask.split("@", 1)[1]
+        nick = self._name()
+        return f"Rejecting K-Lined user {nick}[~u@{ip}] [{ip}] ({mask})"
+
+    def _klineexit(self) -> List[str]:
+        # a disconnect is always followed by the client exiting
+        nick, (user, host, ip) = self._pop_client()
+        mask = f"*@{ip}"
+        self._klines.append(mask)
+        return [
+            f"Disconnecting K-Lined user {nick}[{user}@{host}] ({mask})",
+            f"Client exiting: {nick} ({user}@{host}) [K-Lined] [{ip}]",
+        ]
+
+    def _nickserv(self, ts: datetime) -> str:
+        time = ts.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+        roll = self._random.random()
+        if roll < 0.4 or not self._accounts:
+            account = self._name()
+            self._accounts.append(account)
+            message = f"{account} REGISTER: {account} to {account}@example.invalid"
+        elif roll < 0.7:
+            account = self._random.choice(self._accounts)
+            message = f"{account} VERIFY:REGISTER: {account} ({account}@example.invalid)"
+        elif roll < 0.9:
+            account = self._random.choice(self._accounts)
+            message = f"{self._name()} GROUP: {self._name()} to {account}"
+        else:
+            account = self._random.choice(self._accounts)
+            message = (
+                f"{self._random.choice(OPERS)} FREEZE:ON: {account}"
+                f" (reason: spam %{self._random.choice(TAGS)})"
+            )
+        return f"@time={time}Z :{NICKSERV} PRIVMSG #services :{message}"
+
+    def lines(self, count: int) -> Iterator[Tuple[str, str]]:
+        # (kind, raw line)
+        sent = 0
+        while sent < count:
+            self._ts += timedelta(seconds=self._random.expovariate(1 / self._gap))
+            server = self._random.choice(SERVERS)
+            kind = self._kind()
+
+            if kind == "nickserv":
+                texts = [self._nickserv(self._ts)]
+            else:
+                if kind == "cliconn":
+                    snotes = [self._cliconn(server)]
+                elif kind == "cliexit":
+                    snotes = [self._cliexit()]
+                elif kind == "nickchg":
+                    snotes = [self._nickchg()]
+                elif kind == "klineadd":
+                    snotes = [self._klineadd()]
+                elif kind == "klinedel":
+                    snotes = [self._klinedel()]
+                elif kind == "klinerej":
+                    snotes = [self._klinerej()]
+                else:
+                    snotes = self._klineexit()
+                texts = [_snote(server, self._ts, s) for s in snotes]
+
+            for text in texts:
+                yield kind, text
+                sent += 1
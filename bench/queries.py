@@ -0,0 +1,236 @@
+import asyncio, json
+from argparse import ArgumentParser
+from contextlib import asynccontextmanager
+from ipaddress import ip_network
+from time import perf_counter
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+
+import asyncpg
+
+from beryllia import Bot, Caller
+from beryllia.config import load as config_load
+from beryllia.database import Database
+from beryllia.database.common import TimedPool
+from beryllia.normalise import RFC1459SearchNormaliser
+
+from .common import compare, percentile
+
+# (label, command, type, query)
+_TYPE_CASE = Tuple[str, str, str, str]
+
+
+class _RecordingConnection(object):
+    # passes everything through, noting down each statement and its args
+    def __init__(self, conn: asyncpg.Connection, statements: List[Tuple[str, Any]]):
+        self._conn = conn
+        self._statements = statements
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    async def _record(self, method: str, query: str, *args: Any) -> Any:
+        self._statements.append((query, args))
+        return await getattr(self._conn, method)(query, *args)
+
+    async def execute(self, query: str, *args: Any) -> Any:
+        return await self._record("execute", query, *args)
+
+    async def fetch(self, query: str, *args: Any) -> Any:
+        return await self._record("fetch", query, *args)
+
+    async def fetchrow(self, query: str, *args: Any) -> Any:
+        return await self._record("fetchrow", query, *args)
+
+    async def fetchval(self, query: str, *args: Any) -> Any:
+        return await self._record("fetchval", query, *args)
+
+
+class _RecordingPool(TimedPool):
+    def __init__(self, pool: asyncpg.Pool):
+        super().__init__(pool)
+        self.statements: List[Tuple[str, Any]] = []
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        async with super().acquire() as conn:
+            yield _RecordingConnection(conn, self.statements)
+
+
+async def _cases(conn: asyncpg.Connection) -> List[_TYPE_CASE]:
+    # search for things that actually exist in the seeded data
+    kill = await conn.fetchrow(
+        "SELECT nickname, hostname, ip FROM kline_kill ORDER BY RANDOM() LIMIT 1"
+    )
+    kline = await conn.fetchrow("SELECT id, ts FROM kline ORDER BY RANDOM() LIMIT 1")
+    tag = await conn.fetchval("SELECT tag FROM kline_tag LIMIT 1")
+    cliconn = await conn.fetchrow(
+        """
+        SELECT id, nickname, username, hostname, realname, ip
+        FROM cliconn
+        ORDER BY RANDOM()
+        LIMIT 1
+    """
+    )
+
+    def _ips(command: str, ip: Any) -> Iterator[_TYPE_CASE]:
+        cidr = ip_network(f"{ip}/{24 if ip.version == 4 else 64}", strict=False)
+        if ip.version == 4:
+            glob = ".".join(str(ip).split(".")[:3]) + ".*"
+        else:
+            glob = ":".join(ip.exploded.split(":")[:4]) + ":*"
+        yield f"{command} ip", command, "ip", str(ip)
+        yield f"{command} cidr", command, "ip", str(cidr)
+        yield f"{command} ip glob", command, "ip", glob
+
+    octets = str(kill["ip"]).split(".")[:2]
+    cidr_short = ip_network(f"{cliconn['ip']}/16", strict=False)
+    return [
+        ("kcheck nick", "kcheck", "nick", kill["nickname"]),
+        ("kcheck host", "kcheck", "host", kill["hostname"]),
+        *_ips("kcheck", kill["ip"]),
+        ("kcheck mask", "kcheck", "mask", "*@" + ".".join(octets) + ".*"),
+        ("kcheck ts", "kcheck", "ts", kline["ts"].strftime("%Y-%m-%d %H:%M")),
+        ("kcheck ts range", "kcheck", "ts", kline["ts"].strftime("%Y-%m-%d..%Y-%m-%d")),
+        ("kcheck tag", "kcheck", "tag", tag),
+        ("kcheck reason", "kcheck", "reason", "proxy"),
+        ("kcheck reasonglob", "kcheck", "reasonglob", "*proxy*"),
+        ("kcheck id", "kcheck", "id", str(kline["id"])),
+        ("cliconn nick", "cliconn", "nick", cliconn["nickname"]),
+        ("cliconn user", "cliconn", "user", cliconn["username"]),
+        ("cliconn host", "cliconn", "host", cliconn["hostname"]),
+        ("cliconn real", "cliconn", "real", cliconn["realname"]),
+        *_ips("cliconn", cliconn["ip"]),
+        ("cliconn id", "cliconn", "id", str(cliconn["id"])),
+        ("cliconn short", "cliconn", "short", str(cidr_short)),
+        ("cliconn quit", "cliconn", "quit", "*timeout*"),
+    ]
+
+
+def _walk(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+
+async def _explain(
+    conn: asyncpg.Connection, statements: List[Tuple[str, Any]]
+) -> List[Dict[str, Any]]:
+
+    outs: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+    for query, args in statements:
+        if query in seen:
+            # the same per-result lookup, over and over
+            continue
+        seen.add(query)
+
+        raw = await conn.fetchval(
+            f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", *args
+        )
+        plan = json.loads(raw)[0]
+        nodes = list(_walk(plan["Plan"]))
+        outs.append(
+            {
+                "query": " ".join(query.split()),
+                "args": [str(a) for a in args],
+                "ms": plan["Execution Time"],
+                "shared_hit": plan["Plan"].get("Shared Hit Blocks", 0),
+                "shared_read": plan["Plan"].get("Shared Read Blocks", 0),
+                "seq_scans": [
+                    n["Relation Name"] for n in nodes if n["Node Type"] == "Seq Scan"
+                ],
+                "plan": plan,
+            }
+        )
+    return outs
+
+
+async def run(config_file: str, iterations: int, count: int) -> Dict[str, Any]:
+    config = config_load(config_file)
+    pool = await asyncpg.create_pool(
+        user=config.db_user,
+        password=config.db_pass,
+        host=config.db_host,
+        database=config.db_name,
+    )
+    recording = _RecordingPool(pool)
+
+    server = Bot(config).create_server("bench")
+    server.database = Database(recording, RFC1459SearchNormaliser())
+    caller = Caller("bench", "bench!bench@bench", "bench")
+
+    results: Dict[str, Any] = {}
+    async with pool.acquire() as conn:
+        for label, command, type, query in await _cases(conn):
+            func = getattr(server, f"cmd_{command}")
+            args = [type, query, str(count)]
+
+            latencies: List[float] = []
+            for _ in range(iterations):
+                recording.statements.clear()
+                start = perf_counter()
+                await func(caller, args)
+                latencies.append(perf_counter() - start)
+            latencies.sort()
+
+            statements = list(recording.statements)
+            results[label] = {
+                "query": query,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "statements": len(statements),
+                "explain": await _explain(conn, statements),
+            }
+
+    await pool.close()
+    return results
+
+
+def _report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    then = baseline or {}
+    for label, result in results.items():
+        then_result = then.get(label, {})
+        read = sum(e["shared_read"] + e["shared_hit"] for e in result["explain"])
+        then_read: Optional[float] = None
+        if then_result:
+            then_read = sum(
+                e["shared_read"] + e["shared_hit"] for e in then_result["explain"]
+            )
+        seq_scans = sorted({s for e in result["explain"] for s in e["seq_scans"]})
+
+        print(
+            f"{label:>16}"
+            f"  p50_ms {result['p50_ms']:.2f}"
+            + compare(result["p50_ms"], then_result.get("p50_ms"), False)
+            + f"  p99_ms {result['p99_ms']:.2f}"
+            + compare(result["p99_ms"], then_result.get("p99_ms"), False)
+            + f"  statements {result['statements']}"
+            + f"  buffers {read}"
+            + compare(read, then_read, False)
+            + (f"  SEQ SCAN {','.join(seq_scans)}" if seq_scans else "")
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="time every kcheck and cliconn search type against a"
+        " seeded database, recording query plans"
+    )
+    parser.add_argument("config")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--count", type=int, default=3)
+    parser.add_argument("--save", help="write results and plans to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.config, args.iterations, args.count))
+
+    baseline: Optional[Dict[str, Any]] = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    _report(results, baseline)
+
+    if args.save is not None:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,345 @@
+import asyncio
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from ipaddress import ip_address, IPv4Address, IPv6Address
+from random import Random
+from string import ascii_lowercase
+from typing import Any, Iterator, List, Optional, Sequence, Tuple, Union
+
+import asyncpg
+
+from beryllia.config import load as config_load
+from beryllia.normalise import RFC1459SearchNormaliser, SearchType
+from beryllia.util import CompositeString, CompositeStringText
+
+from .generate import OPERS, QUITS, REALNAMES, SERVERS, TAGS
+
+# rows per COPY
+CHUNK = 50_000
+
+NICK_STEMS = ["Guest", "user", "kiwi", "web", "anon", "afk", "dev", "bot"]
+ISPS = ["dsl.example.net", "cable.example.com", "mobile.example.org", "vps.example"]
+REASONS = [
+    "Please email bans@libera.chat to request assistance with this ban",
+    "You are banned from this server- Spambot",
+    "Open proxy found on your host",
+    "Ban evasion",
+]
+
+_NORMALISER = RFC1459SearchNormaliser()
+
+_TYPE_IP = Union[IPv4Address, IPv6Address]
+
+
+def _search(value: str, type: SearchType) -> str:
+    composite = CompositeString([CompositeStringText(value)])
+    return str(_NORMALISER.normalise(composite, type))
+
+
+class Population(object):
+    # a long tail of hosts, where a few reconnect a lot and most rarely do,
+    # clustered into a few hundred /16s like real ISPs
+    def __init__(self, random: Random, hosts: int):
+        self._random = random
+        self._prefixes = [
+            (random.randint(1, 223), random.randint(0, 255)) for _ in range(300)
+        ]
+        self._hosts = [self._host() for _ in range(hosts)]
+
+    def _host(self) -> Tuple[str, str, _TYPE_IP]:
+        random = self._random
+        if random.random() < 0.85:
+            a, b = random.choice(self._prefixes)
+            ip: _TYPE_IP = ip_address(
+                f"{a}.{b}.{random.randint(0, 255)}.{random.randint(1, 254)}"
+            )
+        else:
+            hextets = [random.getrandbits(16) for _ in range(3)]
+            ip = ip_address("2001:db8:%x:%x::%x" % tuple(hextets))
+
+        roll = random.random()
+        if roll < 0.5:
+            hostname = str(ip)
+        elif roll < 0.9:
+            reverse = str(ip).replace(".", "-").replace(":", "-")
+            hostname = f"{reverse}.{random.choice(ISPS)}"
+        else:
+            hostname = f"user/{self.nick()}"[:64]
+
+        user = "~" + "".join(random.choices(ascii_lowercase, k=random.randint(3, 8)))
+        return user, hostname, ip
+
+    def nick(self) -> str:
+        random = self._random
+        if random.random() < 0.3:
+            return f"{random.choice(NICK_STEMS)}{random.randint(0, 99999)}"
+        return "".join(random.choices(ascii_lowercase, k=random.randint(3, 12)))
+
+    def client(self) -> Tuple[str, str, str, _TYPE_IP]:
+        # paretovariate gives us a few very busy hosts
+        index = int(self._random.paretovariate(1.2)) - 1
+        user, host, ip = self._hosts[index % len(self._hosts)]
+        return self.nick(), user, host, ip
+
+
+def _ts(random: Random, start: datetime, days: int) -> datetime:
+    return start + timedelta(seconds=random.uniform(0, days * 86400))
+
+
+def _cliconns(
+    random: Random, people: Population, count: int, start: datetime, days: int
+) -> Iterator[Tuple[Any, ...]]:
+
+    for _ in range(count):
+        nick, user, host, ip = people.client()
+        real = random.choice(REALNAMES)
+        account = nick if random.random() < 0.3 else None
+        ts = _ts(random, start, days)
+
+        # most connections are short, a few last for weeks
+        exit_ts: Optional[datetime] = None
+        duration: Optional[int] = None
+        quit: Optional[str] = None
+        if random.random() < 0.95:
+            duration = int(random.lognormvariate(6, 2.5))
+            exit_ts = ts + timedelta(seconds=duration)
+            quit = random.choice(QUITS)
+
+        yield (
+            nick,
+            _search(nick, SearchType.NICK),
+            user,
+            _search(user, SearchType.USER),
+            real,
+            _search(real, SearchType.REAL),
+            host,
+            _search(host, SearchType.HOST),
+            account,
+            None if account is None else _search(account, SearchType.NICK),
+            ip,
+            random.choice(SERVERS),
+            ts,
+            exit_ts,
+            duration,
+            quit,
+        )
+
+
+def _klines(
+    random: Random, people: Population, count: int, start: datetime, days: int
+) -> Iterator[Tuple[Any, ...]]:
+
+    for _ in range(count):
+        _, _, host, ip = people.client()
+        mask = f"*@{ip if random.random() < 0.8 else host}"
+        oper = random.choice(OPERS)
+        duration = random.choice([60, 1440, 4320, 10080]) * 60
+        reason = random.choice(REASONS)
+        if random.random() < 0.7:
+            reason += f" %{random.choice(TAGS)}"
+        ts = _ts(random, start, days)
+        yield (
+            mask,
+            _search(mask, SearchType.MASK),
+            f"{oper}!{oper}@libera/staff/{oper}",
+            oper,
+            duration,
+            reason,
+            ts,
+            ts + timedelta(seconds=duration),
+        )
+
+
+def _affected(
+    random: Random,
+    people: Population,
+    klines: Sequence[Tuple[int, datetime]],
+    count: int,
+) -> Iterator[Tuple[Any, ...]]:
+    # kills and rejects look the same
+
+    for _ in range(count):
+        kline_id, kline_ts = random.choice(klines)
+        nick, user, host, ip = people.client()
+        yield (
+            kline_id,
+            nick,
+            _search(nick, SearchType.NICK),
+            user[:10],
+            _search(user[:10], SearchType.USER),
+            host,
+            _search(host, SearchType.HOST),
+            ip,
+            kline_ts + timedelta(seconds=random.uniform(0, 3600)),
+        )
+
+
+async def _copy(
+    conn: asyncpg.Connection,
+    table: str,
+    columns: List[str],
+    records: Iterator[Tuple[Any, ...]],
+) -> None:
+
+    done = 0
+    while True:
+        chunk = [r for _, r in zip(range(CHUNK), records)]
+        if not chunk:
+            break
+        await conn.copy_records_to_table(table, records=chunk, columns=columns)
+        done += len(chunk)
+        print(f"{table}: {done}", end="\r", flush=True)
+    print()
+
+
+AFFECTED_COLUMNS = [
+    "kline_id",
+    "nickname",
+    "search_nick",
+    "username",
+    "search_user",
+    "hostname",
+    "search_host",
+    "ip",
+    "ts",
+]
+
+
+async def seed(
+    config_file: str,
+    seed: int,
+    days: int,
+    hosts: int,
+    cliconns: int,
+    klines: int,
+    kills: int,
+    rejects: int,
+) -> None:
+
+    config = config_load(config_file)
+    conn = await asyncpg.connect(
+        user=config.db_user,
+        password=config.db_pass,
+        host=config.db_host,
+        database=config.db_name,
+    )
+
+    random = Random(seed)
+    people = Population(random, hosts)
+    start = datetime.utcnow() - timedelta(days=days)
+
+    await _copy(
+        conn,
+        "cliconn",
+        [
+            "nickname",
+            "search_nick",
+            "username",
+            "search_user",
+            "realname",
+            "search_real",
+            "hostname",
+            "search_host",
+            "account",
+            "search_acc",
+            "ip",
+            "server",
+            "ts",
+            "exit_ts",
+            "duration",
+            "quit_reason",
+        ],
+        _cliconns(random, people, cliconns, start, days),
+    )
+    await _copy(
+        conn,
+        "kline",
+        [
+            "mask",
+            "search_mask",
+            "source",
+            "oper",
+            "duration",
+            "reason",
+            "ts",
+            "expire",
+        ],
+        _klines(random, people, klines, start, days),
+    )
+
+    rows = await conn.fetch("SELECT id, ts FROM kline")
+    kline_rows = [(row["id"], row["ts"]) for row in rows]
+    await _copy(
+        conn,
+        "kline_kill",
+        AFFECTED_COLUMNS,
+        _affected(random, people, kline_rows, kills),
+    )
+    # rejects are unique per (kline, nick, user, host), so go through a
+    # staging table rather than have one collision abort the whole COPY
+    await conn.execute(
+        "CREATE TEMPORARY TABLE kline_reject_seed (LIKE kline_reject INCLUDING DEFAULTS)"
+    )
+    await _copy(
+        conn,
+        "kline_reject_seed",
+        AFFECTED_COLUMNS,
+        _affected(random, people, kline_rows, rejects),
+    )
+    await conn.execute(
+        f"""
+        INSERT INTO kline_reject ({", ".join(AFFECTED_COLUMNS)})
+        SELECT {", ".join(AFFECTED_COLUMNS)} FROM kline_reject_seed
+        ON CONFLICT DO NOTHING
+    """
+    )
+
+    await conn.execute(
+        """
+        INSERT INTO kline_tag (kline_id, tag, search_tag, source, oper, ts)
+        SELECT
+            id,
+            SUBSTRING(reason FROM '%(\\S+)'),
+            LOWER(SUBSTRING(reason FROM '%(\\S+)')),
+            source,
+            oper,
+            ts
+        FROM kline
+        WHERE reason LIKE '%\\%%'
+        ON CONFLICT DO NOTHING
+    """
+    )
+    # what KLineExpiry would have done had these been live
+    await conn.execute(
+        "UPDATE kline SET expired = TRUE WHERE expire <= NOW()::TIMESTAMP"
+    )
+    await conn.execute("ANALYZE")
+    await conn.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="fill a scratch database with realistic looking history"
+    )
+    parser.add_argument("config")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--hosts", type=int, default=1_000_000)
+    parser.add_argument("--cliconns", type=int, default=10_000_000)
+    parser.add_argument("--klines", type=int, default=200_000)
+    parser.add_argument("--kills", type=int, default=1_000_000)
+    parser.add_argument("--rejects", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    asyncio.run(
+        seed(
+            args.config,
+            args.seed,
+            args.days,
+            args.hosts,
+            args.cliconns,
+            args.klines,
+            args.kills,
+            args.rejects,
+        )
+    )
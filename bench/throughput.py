@@ -0,0 +1,99 @@
+import asyncio, json
+from argparse import ArgumentParser
+from collections import defaultdict
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+from irctokens import tokenise
+from ircstates.numerics import RPL_ENDOFMOTD
+
+from beryllia import Bot
+from beryllia.config import load as config_load
+from beryllia.metrics import DB_ACQUIRE
+
+from .common import compare, percentile
+from .generate import SnoteGenerator
+
+
+def _summary(latencies: List[float], queries: int) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "lines": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "queries_per_line": queries / max(len(latencies), 1),
+    }
+
+
+async def run(config_file: str, count: int, seed: int) -> Dict[str, Any]:
+    config = config_load(config_file)
+    server = Bot(config).create_server("bench")
+    # pretend we've connected, so snotes are handled
+    server.registered = True
+    await server.line_read(tokenise(f":bench {RPL_ENDOFMOTD} bench :End of MOTD"))
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    queries: Dict[str, int] = defaultdict(int)
+
+    start = perf_counter()
+    for kind, text in SnoteGenerator(seed).lines(count):
+        line = tokenise(text)
+        before = DB_ACQUIRE.count()
+        line_start = perf_counter()
+        await server.line_read(line)
+        latencies[kind].append(perf_counter() - line_start)
+        queries[kind] += DB_ACQUIRE.count() - before
+    elapsed = perf_counter() - start
+
+    all_latencies = [l for kind in latencies.values() for l in kind]
+    return {
+        "seed": seed,
+        "lines_per_sec": count / elapsed,
+        "total": _summary(all_latencies, sum(queries.values())),
+        "kinds": {k: _summary(latencies[k], queries[k]) for k in sorted(latencies)},
+    }
+
+
+def _report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    then = baseline or {}
+    print(
+        f"{results['lines_per_sec']:.0f} lines/sec"
+        + compare(results["lines_per_sec"], then.get("lines_per_sec"), True)
+    )
+
+    rows = [("total", results["total"])] + list(results["kinds"].items())
+    then_rows = {"total": then.get("total", {}), **then.get("kinds", {})}
+    for name, summary in rows:
+        then_summary = then_rows.get(name, {})
+        outs = [f"{name:>10}", f"{summary['lines']:>8} lines"]
+        for key in ["p50_ms", "p99_ms", "queries_per_line"]:
+            outs.append(
+                f"{key} {summary[key]:.3f}"
+                + compare(summary[key], then_summary.get(key), False)
+            )
+        print("  ".join(outs))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="feed synthetic snotes through Server.line_read"
+        " (point the config at a scratch database!)"
+    )
+    parser.add_argument("config")
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.config, args.lines, args.seed))
+
+    baseline: Optional[Dict[str, Any]] = None
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    _report(results, baseline)
+
+    if args.save is not None:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
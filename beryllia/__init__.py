@@ -1,10 +1,15 @@
+import asyncio
+from collections import OrderedDict
 from dataclasses import dataclass
 from datetime import datetime, timedelta
+from itertools import count as itertools_count
 from json import loads as json_loads
+from logging import DEBUG
 from re import compile as re_compile
 from shlex import split as shlex_split
 from tabulate import tabulate
 from typing import Dict, List, Optional, Sequence, Tuple
+from typing import OrderedDict as TOrderedDict
 
 from irctokens import build, hostmask as hostmask_parse, Hostmask, Line
 from ircrobots import Bot as BaseBot
@@ -14,15 +19,28 @@ from ircstates.numerics import RPL_ENDOFMOTD, ERR_NOMOTD, RPL_WELCOME, RPL_YOURE
 from ircrobots.ircv3 import Capability
 
 from .config import Config
+from .connrate import ip_prefix, PREFIX_V4, PREFIX_V6
 from .database import Database, DatabaseError
+from .database.common import SlowLog
 from .database.common import NickUserHost
+from .database.cliconn import Cliconn
 from .database.kline import DBKLine
+from .database.watch import DBWatch
+from .expiry import KLineExpiry
+from .log import LOG, LOG_IRC, snote_category
+from .metrics import COMMAND, MAP_SIZE, QUEUE_DEPTH
 from .normalise import RFC1459SearchNormaliser
+from .sketch import WINDOW_MAX
+from .watch import Watchlist, WATCH_TYPES
+from .output import OutputQueue, pack_lines, LINE_MAX, PRIORITY_HIGH, PRIORITY_LOW
 
 from .util import oper_up, pretty_delta, get_statsp, get_klines
-from .util import try_parse_cidr, try_parse_ip, try_parse_ts
-from .util import looks_like_glob, colourise
+from .util import line_time, parse_stats_kline_reason
+from .util import try_parse_cidr, try_parse_ip, try_parse_ts_range
+from .util import try_parse_duration, try_parse_ids
+from .util import looks_like_glob, colourise, sparkline
 
+from .parse.common import embedded_tags, TAGLEN
 from .parse.nickserv import NickServParser
 from .parse.snote import SnoteParser
 
@@ -30,6 +48,28 @@ RE_DATE = re_compile(r"^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})$")
 
 CAP_OPER = Capability(None, "solanum.chat/oper")
 MASK_MAX = 3
+# how many outstanding continuation tokens we remember
+PAGES_MAX = 256
+# replies this many lines or shorter jump ahead of long replies
+SMALL_REPLY = 4
+# worst case username and hostname length, for when we don't know our own
+USERLEN = 10
+HOSTLEN = 63
+# how many slow queries `slowlog` lists
+SLOWLOG_MAX = 10
+# seconds. `cliconn short` finds connections that didn't last this long
+SHORT_SESSION = 10
+# how many bars `connrate` draws, at most
+CONNRATE_BARS = 60
+# how many entries `top` lists, and how far back it looks by default
+TOP_COUNT = 10
+TOP_WINDOW = timedelta(minutes=5)
+# how many watches `watch list` shows
+WATCH_LIST_MAX = 20
+WATCH_PATTERNLEN = 92
+WATCH_REASONLEN = 260
+# most k-lines `ktag` and `ktaglast` will tag at once
+KTAG_MAX = 500
 
 
 @dataclass
@@ -39,7 +79,23 @@ class Caller:
     oper: str
 
 
+@dataclass
+class Page:
+    oper: str
+    command: str
+    type: str
+    query: str
+    count: int
+    before_ts: datetime
+    before_id: int
+
+
 PREFERENCES: Dict[str, type] = {"statsp": bool, "knag": bool}
+# commands whose output is laid out line-by-line, and so shouldn't be packed
+PREFORMATTED = {"connrate", "eval", "slowlog", "statsp", "top"}
+# search types whose results come back best match first, rather than newest
+# first, so can't be paged by timestamp
+RANKED = {"reason"}
 
 
 class Server(BaseServer):
@@ -47,6 +103,7 @@ class Server(BaseServer):
 
     _nickserv: NickServParser
     _snote: SnoteParser
+    _expiry: KLineExpiry
 
     def __init__(self, bot: BaseBot, name: str, config: Config):
 
@@ -57,14 +114,68 @@ class Server(BaseServer):
 
         self._database_init: bool = False
 
+        # the k-lines we saw in STATS last time we looked
+        self._klines_irc: Optional[Dict[str, str]] = None
+
+        self._pages: TOrderedDict[str, Page] = OrderedDict()
+        self._page_tokens = itertools_count(1)
+
+        self._output = OutputQueue(self.send, config.output_rate, config.output_burst)
+        self._output_task: Optional[asyncio.Task] = None
+        self._nickserv_task: Optional[asyncio.Task] = None
+        self._expiry_task: Optional[asyncio.Task] = None
+
+        # when the line we're currently handling was sent
+        self._line_ts = datetime.utcnow()
+
+    def _clock(self) -> datetime:
+        return self._line_ts
+
+    def _metrics_init(self) -> None:
+        QUEUE_DEPTH.set_function(lambda: len(self._output), queue="output")
+        QUEUE_DEPTH.set_function(
+            lambda: self._nickserv.resolve_queue_depth, queue="email_resolve"
+        )
+        QUEUE_DEPTH.set_function(
+            lambda: self._nickserv.events_waiting, queue="nickserv_event"
+        )
+        MAP_SIZE.set_function(lambda: self._snote.cliconns_size, map="cliconns")
+        MAP_SIZE.set_function(
+            lambda: self._snote.kline_waiting_exit_size, map="kline_waiting_exit"
+        )
+        MAP_SIZE.set_function(
+            lambda: self._nickserv.registration_ids_size, map="registration_ids"
+        )
+        MAP_SIZE.set_function(lambda: len(self._expiry), map="kline_expiry")
+        MAP_SIZE.set_function(lambda: len(self._pages), map="pages")
+        MAP_SIZE.set_function(lambda: len(self._snote.conn_rate), map="conn_rate")
+        MAP_SIZE.set_function(lambda: len(self._snote.watchlist), map="watchlist")
+
     def set_throttle(self, rate: int, time: float):
-        # turn off throttling
+        # turn off ircrobots' throttling; protocol traffic goes out unthrottled
+        # and our own output goes through self._output instead
         pass
 
+    def _line_budget(self, command: str, target: str) -> int:
+        # the server prepends our full hostmask when it relays our messages,
+        # and that counts towards the 512 byte limit
+        username = self.username or "x" * USERLEN
+        hostname = self.hostname or "x" * HOSTLEN
+        prefix = f":{self.nickname}!{username}@{hostname} {command} {target} :"
+        return LINE_MAX - len(prefix.encode("utf8"))
+
     async def minutely(self, now: datetime):
         # this might hit before we've made our database after RPL_ISUPPORT
         if not self._database_init:
             return
+
+        if self._snote.conn_rate:
+            try:
+                await self._snote.conn_rate.flush(self.database.conn_rate)
+            except Exception:
+                # the counts are kept for next time. don't let this stop
+                # statsp or reconciliation
+                LOG.exception("failed to flush connection rates")
         async with self.read_lock:
             for oper, mask in await get_statsp(self):
                 pref = await self.database.preference.get(oper, "statsp")
@@ -73,21 +184,63 @@ class Server(BaseServer):
                     continue
                 await self.database.statsp.add(oper, mask, now)
 
+            reconcile = self._config.reconcile
+            # 0 turns it off
+            if reconcile and not (now.hour * 60 + now.minute) % reconcile:
+                await self._compare_klines()
+
     async def _compare_klines(self):
-        klines_db = await self.database.kline.list_active()
         klines_irc = await get_klines(self)
-
         # None if we didn't have permission to do it
         if klines_irc is None:
             return
-        for kline_gone in set(klines_db) - klines_irc:
-            kline_id = klines_db[kline_gone]
-            await self.database.kline_remove.add(kline_id, None, None)
-        # TODO: add new k-lines to database?
+
+        if self._klines_irc is None:
+            # first look since connecting; compare against everything the
+            # database thinks is active
+            klines_db = await self.database.kline.list_active()
+            klines_gone = set(klines_db) - set(klines_irc)
+            klines_new = set(klines_irc) - set(klines_db)
+        else:
+            # only look at what's changed since our last look
+            klines_gone = set(self._klines_irc) - set(klines_irc)
+            klines_new = set(klines_irc) - set(self._klines_irc)
+            klines_db = await self.database.kline.find_active_many(
+                klines_gone | klines_new
+            )
+            # expired or already removed
+            klines_gone &= set(klines_db)
+            # already seen via snote
+            klines_new -= set(klines_db)
+        self._klines_irc = klines_irc
+
+        if klines_gone:
+            await self.database.kline_remove.add_many(
+                [klines_db[mask] for mask in klines_gone], None, None
+            )
+
+        klines_add: List[Tuple[str, int, str, Optional[datetime]]] = []
+        for mask in klines_new:
+            # we can only work out the duration of temporary k-lines
+            if (parsed := parse_stats_kline_reason(klines_irc[mask])) is not None:
+                klines_add.append((mask, *parsed))
+        if klines_add:
+            # we don't know who set these. when they were set comes from their
+            # reason, or they'll look like they were set now
+            for kline_id, expire in await self.database.kline.add_many(
+                "*", "*", klines_add
+            ):
+                self._expiry.push(kline_id, expire)
+
+        if klines_gone or klines_add:
+            await self._log(
+                f"KLINE:SYNC: {len(klines_add)} missing,"
+                f" {len(klines_gone)} no longer active"
+            )
 
     async def _log(self, text: str):
         if self._config.log is not None:
-            await self.send(build("PRIVMSG", [self._config.log, text]))
+            self._output.queue(build("PRIVMSG", [self._config.log, text]))
 
     async def _knag(self, oper: str, nick: str, kline_id: int, kline: DBKLine) -> None:
         pref = await self.database.preference.get(oper, "knag")
@@ -98,12 +251,28 @@ class Server(BaseServer):
             f"k-line \2#{kline_id}\2 ({kline.mask}) set without a tag;"
             f" '/msg {self.nickname} ktag {kline_id} taghere' to tag it"
         )
-        await self.send(build("NOTICE", [nick, out]))
+        self._output.queue(build("NOTICE", [nick, out]))
 
-    async def _kline_new(self, kline_id: int) -> None:
+    async def _kline_expired(self, kline_id: int) -> None:
         kline = await self.database.kline.get(kline_id)
+        if await self.database.kline_remove.get(kline_id) is not None:
+            # removed before it got to expire
+            return
+        elif await self.database.kline.find_active(kline.mask) is not None:
+            # superseded by a newer k-line for the same mask
+            return
+
+        await self._log(
+            f"KLINE:EXPIRE: \2{kline_id}\2"
+            f" by {colourise(kline.oper)}:"
+            f" {kline.mask} {kline.reason}"
+        )
+
+    async def _kline_new(self, kline_id: int, kline: DBKLine) -> None:
+        self._expiry.push(kline_id, kline.expire)
 
-        if not await self.database.kline_tag.find_tags(kline_id):
+        # any tags it has were added along with it, from its reason
+        if not embedded_tags(kline.reason):
             nickname = hostmask_parse(kline.source).nickname
             await self._knag(kline.oper, nickname, kline_id, kline)
 
@@ -113,8 +282,31 @@ class Server(BaseServer):
             f" {kline.mask} {kline.reason}"
         )
 
+    async def _watch_reload(self) -> None:
+        self._snote.watchlist = Watchlist(await self.database.watch.list_all())
+
+    async def _watch_hit(
+        self, cliconn_id: int, cliconn: Cliconn, watches: Sequence[DBWatch]
+    ) -> None:
+
+        matched = ", ".join(
+            f"\2#{w.id}\2 ({w.type} {w.pattern}: {w.reason})" for w in watches
+        )
+        await self._log(
+            f"WATCH: {cliconn.nuh()} [{cliconn.ip}] <{cliconn.account or '*'}>"
+            f" [{cliconn.realname}] on {cliconn.server} (cliconn \2{cliconn_id}\2)"
+            f" matched {matched}"
+        )
+
     async def line_read(self, line: Line):
+        # server-time, so rows carry when things happened, not when we got
+        # around to handling them
+        self._line_ts = line_time(line)
+
         if line.command == RPL_WELCOME:
+            if self._output_task is None:
+                self._output_task = asyncio.create_task(self._output.run())
+
             oper_name, oper_file, oper_pass = self._config.oper
             await oper_up(self, oper_name, oper_file, oper_pass)
 
@@ -127,11 +319,30 @@ class Server(BaseServer):
                 self._config.db_host,
                 self._config.db_name,
                 RFC1459SearchNormaliser(),
+                SlowLog(
+                    self._config.slow_threshold,
+                    self._config.slow_explain,
+                    self._config.slow_keep,
+                ),
             )
             self._database_init = True
 
-            self._nickserv = NickServParser(database)
-            self._snote = SnoteParser(database, self._config.rejects, self._kline_new)
+            self._nickserv = NickServParser(database, clock=self._clock)
+            self._nickserv_task = asyncio.create_task(self._nickserv.run())
+            self._snote = SnoteParser(
+                database,
+                self._config.rejects,
+                self._kline_new,
+                self._clock,
+                self._watch_hit,
+            )
+            await self._watch_reload()
+
+            self._expiry = KLineExpiry(database)
+            self._expiry.add_listener(self._kline_expired)
+            self._expiry_task = asyncio.create_task(self._expiry.run())
+
+            self._metrics_init()
 
         elif line.command == RPL_YOUREOPER:
             # B connections rejected due to k-line
@@ -202,12 +413,19 @@ class Server(BaseServer):
         try:
             args = shlex_split(sargs)
         except ValueError as e:
-            await self.send(build("NOTICE", [target, f"shlex failure: {str(e)}"]))
+            self._output.queue(build("NOTICE", [target, f"shlex failure: {str(e)}"]))
             return
 
-        outs = await getattr(self, attrib)(caller, args)
+        with COMMAND.time(command=command):
+            outs = await getattr(self, attrib)(caller, args)
+
+        # don't let a short reply get stuck behind someone's 200 line eval
+        priority = PRIORITY_HIGH if len(outs) <= SMALL_REPLY else PRIORITY_LOW
+        if not command in PREFORMATTED:
+            outs = pack_lines(outs, self._line_budget("NOTICE", target))
+
         for out in outs:
-            await self.send(build("NOTICE", [target, out]))
+            self._output.queue(build("NOTICE", [target, out]), priority)
 
     async def cmd_help(self, caller: Caller, args: str):
         me = self.nickname
@@ -223,25 +441,26 @@ class Server(BaseServer):
         else:
             return ["unknown command"]
 
-    async def _ktag(self, kline_id: int, tag: str, caller: Caller):
-
-        if await self.database.kline_tag.exists(kline_id, tag):
-            return [f"k-line {kline_id} is already tagged as '{tag}'"]
-
-        await self.database.kline_tag.add(kline_id, tag, caller.source, caller.oper)
-        kline = await self.database.kline.get(kline_id)
-        kts = pretty_delta(datetime.utcnow() - kline.ts)
-        return [f"tagged {kts} old k-line" f" (#{kline_id} \2{kline.mask}\2) as {tag}"]
+    def _ktagged(self, tag: str, wanted: int, found: int, tagged: int) -> str:
+        out = f"tagged {tagged} k-line{'' if tagged == 1 else 's'} as '{tag}'"
+        if (already := found - tagged) > 0:
+            out += f" ({already} already tagged)"
+        if (missing := wanted - found) > 0:
+            out += f" ({missing} not found)"
+        return out
 
     async def cmd_ktag(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
         if len(args) < 2:
-            return ["please provide a k-line ID and a tag"]
-        elif not args[0].isdecimal():
-            return [f"'{args[0]}' doesn't look like a k-line ID"]
-        elif not await self.database.kline.exists(kline_id := int(args[0])):
-            return [f"k-line {kline_id} not found"]
-
-        return await self._ktag(kline_id, args[1], caller)
+            return ["please provide k-line IDs (e.g. 1,2,5-9) and a tag"]
+        elif (kline_ids := try_parse_ids(args[0], KTAG_MAX)) is None:
+            return [f"'{args[0]}' doesn't look like k-line IDs (max {KTAG_MAX})"]
+        elif len(tag := args[1]) > TAGLEN:
+            return [f"tags can't be longer than {TAGLEN} characters"]
+
+        found, tagged = await self.database.kline_tag.add_many(
+            kline_ids, tag, caller.source, caller.oper
+        )
+        return [self._ktagged(tag, len(kline_ids), found, tagged)]
 
     async def cmd_unktag(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
         if len(args) < 2:
@@ -263,47 +482,110 @@ class Server(BaseServer):
             return ["please provide a k-line count and tag"]
         elif not args[0].isdecimal():
             return [f"'{args[0]}' isn't a number"]
+        elif (count := int(args[0])) > KTAG_MAX:
+            return [f"can't tag more than {KTAG_MAX} k-lines at once"]
+        elif len(tag := args[1]) > TAGLEN:
+            return [f"tags can't be longer than {TAGLEN} characters"]
+
+        # optionally, how far back to look and a mask glob to match, in
+        # either order
+        since: Optional[datetime] = None
+        mask: Optional[str] = None
+        for arg in args[2:]:
+            if since is None and (duration := try_parse_duration(arg)) is not None:
+                since = datetime.utcnow() - duration
+            elif mask is None:
+                mask = arg
+            else:
+                return [f"unexpected argument '{arg}' (expected a duration and mask)"]
 
-        kline_ids = await self.database.kline.find_last_by_oper(
-            caller.oper, int(args[0])
+        found, tagged = await self.database.kline_tag.add_last(
+            caller.oper, count, tag, caller.source, caller.oper, since, mask
+        )
+        if found == 0:
+            return ["found no recent k-lines from you"]
+        return [self._ktagged(tag, found, found, tagged)]
+
+    def _page(
+        self,
+        caller: Caller,
+        command: str,
+        type: str,
+        query: str,
+        count: int,
+        last: Tuple[int, datetime],
+    ) -> str:
+
+        last_id, last_ts = last
+        token = f"{next(self._page_tokens):x}"
+        self._pages[token] = Page(
+            caller.oper, command, type, query, count, last_ts, last_id
+        )
+        while len(self._pages) > PAGES_MAX:
+            self._pages.popitem(last=False)
+
+        return f"more results: /msg {self.nickname} more {token}"
+
+    async def cmd_more(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
+        if not args:
+            return ["please provide a continuation token"]
+
+        token = args[0].lower()
+        page = self._pages.get(token)
+        if page is None or not page.oper == caller.oper:
+            return [f"unknown or expired continuation token '{token}'"]
+
+        del self._pages[token]
+        func = getattr(self, f"_{page.command}")
+        return await func(
+            caller, page.type, page.query, page.count, page.before_ts, page.before_id
         )
-        outs: List[str] = []
-        for kline_id, _ in kline_ids:
-            outs += await self._ktag(kline_id, args[1], caller)
-        if not outs:
-            outs = ["found no recent k-lines from you"]
-        return outs
 
     async def cmd_kcheck(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
         if len(args) < 2:
             return ["please provide a type and query"]
 
         type, query, *args = args
-        db = self.database
-        now = datetime.utcnow()
 
         count = 3
         if args and (count_s := args[0]).isdecimal():
             count = int(count_s)
 
+        return await self._kcheck(caller, type.lower(), query, count)
+
+    async def _kcheck(
+        self,
+        caller: Caller,
+        type: str,
+        query: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[str]:
+
+        db = self.database
+        now = datetime.utcnow()
+        before = (before_ts, before_id)
+
         klines_: List[Tuple[int, datetime]] = []
-        type = type.lower()
         if type == "nick":
-            klines_ += await db.kline_kill.find_by_nick(query, count)
-            klines_ += await db.kline_reject.find_by_nick(query, count)
+            klines_ += await db.kline_kill.find_by_nick(query, count, *before)
+            klines_ += await db.kline_reject.find_by_nick(query, count, *before)
         elif type == "host":
-            klines_ += await db.kline_kill.find_by_host(query, count)
-            klines_ += await db.kline_reject.find_by_host(query, count)
+            klines_ += await db.kline_kill.find_by_host(query, count, *before)
+            klines_ += await db.kline_reject.find_by_host(query, count, *before)
         elif type == "mask":
-            klines_ += await db.kline.find_by_mask_glob(query, count)
+            klines_ += await db.kline.find_by_mask_glob(query, count, *before)
         elif type == "ts":
-            if (dt := try_parse_ts(query)) is None:
-                return [f"'{query}' does not look like a timestamp"]
-            klines_ += await db.kline.find_by_ts(dt, count)
+            if (ts_range := try_parse_ts_range(query)) is None:
+                return [f"'{query}' does not look like a timestamp or range"]
+            klines_ += await db.kline.find_by_ts(*ts_range, count, *before)
         elif type == "tag":
-            klines_ += await db.kline_tag.find_klines(query, count)
+            klines_ += await db.kline_tag.find_klines(query, count, *before)
         elif type == "reason":
             klines_ += await db.kline.find_by_reason(query, count)
+        elif type == "reasonglob":
+            klines_ += await db.kline.find_by_reason_glob(query, count, *before)
         elif type == "id":
             if not query.isdecimal() or not await db.kline.exists(
                 query_id := int(query)
@@ -316,21 +598,26 @@ class Server(BaseServer):
             klines_.append((query_id, kline.ts))
         elif type == "ip":
             if (ip := try_parse_ip(query)) is not None:
-                klines_ += await db.kline_kill.find_by_ip(ip, count)
-                klines_ += await db.kline_reject.find_by_ip(ip, count)
+                klines_ += await db.kline_kill.find_by_ip(ip, count, *before)
+                klines_ += await db.kline_reject.find_by_ip(ip, count, *before)
             elif (cidr := try_parse_cidr(query)) is not None:
-                klines_ += await db.kline_kill.find_by_cidr(cidr, count)
-                klines_ += await db.kline_reject.find_by_cidr(cidr, count)
+                klines_ += await db.kline_kill.find_by_cidr(cidr, count, *before)
+                klines_ += await db.kline_reject.find_by_cidr(cidr, count, *before)
             elif looks_like_glob(query):
-                klines_ += await db.kline_kill.find_by_ip_glob(query, count)
-                klines_ += await db.kline_reject.find_by_ip_glob(query, count)
+                klines_ += await db.kline_kill.find_by_ip_glob(query, count, *before)
+                klines_ += await db.kline_reject.find_by_ip_glob(
+                    query, count, *before
+                )
             else:
                 return [f"'{query}' does not look like an IP address"]
         else:
             return [f"unknown query type '{type}'"]
 
-        # sort by timestamp descending
-        klines = sorted(set(klines_), key=lambda k: k[1], reverse=True)
+        klines = list(dict.fromkeys((k[0], k[1]) for k in klines_))
+        if type not in RANKED:
+            # sort by timestamp descending, with id as a tie breaker so that
+            # continuation tokens are stable
+            klines.sort(key=lambda k: (k[1], k[0]), reverse=True)
         # apply output limit
         klines = klines[:count]
 
@@ -368,7 +655,11 @@ class Server(BaseServer):
             if len(masks) > MASK_MAX:
                 outs[-1] += f" (and {len(masks)-MASK_MAX} more)"
 
-        return outs or ["no results"]
+        if not outs:
+            return ["no results"]
+        elif len(klines) == count and not type == "id" and type not in RANKED:
+            outs.append(self._page(caller, "kcheck", type, query, count, klines[-1]))
+        return outs
 
     async def cmd_cliconn(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
         if len(args) < 2:
@@ -379,20 +670,37 @@ class Server(BaseServer):
             count = int(count_s)
 
         type, query, *_ = args
-        type = type.lower()
+        return await self._cliconn(caller, type.lower(), query, count)
+
+    async def _cliconn(
+        self,
+        caller: Caller,
+        type: str,
+        query: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[str]:
+
         db = self.database
         now = datetime.utcnow()
+        before = (before_ts, before_id)
 
         cliconns_: List[Tuple[int, datetime]] = []
         if type == "nick":
-            cliconns_ += await db.cliconn.find_by_nick(query, count)
-            cliconns_ += await db.nick_change.find_cliconn(query)
+            cliconns_ += await db.cliconn.find_by_nick(query, count, *before)
         elif type == "user":
-            cliconns_ += await db.cliconn.find_by_user(query, count)
+            cliconns_ += await db.cliconn.find_by_user(query, count, *before)
         elif type == "host":
-            cliconns_ += await db.cliconn.find_by_host(query, count)
+            cliconns_ += await db.cliconn.find_by_host(query, count, *before)
         elif type == "real":
-            cliconns_ += await db.cliconn.find_by_real(query, count)
+            cliconns_ += await db.cliconn.find_by_real(query, count, *before)
+        elif type == "short":
+            cliconns_ += await db.cliconn.find_short(
+                query, SHORT_SESSION, count, *before
+            )
+        elif type == "quit":
+            cliconns_ += await db.cliconn.find_by_quit(query, count, *before)
         elif type == "id":
             if not query.isdecimal() or not await db.cliconn.exists(
                 query_id := int(query)
@@ -405,11 +713,11 @@ class Server(BaseServer):
             cliconns_.append((query_id, cliconn.ts))
         elif type == "ip":
             if (ip := try_parse_ip(query)) is not None:
-                cliconns_ += await db.cliconn.find_by_ip(ip, count)
+                cliconns_ += await db.cliconn.find_by_ip(ip, count, *before)
             elif (cidr := try_parse_cidr(query)) is not None:
-                cliconns_ += await db.cliconn.find_by_cidr(cidr, count)
+                cliconns_ += await db.cliconn.find_by_cidr(cidr, count, *before)
             elif looks_like_glob(query):
-                cliconns_ += await db.cliconn.find_by_ip_glob(query, count)
+                cliconns_ += await db.cliconn.find_by_ip_glob(query, count, *before)
             else:
                 return [f"'{query}' does not look like an IP address"]
         else:
@@ -418,7 +726,11 @@ class Server(BaseServer):
         # cut out duplicates
         # the database code does this already, but we might compile from
         # multiple database calls
-        cliconns = sorted(set(cliconns_), key=lambda c: c[1], reverse=True)
+        cliconns = sorted(
+            {(c[0], c[1]) for c in cliconns_},
+            key=lambda c: (c[1], c[0]),
+            reverse=True,
+        )
         # apply output limit. database code also does this, but see above
         cliconns = cliconns[:count]
 
@@ -431,10 +743,160 @@ class Server(BaseServer):
             outs.append(
                 f"\x02{cts_human}\x02 ago -" f" {cliconn.nuh()} [{cliconn.realname}]"
             )
+            if cliconn.duration is not None:
+                duration_s = pretty_delta(timedelta(seconds=cliconn.duration))
+                outs[-1] += f" (lasted {duration_s}: {cliconn.quit_reason})"
             if nick_chg:
                 nick_chg_s = ", ".join(nick_chg)
                 outs.append(f"  nicks: {nick_chg_s}")
 
+        if not outs:
+            return ["no results"]
+        elif len(cliconns) == count and not type == "id":
+            outs.append(
+                self._page(caller, "cliconn", type, query, count, cliconns[-1])
+            )
+        return outs
+
+    async def cmd_regcheck(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
+        if len(args) < 2:
+            return ["please provide a type and query"]
+
+        count = 3
+        if len(args) > 2 and (count_s := args[2]).isdecimal():
+            count = int(count_s)
+
+        type, query, *_ = args
+        return await self._regcheck(caller, type.lower(), query, count)
+
+    async def _regcheck(
+        self,
+        caller: Caller,
+        type: str,
+        query: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[str]:
+
+        db = self.database
+        now = datetime.utcnow()
+        before = (before_ts, before_id)
+
+        regs: Sequence[Tuple[int, datetime]]
+        if type == "account":
+            regs = await db.registration.find_by_account(query, count, *before)
+        elif type == "nick":
+            regs = await db.registration.find_by_nick(query, count, *before)
+        elif type == "email":
+            regs = await db.registration.find_by_email(query, count, *before)
+        elif type == "domain":
+            regs = await db.registration.find_by_domain(query, count, *before)
+        elif type == "mx":
+            regs = await db.registration.find_by_mx(query, count, *before)
+        else:
+            return [f"unknown query type '{type}'"]
+
+        outs: List[str] = []
+        for reg_id, _ in regs:
+            reg = await db.registration.get(reg_id)
+            rts_human = pretty_delta(now - reg.ts)
+            if reg.dropped_at is not None:
+                verified_s = "\x0304dropped\x03"
+            elif reg.verified_at is None:
+                verified_s = "\x0304unverified\x03"
+            else:
+                verified_s = "\x0303verified\x03"
+
+            outs.append(
+                f"\x02{rts_human}\x02 ago - \x02{reg.account}\x02"
+                f" registered by {reg.nickname} to {reg.email} ({verified_s})"
+            )
+
+        if not outs:
+            return ["no results"]
+        elif len(regs) == count:
+            outs.append(self._page(caller, "regcheck", type, query, count, regs[-1]))
+        return outs
+
+    async def cmd_fcheck(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
+        if len(args) < 2:
+            return ["please provide a type and query"]
+
+        count = 3
+        if len(args) > 2 and (count_s := args[2]).isdecimal():
+            count = int(count_s)
+
+        type, query, *_ = args
+        return await self._fcheck(caller, type.lower(), query, count)
+
+    async def _fcheck(
+        self,
+        caller: Caller,
+        type: str,
+        query: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[str]:
+
+        db = self.database
+        now = datetime.utcnow()
+        before = (before_ts, before_id)
+
+        freezes: Sequence[Tuple[int, datetime]]
+        if type == "account":
+            freezes = await db.account_freeze.find_by_account(query, count, *before)
+        elif type == "soper":
+            freezes = await db.account_freeze.find_by_soper(query, count, *before)
+        elif type == "tag":
+            freezes = list(await db.freeze_tag.find_freezes(query, count, *before))
+        elif type == "reason":
+            freezes = await db.account_freeze.find_by_reason(query, count)
+        else:
+            return [f"unknown query type '{type}'"]
+
+        outs: List[str] = []
+        for freeze_id, _ in freezes:
+            freeze = await db.account_freeze.get(freeze_id)
+            fts_human = pretty_delta(now - freeze.ts)
+            outs.append(
+                f"\x02{fts_human}\x02 ago - \x02{freeze.account}\x02"
+                f" frozen by \x02{freeze.soper}\x02: {freeze.reason}"
+            )
+
+        if not outs:
+            return ["no results"]
+        elif len(freezes) == count and type not in RANKED:
+            outs.append(
+                self._page(caller, "fcheck", type, query, count, freezes[-1])
+            )
+        return outs
+
+    async def cmd_nshistory(
+        self, caller: Caller, args: Sequence[str]
+    ) -> Sequence[str]:
+
+        if not args:
+            return ["please provide an account"]
+
+        count = 10
+        if len(args) > 1 and (count_s := args[1]).isdecimal():
+            count = int(count_s)
+
+        now = datetime.utcnow()
+        outs: List[str] = []
+        for event in await self.database.nickserv_event.find_by_account(
+            args[0], count
+        ):
+            source = event.nickname
+            if event.source_account is not None:
+                source += f" ({event.source_account})"
+            ts_human = pretty_delta(now - event.ts)
+            outs.append(
+                f"\x02{ts_human}\x02 ago - {source} \x02{event.command}\x02:"
+                f" {event.args}"
+            )
         return outs or ["no results"]
 
     async def cmd_statsp(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
@@ -477,6 +939,173 @@ class Server(BaseServer):
         await db.preference.set(caller.oper, key, value)
         return [f"set {key} to {value}"]
 
+    async def cmd_resolvestats(
+        self, caller: Caller, args: Sequence[str]
+    ) -> Sequence[str]:
+
+        depth = self._nickserv.resolve_queue_depth
+        if (latency := self._nickserv.resolve_latency) is None:
+            latency_s = "no recent lookups"
+        else:
+            latency_s = f"{latency*1000:.0f}ms average"
+        return [f"email resolve queue: {depth} waiting, {latency_s}"]
+
+    async def cmd_connrate(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
+        if not args:
+            return ["please provide a server, IP or CIDR"]
+
+        now = datetime.utcnow()
+        start, end = now - timedelta(hours=1), now
+        if len(args) > 1:
+            if (duration := try_parse_duration(args[1])) is not None:
+                start = now - duration
+            elif (ts_range := try_parse_ts_range(args[1])) is not None:
+                start, end = ts_range
+            else:
+                return [f"'{args[1]}' isn't a duration, timestamp or range"]
+        start = start.replace(second=0, microsecond=0)
+
+        key = args[0]
+        db = self.database
+        if (ip := try_parse_ip(key)) is not None:
+            rows = await db.conn_rate.find_by_prefix(ip_prefix(ip), start, end)
+        elif (cidr := try_parse_cidr(key)) is not None:
+            # we only count down to a /24 or /64
+            if cidr.prefixlen > (PREFIX_V4 if cidr.version == 4 else PREFIX_V6):
+                cidr = ip_prefix(cidr.network_address)
+            rows = await db.conn_rate.find_by_prefix(cidr, start, end)
+        else:
+            rows = await db.conn_rate.find_by_server(key, start, end)
+
+        if not rows:
+            return [f"no connections from {key} in that time"]
+
+        minutes = max(1, int((end - start).total_seconds() // 60))
+        bucket = -(-minutes // CONNRATE_BARS)
+        counts = [0] * -(-minutes // bucket)
+        for ts, count in rows:
+            index = int((ts - start).total_seconds() // 60) // bucket
+            counts[min(index, len(counts) - 1)] += count
+
+        peak_ts, peak = max(rows, key=lambda r: r[1])
+        total = sum(count for _, count in rows)
+        return [
+            f"{key}: {total} connections"
+            f" {start:%Y-%m-%d %H:%M}..{end:%Y-%m-%d %H:%M},"
+            f" peak {peak}/min at {peak_ts:%Y-%m-%d %H:%M}",
+            f"{sparkline(counts)} ({bucket} min per bar, tallest {max(counts)})",
+        ]
+
+    async def cmd_top(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
+        heavy = self._snote.heavy
+        if not args or not (field := args[0].lower()) in heavy.fields:
+            return [f"please provide a field ({', '.join(heavy.fields)})"]
+
+        window = TOP_WINDOW
+        if len(args) > 1:
+            if (window_ := try_parse_duration(args[1])) is None:
+                return [f"'{args[1]}' isn't a duration"]
+            elif window_ > WINDOW_MAX:
+                return [f"can't look back further than {pretty_delta(WINDOW_MAX)}"]
+            window = window_
+
+        top = heavy.top(field, window, datetime.utcnow(), TOP_COUNT)
+        if not top:
+            return ["no recent connections"]
+
+        width = len(str(top[0][1]))
+        outs = [f"top {field} over the last {pretty_delta(window)}:"]
+        for key, count, error in top:
+            outs.append(f"  {str(count).rjust(width)} {key}")
+            if error:
+                # space-saving only ever overestimates
+                outs[-1] += f" (at least {count - error})"
+        return outs
+
+    async def cmd_watch(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
+        if not args:
+            return ["please provide a subcommand (add, del, list)"]
+
+        subcommand, *args = args
+        subcommand = subcommand.lower()
+        if subcommand == "add":
+            if len(args) < 2:
+                return ["please provide a type and pattern"]
+            type, pattern, *reason_ = args
+            type = type.lower()
+            if not type in WATCH_TYPES:
+                return [f"type must be one of {', '.join(sorted(WATCH_TYPES))}"]
+            elif type == "cidr" and try_parse_cidr(pattern) is None:
+                return [f"'{pattern}' does not look like a CIDR"]
+            elif len(pattern) > WATCH_PATTERNLEN:
+                return [f"patterns can't be longer than {WATCH_PATTERNLEN} characters"]
+
+            reason = " ".join(reason_) or "no reason"
+            if len(reason) > WATCH_REASONLEN:
+                return [f"reasons can't be longer than {WATCH_REASONLEN} characters"]
+            watch_id = await self.database.watch.add(
+                type, pattern, reason, caller.oper
+            )
+            await self._watch_reload()
+            return [f"added watch \2#{watch_id}\2 ({type} {pattern})"]
+
+        elif subcommand == "del":
+            if not args or not args[0].isdecimal():
+                return ["please provide a watch ID"]
+            elif not await self.database.watch.remove(watch_id := int(args[0])):
+                return [f"watch {watch_id} not found"]
+            await self._watch_reload()
+            return [f"removed watch {watch_id}"]
+
+        elif subcommand == "list":
+            watches = await self.database.watch.list_all()
+            if args:
+                watches = [w for w in watches if w.type == args[0].lower()]
+            if not watches:
+                return ["no watches"]
+
+            outs: List[str] = []
+            for watch in watches[:WATCH_LIST_MAX]:
+                outs.append(
+                    f"\2#{watch.id}\2: {watch.type} {watch.pattern}"
+                    f" by \2{watch.oper}\2: {watch.reason}"
+                )
+            if len(watches) > WATCH_LIST_MAX:
+                outs.append(f"(and {len(watches) - WATCH_LIST_MAX} more)")
+            return outs
+
+        else:
+            return [f"unknown subcommand '{subcommand}'"]
+
+    async def cmd_slowlog(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
+        slowlog = self.database.slowlog
+        slow = [] if slowlog is None else slowlog.recent()
+
+        if args and args[0].isdecimal():
+            # the plan for one slow query
+            index = int(args[0])
+            if not 0 < index <= len(slow):
+                return [f"no slow query #{index}"]
+
+            query = slow[index - 1]
+            outs = [query.query, f"  args: {', '.join(repr(a) for a in query.args)}"]
+            if query.plan is None:
+                outs.append("  no plan captured")
+            else:
+                outs += [f"  {line}" for line in query.plan]
+            return outs
+
+        now = datetime.utcnow()
+        outs = []
+        for index, query in enumerate(slow[:SLOWLOG_MAX], 1):
+            ts_human = pretty_delta(now - query.ts)
+            plan_s = " (plan)" if query.plan is not None else ""
+            outs.append(
+                f"\x02#{index}\x02 {ts_human} ago, {query.seconds:.3f}s{plan_s}:"
+                f" {query.query}"
+            )
+        return outs or ["no slow queries"]
+
     async def cmd_eval(self, caller: Caller, args: Sequence[str]) -> Sequence[str]:
         if len(args) == 0:
             return ["please provide a query"]
@@ -507,10 +1136,14 @@ class Server(BaseServer):
         return outs
 
     def line_preread(self, line: Line):
-        print(f"< {line.format()}")
+        if LOG_IRC.isEnabledFor(DEBUG):
+            LOG_IRC.debug(
+                "< %s", line.format(), extra={"snote": snote_category(line)}
+            )
 
     def line_presend(self, line: Line):
-        print(f"> {line.format()}")
+        if LOG_IRC.isEnabledFor(DEBUG):
+            LOG_IRC.debug("> %s", line.format())
 
 
 class Bot(BaseBot):
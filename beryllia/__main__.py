@@ -1,4 +1,4 @@
-import asyncio
+import asyncio, sys
 from argparse import ArgumentParser
 
 from ircrobots import ConnectionParams, SASLUserPass
@@ -6,6 +6,9 @@ from ircrobots import ConnectionParams, SASLUserPass
 from . import Bot
 from .config import Config, load as config_load
 from .cron import cron
+from .log import setup as log_setup
+from .metrics import serve as metrics_serve
+from .replay import replay
 
 
 async def main(config: Config):
@@ -24,6 +27,10 @@ async def main(config: Config):
         autojoin.append(config.log)
     params.autojoin = autojoin
 
+    if config.metrics is not None:
+        metrics_host, metrics_port = config.metrics
+        await metrics_serve(metrics_host, metrics_port)
+
     await bot.add_server("beryllia", params)
     await asyncio.wait([
         asyncio.create_task(cron(bot)),
@@ -31,9 +38,33 @@ async def main(config: Config):
     ])
 
 if __name__ == "__main__":
-    parser = ArgumentParser()
-    parser.add_argument("config")
-    args = parser.parse_args()
+    argv = sys.argv[1:]
+    replaying = argv[:1] == ["replay"]
+
+    if replaying:
+        parser = ArgumentParser(prog="beryllia replay")
+        parser.add_argument("config")
+        parser.add_argument("logfile", nargs="+")
+        args = parser.parse_args(argv[1:])
+    else:
+        parser = ArgumentParser(prog="beryllia")
+        parser.add_argument("config")
+        args = parser.parse_args(argv)
 
     config = config_load(args.config)
-    asyncio.run(main(config))
+    log_listener = log_setup(
+        config.log_level,
+        config.log_file,
+        config.log_max_bytes,
+        config.log_backups,
+        config.log_json,
+        config.log_sample,
+    )
+    try:
+        if replaying:
+            asyncio.run(replay(config, args.logfile))
+        else:
+            asyncio.run(main(config))
+    finally:
+        # flush anything still queued
+        log_listener.stop()
@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from os.path import expanduser
-from typing import Optional, Sequence, Tuple
+from typing import Dict, Optional, Sequence, Tuple
 
 import yaml
 
@@ -15,6 +15,7 @@ class Config(object):
     channels: Sequence[str]
     log: Optional[str]
     rejects: int
+    reconcile: int
 
     sasl: Tuple[str, str]
     oper: Tuple[str, str, str]
@@ -24,12 +25,56 @@ class Config(object):
     db_host: Optional[str]
     db_name: str
 
+    output_rate: float
+    output_burst: int
+
+    # (host, port) to serve prometheus metrics on
+    metrics: Optional[Tuple[str, int]]
+
+    log_level: str
+    log_file: Optional[str]
+    log_max_bytes: int
+    log_backups: int
+    log_json: bool
+    # snote category -> fraction of lines to log
+    log_sample: Dict[str, float]
+
+    # seconds
+    slow_threshold: float
+    # fraction of slow queries to EXPLAIN
+    slow_explain: float
+    slow_keep: int
+
 
 def load(filepath: str):
     with open(filepath) as file:
         config_yaml = yaml.safe_load(file.read())
 
     nickname = config_yaml["nickname"]
+    output = config_yaml.get("output", {})
+
+    metrics: Optional[Tuple[str, int]] = None
+    if "metrics" in config_yaml:
+        metrics_yaml = config_yaml["metrics"]
+        metrics = (metrics_yaml.get("host", "127.0.0.1"), metrics_yaml["port"])
+
+    logging_yaml = config_yaml.get("logging", {})
+    log_file: Optional[str] = None
+    if "file" in logging_yaml:
+        log_file = expanduser(logging_yaml["file"])
+
+    slow = config_yaml.get("slow_query", {})
+
+    output_rate = output.get("rate", 2.0)
+    output_burst = output.get("burst", 5)
+    if output_rate <= 0:
+        raise ValueError("output rate must be more than 0")
+    elif output_burst < 1:
+        raise ValueError("output burst must be at least 1")
+
+    reconcile = config_yaml.get("reconcile", 10)
+    if reconcile < 0:
+        raise ValueError("reconcile must be 0 (off) or more minutes")
 
     oper_name = config_yaml["oper"]["name"]
     oper_file = expanduser(config_yaml["oper"]["file"])
@@ -44,10 +89,23 @@ def load(filepath: str):
         config_yaml["channels"],
         config_yaml.get("log", None),
         config_yaml["rejects"],
+        reconcile,
         (config_yaml["sasl"]["username"], config_yaml["sasl"]["password"]),
         (oper_name, oper_file, oper_pass),
         config_yaml["database"]["user"],
         config_yaml["database"].get("pass", None),
         config_yaml["database"].get("host", None),
         config_yaml["database"]["name"],
+        output_rate,
+        output_burst,
+        metrics,
+        logging_yaml.get("level", "DEBUG"),
+        log_file,
+        logging_yaml.get("max_bytes", 10 * 1024 * 1024),
+        logging_yaml.get("backups", 5),
+        logging_yaml.get("json", False),
+        logging_yaml.get("sample", {}),
+        slow.get("threshold", 1.0),
+        slow.get("explain", 0.1),
+        slow.get("keep", 32),
     )
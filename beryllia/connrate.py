@@ -0,0 +1,57 @@
+from collections import Counter
+from datetime import datetime
+from ipaddress import ip_network, IPv4Address, IPv4Network, IPv6Address, IPv6Network
+from typing import Counter as TCounter
+from typing import Optional, Tuple, Union
+
+from .database.conn_rate import ConnRateTable
+
+# how wide a prefix we count connections per
+PREFIX_V4 = 24
+PREFIX_V6 = 64
+
+_TYPE_IP = Union[IPv4Address, IPv6Address]
+_TYPE_PREFIX = Union[IPv4Network, IPv6Network]
+
+
+def ip_prefix(ip: _TYPE_IP) -> _TYPE_PREFIX:
+    length = PREFIX_V4 if ip.version == 4 else PREFIX_V6
+    return ip_network(f"{ip}/{length}", strict=False)
+
+
+class ConnRate(object):
+    # per-minute connection counts, by server and by prefix, kept in memory
+    # between flushes to the database. flushes add to what's already there,
+    # so flushing part way through a minute is fine
+    def __init__(self):
+        self._servers: TCounter[Tuple[datetime, str]] = Counter()
+        self._prefixes: TCounter[Tuple[datetime, _TYPE_PREFIX]] = Counter()
+
+    def __len__(self) -> int:
+        return len(self._servers) + len(self._prefixes)
+
+    def clear(self) -> None:
+        self._servers.clear()
+        self._prefixes.clear()
+
+    def add(self, server: str, ip: Optional[_TYPE_IP], ts: datetime) -> None:
+        minute = ts.replace(second=0, microsecond=0)
+        self._servers[(minute, server)] += 1
+        if ip is not None:
+            self._prefixes[(minute, ip_prefix(ip))] += 1
+
+    async def flush(self, table: ConnRateTable) -> None:
+        # only forget counts once they're written, so that if writing fails
+        # they go out with the next flush instead
+        servers = dict(self._servers)
+        prefixes = dict(self._prefixes)
+        await table.add_many(
+            [(ts, server, n) for (ts, server), n in servers.items()],
+            [(ts, prefix, n) for (ts, prefix), n in prefixes.items()],
+        )
+
+        # anything counted while we were writing stays
+        self._servers.subtract(servers)
+        self._prefixes.subtract(prefixes)
+        self._servers = +self._servers
+        self._prefixes = +self._prefixes
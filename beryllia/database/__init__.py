@@ -2,6 +2,7 @@ import asyncpg
 from typing import Any, Optional, Sequence, Tuple
 
 from .cliconn import CliconnTable, CliexitTable
+from .conn_rate import ConnRateTable
 from .nick_change import NickChangeTable
 from .statsp import StatsPTable
 from .kline import KLineTable
@@ -10,12 +11,15 @@ from .kline_reject import KLineRejectTable
 from .kline_remove import KLineRemoveTable
 from .kline_tag import KLineTagTable
 from .preference import PreferenceTable
+from .watch import WatchTable
 
 from .registration import RegistrationTable
 from .email_resolve import EmailResolveTable
 from .account_freeze import AccountFreezeTable
 from .freeze_tag import FreezeTagTable
+from .nickserv_event import NickServEventTable
 
+from .common import SlowLog, TimedPool
 from ..normalise import SearchNormaliser
 
 
@@ -24,8 +28,9 @@ class DatabaseError(Exception):
 
 
 class Database(object):
-    def __init__(self, pool: asyncpg.Pool, normaliser: SearchNormaliser):
+    def __init__(self, pool: TimedPool, normaliser: SearchNormaliser):
         self._pool = pool
+        self.slowlog = pool.slowlog
 
         self.kline = KLineTable(pool, normaliser)
         self.kline_reject = KLineRejectTable(pool, normaliser)
@@ -34,13 +39,16 @@ class Database(object):
         self.kline_tag = KLineTagTable(pool, normaliser)
         self.cliconn = CliconnTable(pool, normaliser)
         self.cliexit = CliexitTable(pool, normaliser)
+        self.conn_rate = ConnRateTable(pool, normaliser)
         self.nick_change = NickChangeTable(pool, normaliser)
         self.statsp = StatsPTable(pool, normaliser)
         self.preference = PreferenceTable(pool, normaliser)
+        self.watch = WatchTable(pool, normaliser)
         self.registration = RegistrationTable(pool, normaliser)
         self.email_resolve = EmailResolveTable(pool, normaliser)
         self.account_freeze = AccountFreezeTable(pool, normaliser)
         self.freeze_tag = FreezeTagTable(pool, normaliser)
+        self.nickserv_event = NickServEventTable(pool, normaliser)
 
     @staticmethod
     async def connect(
@@ -49,12 +57,13 @@ class Database(object):
         hostname: Optional[str],
         db_name: str,
         normaliser: SearchNormaliser,
+        slowlog: Optional[SlowLog] = None,
     ):
 
         pool = await asyncpg.create_pool(
             user=username, password=password, host=hostname, database=db_name
         )
-        return Database(pool, normaliser)
+        return Database(TimedPool(pool, slowlog), normaliser)
 
     async def readonly_eval(self, query: str) -> Sequence[Tuple[Any, ...]]:
         async with self._pool.acquire() as conn, conn.transaction(readonly=True):
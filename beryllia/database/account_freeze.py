@@ -1,14 +1,110 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Optional, Sequence, Tuple
+
 from .common import Table
+from ..normalise import SearchType
+from ..util import glob_to_sql, lex_glob_pattern
+
+
+@dataclass
+class DBAccountFreeze(object):
+    account: str
+    soper: str
+    reason: str
+    ts: datetime
 
 
 class AccountFreezeTable(Table):
-    async def add(self, account: str, soper: str, reason: str) -> int:
+    async def add(
+        self, account: str, soper: str, reason: str, ts: Optional[datetime] = None
+    ) -> int:
 
         query = """
-            INSERT INTO account_freeze (account, soper, reason, ts)
-            VALUES ($1, $2, $3, NOW()::TIMESTAMP)
+            INSERT INTO account_freeze (account, search_acc, soper, reason, ts)
+            VALUES ($1, $2, $3, $4, COALESCE($5, NOW()::TIMESTAMP))
             RETURNING id
         """
+        args = [
+            account,
+            str(self.to_search(account, SearchType.NICK)),
+            soper,
+            reason,
+            ts,
+        ]
+
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(query, *args)
+
+    async def get(self, id: int) -> DBAccountFreeze:
+        query = """
+            SELECT account, soper, reason, ts
+            FROM account_freeze
+            WHERE id = $1
+        """
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(query, id)
+
+        return DBAccountFreeze(*row)
+
+    async def _find_freezes(
+        self,
+        where: str,
+        args: Sequence[Any],
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
 
+        where, args = self._keyset(where, args, before_ts, before_id)
+        query = f"""
+            SELECT id, ts
+            FROM account_freeze
+            {where}
+            ORDER BY ts DESC, id DESC
+            LIMIT {count}
+        """
+
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, *args)
+
+    async def find_by_account(
+        self,
+        account: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        pattern = glob_to_sql(lex_glob_pattern(account))
+        param = str(self.to_search(pattern, SearchType.NICK))
+        return await self._find_freezes(
+            "WHERE search_acc LIKE $1", [param], count, before_ts, before_id
+        )
+
+    async def find_by_soper(
+        self,
+        soper: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        return await self._find_freezes(
+            "WHERE soper = $1", [soper], count, before_ts, before_id
+        )
+
+    async def find_by_reason(
+        self, reason: str, count: int
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        # keywords, best match first, like `KLineTable.find_by_reason`
+        query = f"""
+            SELECT id, ts
+            FROM account_freeze, WEBSEARCH_TO_TSQUERY('english', $1) AS query
+            WHERE search_reason @@ query
+            ORDER BY TS_RANK(search_reason, query) DESC, ts DESC, id DESC
+            LIMIT {count}
+        """
         async with self.pool.acquire() as conn:
-            return await conn.fetchval(query, account, soper, reason)
+            return await conn.fetch(query, reason)
@@ -1,12 +1,16 @@
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from ipaddress import IPv4Address, IPv6Address
 from ipaddress import IPv4Network, IPv6Network
-from typing import Any, Optional, Sequence, Tuple, Union
+from typing import Any, List, Optional, Sequence, Tuple, Union
 
 from .common import NickUserHost, Table
 from ..normalise import SearchType
-from ..util import glob_to_sql, lex_glob_pattern
+from ..util import glob_to_sql, lex_glob_pattern, try_parse_cidr
+
+# how far back `CliexitTable.add` looks for a connection to attach an exit to,
+# when it doesn't know which one it is
+EXIT_GUESS = timedelta(days=1)
 
 
 @dataclass
@@ -19,6 +23,9 @@ class Cliconn(NickUserHost):
     ip: Optional[Union[IPv4Address, IPv6Address]]
     server: str
     ts: datetime
+    # seconds, once we've seen it exit
+    duration: Optional[int] = None
+    quit_reason: Optional[str] = None
 
     def nuh(self) -> str:
         return f"{self.nickname}!{self.username}@{self.hostname}"
@@ -27,7 +34,17 @@ class Cliconn(NickUserHost):
 class CliconnTable(Table):
     async def get(self, id: int) -> Cliconn:
         query = """
-            SELECT nickname, username, realname, hostname, account, ip, server, ts
+            SELECT
+                nickname,
+                username,
+                realname,
+                hostname,
+                account,
+                ip,
+                server,
+                ts,
+                duration,
+                quit_reason
             FROM cliconn
             WHERE id = $1
         """
@@ -103,14 +120,20 @@ class CliconnTable(Table):
             return await conn.fetchval(query, *args)
 
     async def _find_cliconns(
-        self, where: str, args: Sequence[Any], count: int
+        self,
+        where: str,
+        args: Sequence[Any],
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Sequence[Tuple[int, datetime]]:
 
+        where, args = self._keyset(where, args, before_ts, before_id)
         query = f"""
             SELECT id, ts
             FROM cliconn
             {where}
-            ORDER BY ts DESC
+            ORDER BY ts DESC, id DESC
             LIMIT {count}
         """
 
@@ -118,56 +141,181 @@ class CliconnTable(Table):
             return await conn.fetch(query, *args)
 
     async def find_by_nick(
-        self, nickname: str, count: int
+        self,
+        nickname: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Sequence[Tuple[int, datetime]]:
 
+        # connections that either started with, or later changed to, a
+        # matching nick. each half is limited on its own, and the nick change
+        # half is a semi-join so a connection that changed to several matching
+        # nicks only counts once towards that limit
         pattern = glob_to_sql(lex_glob_pattern(nickname))
         param = str(self.to_search(pattern, SearchType.NICK))
-        return await self._find_cliconns("WHERE search_nick LIKE $1", [param], count)
+        where_conn, args = self._keyset(
+            "WHERE cliconn.search_nick LIKE $1",
+            [param],
+            before_ts,
+            before_id,
+            "cliconn.ts",
+            "cliconn.id",
+        )
+        where_chg, _ = self._keyset(
+            """
+            WHERE EXISTS (
+                SELECT 1
+                FROM nick_change
+                WHERE nick_change.cliconn_id = cliconn.id
+                AND nick_change.search_nick LIKE $1
+            )
+            """,
+            [param],
+            before_ts,
+            before_id,
+            "cliconn.ts",
+            "cliconn.id",
+        )
+        query = f"""
+            SELECT id, ts FROM (
+                (
+                    SELECT cliconn.id, cliconn.ts
+                    FROM cliconn
+                    {where_conn}
+                    ORDER BY cliconn.ts DESC, cliconn.id DESC
+                    LIMIT {count}
+                )
+                UNION
+                (
+                    SELECT cliconn.id, cliconn.ts
+                    FROM cliconn
+                    {where_chg}
+                    ORDER BY cliconn.ts DESC, cliconn.id DESC
+                    LIMIT {count}
+                )
+            ) AS found
+            ORDER BY ts DESC, id DESC
+            LIMIT {count}
+        """
+
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, *args)
 
     async def find_by_user(
-        self, username: str, count: int
+        self,
+        username: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Sequence[Tuple[int, datetime]]:
 
         pattern = glob_to_sql(lex_glob_pattern(username))
         param = str(self.to_search(pattern, SearchType.USER))
-        return await self._find_cliconns("WHERE search_user LIKE $1", [param], count)
+        return await self._find_cliconns(
+            "WHERE search_user LIKE $1", [param], count, before_ts, before_id
+        )
 
     async def find_by_host(
-        self, hostname: str, count: int
+        self,
+        hostname: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Sequence[Tuple[int, datetime]]:
 
         pattern = glob_to_sql(lex_glob_pattern(hostname))
         param = str(self.to_search(pattern, SearchType.HOST))
-        return await self._find_cliconns("WHERE search_host LIKE $1", [param], count)
+        return await self._find_cliconns(
+            "WHERE search_host LIKE $1", [param], count, before_ts, before_id
+        )
 
     async def find_by_real(
-        self, realname: str, count: int
+        self,
+        realname: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Sequence[Tuple[int, datetime]]:
 
         pattern = glob_to_sql(lex_glob_pattern(realname))
         param = str(self.to_search(pattern, SearchType.REAL))
-        return await self._find_cliconns("WHERE search_real LIKE $1", [param], count)
+        return await self._find_cliconns(
+            "WHERE search_real LIKE $1", [param], count, before_ts, before_id
+        )
 
     async def find_by_ip(
-        self, ip: Union[IPv4Address, IPv6Address], count: int
+        self,
+        ip: Union[IPv4Address, IPv6Address],
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Sequence[Tuple[int, datetime]]:
 
-        return await self._find_cliconns("WHERE ip = $1", [ip], count)
+        return await self._find_cliconns(
+            "WHERE ip = $1", [ip], count, before_ts, before_id
+        )
 
     async def find_by_cidr(
-        self, cidr: Union[IPv4Network, IPv6Network], count: int
+        self,
+        cidr: Union[IPv4Network, IPv6Network],
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Sequence[Tuple[int, datetime]]:
 
-        return await self._find_cliconns("WHERE ip << $1", [cidr], count)
+        return await self._find_cliconns(
+            "WHERE ip <<= $1", [cidr], count, before_ts, before_id
+        )
 
     async def find_by_ip_glob(
-        self, glob: str, count: int
+        self,
+        glob: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Sequence[Tuple[int, datetime]]:
 
-        pattern = glob_to_sql(lex_glob_pattern(glob))
-        param = str(self.to_search(pattern, SearchType.HOST))
-        return await self._find_cliconns("WHERE TEXT(ip) LIKE $1", [param], count)
+        where, args = self._ip_glob(glob)
+        return await self._find_cliconns(where, args, count, before_ts, before_id)
+
+    async def find_short(
+        self,
+        mask: str,
+        duration: int,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        # connections, from an IP, CIDR or hostname glob, that didn't last
+        # `duration` seconds
+        args: List[Any] = []
+        if (cidr := try_parse_cidr(mask)) is not None:
+            where = "WHERE ip <<= $1"
+            args.append(cidr)
+        else:
+            pattern = glob_to_sql(lex_glob_pattern(mask))
+            where = "WHERE search_host LIKE $1"
+            args.append(str(self.to_search(pattern, SearchType.HOST)))
+
+        args.append(duration)
+        return await self._find_cliconns(
+            f"{where} AND duration < $2", args, count, before_ts, before_id
+        )
+
+    async def find_by_quit(
+        self,
+        reason: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        pattern = str(glob_to_sql(lex_glob_pattern(reason)))
+        return await self._find_cliconns(
+            "WHERE quit_reason LIKE $1", [pattern], count, before_ts, before_id
+        )
 
 
 class CliexitTable(Table):
@@ -180,24 +328,66 @@ class CliexitTable(Table):
         ip: Optional[Union[IPv4Address, IPv6Address]],
         reason: str,
         server: str,
+        ts: Optional[datetime] = None,
     ) -> int:
 
+        # if we don't know which connection this is (e.g. we've restarted since
+        # it connected), guess at the latest recent one that looks like it and
+        # hasn't exited yet. older than EXIT_GUESS is more likely a session we
+        # missed the exit of, so record the exit unattached instead. either
+        # way, close the session on the cliconn row
         query = """
-            INSERT INTO cliexit (
-                cliconn_id,
-                nickname,
-                search_nick,
-                username,
-                search_user,
-                hostname,
-                search_host,
-                ip,
-                reason,
-                server,
-                ts
+            WITH session AS (
+                SELECT COALESCE($1, (
+                    SELECT id
+                    FROM cliconn
+                    WHERE search_nick = $3
+                    AND search_user = $5
+                    AND search_host = $7
+                    AND exit_ts IS NULL
+                    AND ts > COALESCE($11, NOW()::TIMESTAMP) - $12::INTERVAL
+                    AND ts <= COALESCE($11, NOW()::TIMESTAMP)
+                    ORDER BY ts DESC
+                    LIMIT 1
+                )) AS id
+            ), exit AS (
+                INSERT INTO cliexit (
+                    cliconn_id,
+                    nickname,
+                    search_nick,
+                    username,
+                    search_user,
+                    hostname,
+                    search_host,
+                    ip,
+                    reason,
+                    server,
+                    ts
+                )
+                SELECT
+                    session.id,
+                    $2,
+                    $3,
+                    $4,
+                    $5,
+                    $6,
+                    $7,
+                    $8,
+                    $9,
+                    $10,
+                    COALESCE($11, NOW()::TIMESTAMP)
+                FROM session
+                RETURNING id, cliconn_id, reason, ts
+            ), closed AS (
+                UPDATE cliconn
+                SET
+                    exit_ts = exit.ts,
+                    duration = EXTRACT(EPOCH FROM exit.ts - cliconn.ts)::INTEGER,
+                    quit_reason = exit.reason
+                FROM exit
+                WHERE cliconn.id = exit.cliconn_id
             )
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, NOW()::TIMESTAMP)
-            RETURNING id
+            SELECT id FROM exit
         """
         args = [
             cliconn,
@@ -210,6 +400,8 @@ class CliexitTable(Table):
             ip,
             reason,
             server,
+            ts,
+            EXIT_GUESS,
         ]
         async with self.pool.acquire() as conn:
             return await conn.fetchval(query, *args)
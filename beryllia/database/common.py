@@ -1,9 +1,20 @@
+from collections import deque
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from typing import Union
+from datetime import datetime
+from functools import wraps
+from inspect import iscoroutinefunction
+from random import random
+from time import perf_counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Iterable, List
+from typing import Optional, Sequence, Tuple, Union
 
-from asyncpg import Pool
+from asyncpg import Connection, Pool
+from ..log import LOG
+from ..metrics import DB_ACQUIRE, DB_QUERY
 from ..normalise import SearchNormaliser, SearchType
 from ..util import CompositeString, CompositeStringText
+from ..util import glob_to_sql, ip_glob_to_cidr, lex_glob_pattern
 
 
 class NickUserHost:
@@ -12,11 +23,145 @@ class NickUserHost:
         raise NotImplementedError()
 
 
+@dataclass
+class SlowQuery(object):
+    query: str
+    args: Sequence[Any]
+    seconds: float
+    ts: datetime
+    plan: Optional[Sequence[str]]
+
+
+class SlowLog(object):
+    def __init__(self, threshold: float, explain: float, keep: int):
+        # seconds
+        self.threshold = threshold
+        # fraction of slow queries we EXPLAIN
+        self.explain = explain
+        self._queries: Deque[SlowQuery] = deque(maxlen=keep)
+
+    def add(self, query: SlowQuery) -> None:
+        self._queries.append(query)
+
+    def recent(self) -> Sequence[SlowQuery]:
+        # newest first
+        return list(reversed(self._queries))
+
+
+class _TimedConnection(object):
+    # times each statement, noting down the ones that are slow
+    def __init__(self, conn: Connection, slowlog: SlowLog):
+        self._conn = conn
+        self._slowlog = slowlog
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+
+    async def _timed(
+        self,
+        query: str,
+        args: Sequence[Any],
+        call: Awaitable[Any],
+        explain: bool = True,
+    ) -> Any:
+
+        start = perf_counter()
+        out = await call
+        seconds = perf_counter() - start
+        if seconds >= self._slowlog.threshold:
+            await self._slow(query, args, seconds, explain)
+        return out
+
+    async def _slow(
+        self, query: str, args: Sequence[Any], seconds: float, explain: bool
+    ) -> None:
+
+        query = " ".join(query.split())
+        LOG.warning("slow query (%.3fs): %s %r", seconds, query, args)
+
+        plan: Optional[Sequence[str]] = None
+        if explain and random() < self._slowlog.explain:
+            # not ANALYZE; we don't want to run it (maybe a write) twice. in a
+            # savepoint if we're in the caller's transaction, so that a failed
+            # EXPLAIN doesn't abort it
+            try:
+                async with self._conn.transaction():
+                    rows = await self._conn.fetch(f"EXPLAIN {query}", *args)
+            except Exception:
+                LOG.exception("failed to EXPLAIN slow query")
+            else:
+                plan = [row[0] for row in rows]
+
+        self._slowlog.add(SlowQuery(query, args, seconds, datetime.utcnow(), plan))
+
+    async def execute(self, query: str, *args: Any) -> Any:
+        return await self._timed(query, args, self._conn.execute(query, *args))
+
+    async def executemany(
+        self, query: str, args: Iterable[Sequence[Any]], **kwargs: Any
+    ) -> Any:
+
+        # far too many args to log, or to pick one set of to EXPLAIN
+        call = self._conn.executemany(query, args, **kwargs)
+        return await self._timed(query, (), call, explain=False)
+
+    async def copy_records_to_table(self, table_name: str, **kwargs: Any) -> Any:
+        call = self._conn.copy_records_to_table(table_name, **kwargs)
+        return await self._timed(f"COPY {table_name}", (), call, explain=False)
+
+    async def fetch(self, query: str, *args: Any) -> Any:
+        return await self._timed(query, args, self._conn.fetch(query, *args))
+
+    async def fetchrow(self, query: str, *args: Any) -> Any:
+        return await self._timed(query, args, self._conn.fetchrow(query, *args))
+
+    async def fetchval(self, query: str, *args: Any) -> Any:
+        return await self._timed(query, args, self._conn.fetchval(query, *args))
+
+
+class TimedPool(object):
+    # records how long we wait for a connection from an asyncpg pool, and how
+    # long each statement takes once we've got one
+    def __init__(self, pool: Pool, slowlog: Optional[SlowLog] = None):
+        self._pool = pool
+        self.slowlog = slowlog
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Connection]:
+        start = perf_counter()
+        async with self._pool.acquire() as conn:
+            DB_ACQUIRE.observe(perf_counter() - start)
+            if self.slowlog is None:
+                yield conn
+            else:
+                yield _TimedConnection(conn, self.slowlog)
+
+
+def _timed(
+    method: str, func: Callable[..., Awaitable[Any]]
+) -> Callable[..., Awaitable[Any]]:
+    @wraps(func)
+    async def _inner(self: Any, *args: Any, **kwargs: Any) -> Any:
+        # the table we were called on, not the one the method was defined on,
+        # which isn't the same for inherited methods
+        with DB_QUERY.time(table=type(self).__name__, method=method):
+            return await func(self, *args, **kwargs)
+
+    return _inner
+
+
 @dataclass
 class Table(object):
-    pool: Pool
+    pool: TimedPool
     normaliser: SearchNormaliser
 
+    def __init_subclass__(cls, **kwargs: Any):
+        super().__init_subclass__(**kwargs)
+        # time every public database call, by table and method
+        for name, func in list(vars(cls).items()):
+            if not name.startswith("_") and iscoroutinefunction(func):
+                setattr(cls, name, _timed(name, func))
+
     def to_search(
         self, input_: Union[str, CompositeString], type: SearchType
     ) -> CompositeString:
@@ -27,3 +172,44 @@ class Table(object):
             input = input_
 
         return self.normaliser.normalise(input, type)
+
+    def _ip_glob(self, glob: str) -> Tuple[str, List[Any]]:
+        # narrow an IP glob down to a CIDR where we can, so it's an index
+        # range scan, and only fall back to matching text for what's left
+        cidr, exact = ip_glob_to_cidr(glob)
+
+        args: List[Any] = []
+        where: List[str] = []
+        if cidr is not None:
+            args.append(cidr)
+            where.append(f"ip <<= ${len(args)}")
+        if not exact:
+            pattern = glob_to_sql(lex_glob_pattern(glob))
+            args.append(str(self.to_search(pattern, SearchType.HOST)))
+            where.append(f"TEXT(ip) LIKE ${len(args)}")
+        return "WHERE " + " AND ".join(where), args
+
+    def _keyset(
+        self,
+        where: str,
+        args: Sequence[Any],
+        before_ts: Optional[datetime],
+        before_id: Optional[int],
+        ts_column: str = "ts",
+        id_column: str = "id",
+    ) -> Tuple[str, List[Any]]:
+        # restrict a search to rows strictly older than a (ts, id) cursor, so
+        # that fetching the next page is an index seek rather than an OFFSET
+        args = list(args)
+        if before_ts is None or before_id is None:
+            return where, args
+
+        args += [before_ts, before_id]
+        clause = (
+            f"({ts_column}, {id_column})"
+            f" < (${len(args)-1}::TIMESTAMP, ${len(args)}::INTEGER)"
+        )
+        if where:
+            return f"{where} AND {clause}", args
+        else:
+            return f"WHERE {clause}", args
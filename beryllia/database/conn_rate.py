@@ -0,0 +1,72 @@
+from datetime import datetime
+from ipaddress import IPv4Network, IPv6Network
+from typing import Sequence, Tuple, Union
+
+from .common import Table
+
+_TYPE_PREFIX = Union[IPv4Network, IPv6Network]
+
+
+class ConnRateTable(Table):
+    async def add_many(
+        self,
+        servers: Sequence[Tuple[datetime, str, int]],
+        prefixes: Sequence[Tuple[datetime, _TYPE_PREFIX, int]],
+    ) -> None:
+
+        # both are sequences of (minute, key, count), added on to whatever
+        # counts those minutes already have
+        query = """
+            WITH servers AS (
+                INSERT INTO conn_rate_server (ts, server, count)
+                SELECT * FROM UNNEST($1::TIMESTAMP[], $2::VARCHAR[], $3::INTEGER[])
+                ON CONFLICT (server, ts) DO UPDATE
+                SET count = conn_rate_server.count + EXCLUDED.count
+            )
+            INSERT INTO conn_rate_prefix (ts, prefix, count)
+            SELECT * FROM UNNEST($4::TIMESTAMP[], $5::CIDR[], $6::INTEGER[])
+            ON CONFLICT (prefix, ts) DO UPDATE
+            SET count = conn_rate_prefix.count + EXCLUDED.count
+        """
+        args = [
+            [ts for ts, _, _ in servers],
+            [server for _, server, _ in servers],
+            [count for _, _, count in servers],
+            [ts for ts, _, _ in prefixes],
+            [prefix for _, prefix, _ in prefixes],
+            [count for _, _, count in prefixes],
+        ]
+        async with self.pool.acquire() as conn:
+            await conn.execute(query, *args)
+
+    async def find_by_server(
+        self, server: str, start: datetime, end: datetime
+    ) -> Sequence[Tuple[datetime, int]]:
+
+        query = """
+            SELECT ts, count
+            FROM conn_rate_server
+            WHERE server = $1
+            AND ts >= $2
+            AND ts < $3
+            ORDER BY ts
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, server, start, end)
+
+    async def find_by_prefix(
+        self, cidr: _TYPE_PREFIX, start: datetime, end: datetime
+    ) -> Sequence[Tuple[datetime, int]]:
+
+        # `cidr` can be wider than the prefixes we count, e.g. a /16
+        query = """
+            SELECT ts, SUM(count)::INTEGER
+            FROM conn_rate_prefix
+            WHERE prefix <<= $1
+            AND ts >= $2
+            AND ts < $3
+            GROUP BY ts
+            ORDER BY ts
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, cidr, start, end)
@@ -1,25 +1,38 @@
-from typing import Optional
+from typing import List, Optional, Sequence, Tuple
 
 from .common import Table
 
 
 class EmailResolveTable(Table):
-    async def add(
+    async def set(
         self,
         registration_id: int,
-        record_parent: Optional[int],
-        record_type: str,
-        record: str,
-    ) -> int:
+        records: Sequence[Tuple[Optional[int], str, str]],
+    ) -> None:
 
-        query = """
+        # `records` is a sequence of (record_parent, record_type, record),
+        # where record_parent is an index in to `records`. replaces anything a
+        # previous attempt got, all or nothing
+        delete = """
+            DELETE FROM email_resolve
+            WHERE registration_id = $1
+        """
+        insert = """
             INSERT INTO email_resolve
                 (registration_id, record_parent, record_type, record)
             VALUES ($1, $2, $3, $4)
             RETURNING id
         """
 
-        async with self.pool.acquire() as conn:
-            return await conn.fetchval(
-                query, registration_id, record_parent, record_type, record
-            )
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute(delete, registration_id)
+
+            record_ids: List[int] = []
+            for record_parent, record_type, record in records:
+                if record_parent is not None:
+                    record_parent = record_ids[record_parent]
+                record_ids.append(
+                    await conn.fetchval(
+                        insert, registration_id, record_parent, record_type, record
+                    )
+                )
@@ -1,18 +1,29 @@
+from datetime import datetime
+from typing import Collection, Optional, Tuple
+
 from .common import Table
 from ..normalise import SearchType
+from ..util import glob_to_sql, lex_glob_pattern
 
 
 class FreezeTagTable(Table):
-    async def add(self, freeze_id: int, tag: str, soper: str) -> None:
+    async def add(
+        self, freeze_id: int, tag: str, soper: str, ts: Optional[datetime] = None
+    ) -> None:
 
         query = """
             INSERT INTO freeze_tag (freeze_id, tag, search_tag, soper, ts)
-            VALUES ($1, $2, $3, $4, NOW()::TIMESTAMP)
+            VALUES ($1, $2, $3, $4, COALESCE($5, NOW()::TIMESTAMP))
         """
 
         async with self.pool.acquire() as conn:
             await conn.execute(
-                query, freeze_id, tag, str(self.to_search(tag, SearchType.TAG)), soper
+                query,
+                freeze_id,
+                tag,
+                str(self.to_search(tag, SearchType.TAG)),
+                soper,
+                ts,
             )
 
     async def exists(self, freeze_id: int, tag: str) -> bool:
@@ -28,3 +39,34 @@ class FreezeTagTable(Table):
                     query, freeze_id, str(self.to_search(tag, SearchType.TAG))
                 )
             )
+
+    async def find_freezes(
+        self,
+        tag: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Collection[Tuple[int, datetime]]:
+
+        pattern = glob_to_sql(lex_glob_pattern(tag))
+        param = str(self.to_search(pattern, SearchType.TAG))
+        where, args = self._keyset(
+            "WHERE freeze_tag.search_tag LIKE $1",
+            [param],
+            before_ts,
+            before_id,
+            "account_freeze.ts",
+            "account_freeze.id",
+        )
+        query = f"""
+            SELECT account_freeze.id, MIN(account_freeze.ts) AS freeze_ts
+                FROM freeze_tag
+            INNER JOIN account_freeze
+                ON freeze_tag.freeze_id = account_freeze.id
+            {where}
+            GROUP BY account_freeze.id
+            ORDER BY freeze_ts DESC, account_freeze.id DESC
+            LIMIT {count}
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, *args)
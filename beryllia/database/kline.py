@@ -41,77 +41,239 @@ class KLineTable(Table):
 
     async def list_active(self) -> Dict[str, int]:
         query = """
-            SELECT kline.mask, kline.id FROM kline
-
-            LEFT JOIN kline_remove
-            ON kline.id = kline_remove.kline_id
-
-            WHERE kline_remove.ts IS NULL
-            AND kline.expire > NOW()::TIMESTAMP
+            SELECT mask, id
+            FROM kline
+            WHERE NOT removed
+            AND NOT expired
+            AND expire > NOW()::TIMESTAMP
         """
         async with self.pool.acquire() as conn:
             return dict(await conn.fetch(query))
 
-    async def find_active(self, mask: str) -> Optional[int]:
+    async def list_expiring(self) -> Sequence[Tuple[int, datetime]]:
         query = """
-            SELECT kline.id FROM kline
+            SELECT id, expire
+            FROM kline
+            WHERE NOT expired
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query)
 
-            LEFT JOIN kline_remove
-            ON  kline.id = kline_remove.kline_id
-            AND kline_remove.ts IS NULL
+    async def set_expired(self, ids: Collection[int]) -> Sequence[int]:
+        # returns the IDs that weren't already marked as expired
+        query = """
+            UPDATE kline
+            SET expired = TRUE
+            WHERE id = ANY($1::INTEGER[])
+            AND NOT expired
+            RETURNING id
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(query, list(ids))
+        return [row[0] for row in rows]
 
-            WHERE kline.mask = $1
-            AND kline.expire > NOW()
+    async def set_expired_before(self, ts: datetime) -> int:
+        query = """
+            UPDATE kline
+            SET expired = TRUE
+            WHERE NOT expired
+            AND expire <= $1
+        """
+        async with self.pool.acquire() as conn:
+            result = await conn.execute(query, ts)
+        # "UPDATE <count>"
+        return int(result.split()[-1])
 
-            ORDER BY kline.ts DESC
+    async def find_active(
+        self, mask: str, now: Optional[datetime] = None
+    ) -> Optional[int]:
+
+        # `now` lets us ask what was active at some point in the past
+        query = """
+            SELECT id
+            FROM kline
+            WHERE mask = $1
+            AND NOT removed
+            AND NOT expired
+            AND expire > COALESCE($2, NOW()::TIMESTAMP)
+            ORDER BY ts DESC
             LIMIT 1
         """
         async with self.pool.acquire() as conn:
-            return await conn.fetchval(query, mask)
+            return await conn.fetchval(query, mask, now)
 
-    async def add(
-        self, source: str, oper: str, mask: str, duration: int, reason: str
-    ) -> int:
+    async def find_active_many(self, masks: Collection[str]) -> Dict[str, int]:
+        query = """
+            SELECT DISTINCT ON (mask) mask, id
+            FROM kline
+            WHERE mask = ANY($1::VARCHAR[])
+            AND NOT removed
+            AND NOT expired
+            AND expire > NOW()::TIMESTAMP
+            ORDER BY mask, ts DESC
+        """
+        async with self.pool.acquire() as conn:
+            return dict(await conn.fetch(query, list(masks)))
 
+    async def add_many(
+        self,
+        source: str,
+        oper: str,
+        klines: Sequence[Tuple[str, int, str, Optional[datetime]]],
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        # `klines` is a sequence of (mask, duration, reason, set at), where
+        # "set at" is now if it's None
         utcnow = datetime.utcnow()
         query = """
             INSERT INTO kline
             (mask, search_mask, source, oper, duration, reason, ts, expire)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-            RETURNING id
+            SELECT
+                mask,
+                search_mask,
+                $1,
+                $2,
+                duration,
+                reason,
+                COALESCE(ts, $3),
+                COALESCE(ts, $3) + MAKE_INTERVAL(secs => duration)
+            FROM UNNEST(
+                $4::VARCHAR[],
+                $5::VARCHAR[],
+                $6::INTEGER[],
+                $7::VARCHAR[],
+                $8::TIMESTAMP[]
+            ) AS k(mask, search_mask, duration, reason, ts)
+            RETURNING id, expire
         """
         args = [
+            source,
+            oper,
+            utcnow,
+            [mask for mask, _, _, _ in klines],
+            [str(self.to_search(mask, SearchType.MASK)) for mask, _, _, _ in klines],
+            [duration for _, duration, _, _ in klines],
+            [reason for _, _, reason, _ in klines],
+            [ts for _, _, _, ts in klines],
+        ]
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, *args)
+
+    async def add(
+        self,
+        source: str,
+        oper: str,
+        mask: str,
+        duration: int,
+        reason: str,
+        reject_max: int,
+        tags: Collection[str] = (),
+        ts: Optional[datetime] = None,
+    ) -> Tuple[int, DBKLine]:
+
+        # all in one statement: add the k-line and its tags, and if it's
+        # replacing a k-line that's still active, move that k-line's kills and
+        # rejects over to it. only up to `reject_max` rejects per hostname
+        # move, as we'd have stopped recording them there
+        utcnow = ts or datetime.utcnow()
+        kline = DBKLine(
             mask,
-            str(self.to_search(mask, SearchType.MASK)),
             source,
             oper,
             duration,
             reason,
             utcnow,
             utcnow + timedelta(seconds=duration),
+        )
+
+        search_tags = {str(self.to_search(tag, SearchType.TAG)): tag for tag in tags}
+        query = """
+            WITH old AS (
+                SELECT id
+                FROM kline
+                WHERE mask = $1
+                AND NOT removed
+                AND NOT expired
+                AND expire > $7
+                ORDER BY ts DESC
+                LIMIT 1
+            ), new AS (
+                INSERT INTO kline
+                (mask, search_mask, source, oper, duration, reason, ts, expire)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                RETURNING id
+            ), tags AS (
+                INSERT INTO kline_tag
+                (kline_id, tag, search_tag, source, oper, ts)
+                SELECT new.id, tag.tag, tag.search_tag, $3, $4, $7
+                FROM new, UNNEST($9::VARCHAR[], $10::VARCHAR[])
+                    AS tag(tag, search_tag)
+                ON CONFLICT DO NOTHING
+            ), kills AS (
+                UPDATE kline_kill
+                SET kline_id = new.id
+                FROM old, new
+                WHERE kline_kill.kline_id = old.id
+            ), rejects AS (
+                UPDATE kline_reject
+                SET kline_id = new.id
+                FROM new, (
+                    SELECT
+                        kline_reject.id,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY search_host ORDER BY ts, id
+                        ) AS n
+                    FROM kline_reject, old
+                    WHERE kline_reject.kline_id = old.id
+                ) AS ranked
+                WHERE kline_reject.id = ranked.id
+                AND ranked.n <= $11
+            )
+            SELECT id FROM new
+        """
+        args = [
+            mask,
+            str(self.to_search(mask, SearchType.MASK)),
+            source,
+            oper,
+            duration,
+            reason,
+            kline.ts,
+            kline.expire,
+            list(search_tags.values()),
+            list(search_tags.keys()),
+            reject_max,
         ]
         async with self.pool.acquire() as conn:
-            return await conn.fetchval(query, *args)
+            return await conn.fetchval(query, *args), kline
 
-    async def reject_hit(self, kline_id: int) -> None:
+    async def reject_hit(
+        self, kline_id: int, ts: Optional[datetime] = None
+    ) -> None:
         query = """
             UPDATE kline
-            SET last_reject = NOW()::TIMESTAMP
+            SET last_reject = COALESCE($2, NOW()::TIMESTAMP)
             WHERE id = $1
         """
 
         async with self.pool.acquire() as conn:
-            await conn.execute(query, kline_id)
+            await conn.execute(query, kline_id, ts)
 
     async def _find_klines(
-        self, where: str, args: Sequence[Any], count: int
+        self,
+        where: str,
+        args: Sequence[Any],
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
 
+        where, args = self._keyset(where, args, before_ts, before_id)
         query = f"""
             SELECT id, ts
             FROM kline
             {where}
-            ORDER BY ts DESC
+            ORDER BY ts DESC, id DESC
             LIMIT {count}
         """
 
@@ -120,37 +282,60 @@ class KLineTable(Table):
 
         return rows
 
-    async def find_last_by_oper(
-        self, oper: str, count: int
-    ) -> Collection[Tuple[int, datetime]]:
-        return await self._find_klines("WHERE oper = $1", [oper], count)
-
     async def find_by_ts(
-        self, ts: datetime, count: int, fudge: int = 1
+        self,
+        start: datetime,
+        end: datetime,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
 
-        where = """
-            WHERE ABS(
-                EXTRACT(
-                    EPOCH FROM (
-                        DATE_TRUNC('minute', ts) - $1
-                    )
-                )
-            ) / 60 <= $2
-        """
-        return await self._find_klines(where, [ts, fudge], count)
+        # [start, end), so it's a range scan on kline_ts
+        where = "WHERE ts >= $1 AND ts < $2"
+        return await self._find_klines(
+            where, [start, end], count, before_ts, before_id
+        )
 
     async def find_by_reason(
         self, reason: str, count: int
     ) -> Collection[Tuple[int, datetime]]:
 
+        # keywords, best match first. `reason` is websearch syntax, so
+        # `spam -botnet` and `"open proxy"` work
+        query = f"""
+            SELECT id, ts
+            FROM kline, WEBSEARCH_TO_TSQUERY('english', $1) AS query
+            WHERE search_reason @@ query
+            ORDER BY TS_RANK(search_reason, query) DESC, ts DESC, id DESC
+            LIMIT {count}
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, reason)
+
+    async def find_by_reason_glob(
+        self,
+        reason: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Collection[Tuple[int, datetime]]:
+
         pattern = str(glob_to_sql(lex_glob_pattern(reason)))
-        return await self._find_klines("WHERE reason LIKE $1", [pattern], count)
+        return await self._find_klines(
+            "WHERE reason LIKE $1", [pattern], count, before_ts, before_id
+        )
 
     async def find_by_mask_glob(
-        self, mask: str, count: int
+        self,
+        mask: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
 
         pattern = glob_to_sql(lex_glob_pattern(mask))
         param = str(self.to_search(pattern, SearchType.MASK))
-        return await self._find_klines("WHERE search_mask LIKE $1", [param], count)
+        return await self._find_klines(
+            "WHERE search_mask LIKE $1", [param], count, before_ts, before_id
+        )
@@ -31,6 +31,7 @@ class KLineKillTable(Table):
         username: str,
         hostname: str,
         ip: Optional[Union[IPv4Address, IPv6Address]],
+        ts: Optional[datetime] = None,
     ):
 
         query = """
@@ -45,7 +46,7 @@ class KLineKillTable(Table):
                 kline_id,
                 ts
             )
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, NOW()::timestamp)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, COALESCE($9, NOW()::TIMESTAMP))
         """
         args = [
             nickname,
@@ -56,14 +57,23 @@ class KLineKillTable(Table):
             str(self.to_search(hostname, SearchType.HOST)),
             ip,
             kline_id,
+            ts,
         ]
         async with self.pool.acquire() as conn:
             await conn.execute(query, *args)
 
     async def _find_klines(
-        self, where: str, args: Sequence[Any], count: int
+        self,
+        where: str,
+        args: Sequence[Any],
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
 
+        where, args = self._keyset(
+            where, args, before_ts, before_id, "kline.ts", "kline.id"
+        )
         query = f"""
             SELECT kline.id, MIN(kline.ts) AS kline_ts
                 FROM kline_kill
@@ -71,7 +81,7 @@ class KLineKillTable(Table):
                 ON kline_kill.kline_id = kline.id
             {where}
             GROUP BY kline.id
-            ORDER BY kline_ts DESC
+            ORDER BY kline_ts DESC, kline.id DESC
             LIMIT {count}
         """
 
@@ -81,40 +91,67 @@ class KLineKillTable(Table):
         return rows
 
     async def find_by_nick(
-        self, nickname: str, count: int
+        self,
+        nickname: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
 
         pattern = glob_to_sql(lex_glob_pattern(nickname))
         param = str(self.to_search(pattern, SearchType.NICK))
-        return await self._find_klines("WHERE search_nick LIKE $1", [param], count)
+        return await self._find_klines(
+            "WHERE search_nick LIKE $1", [param], count, before_ts, before_id
+        )
 
     async def find_by_host(
-        self, hostname: str, count: int
+        self,
+        hostname: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
 
         pattern = glob_to_sql(lex_glob_pattern(hostname))
         param = str(self.to_search(pattern, SearchType.HOST))
-        return await self._find_klines("WHERE search_host LIKE $1", [param], count)
+        return await self._find_klines(
+            "WHERE search_host LIKE $1", [param], count, before_ts, before_id
+        )
 
     async def find_by_ip(
-        self, ip: Union[IPv4Address, IPv6Address], count: int
+        self,
+        ip: Union[IPv4Address, IPv6Address],
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
 
-        return await self._find_klines("WHERE ip = $1", [ip], count)
+        return await self._find_klines(
+            "WHERE ip = $1", [ip], count, before_ts, before_id
+        )
 
     async def find_by_cidr(
-        self, cidr: Union[IPv4Network, IPv6Network], count: int
+        self,
+        cidr: Union[IPv4Network, IPv6Network],
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
 
-        return await self._find_klines("WHERE ip << $1", [cidr], count)
+        return await self._find_klines(
+            "WHERE ip <<= $1", [cidr], count, before_ts, before_id
+        )
 
     async def find_by_ip_glob(
-        self, glob: str, count: int
+        self,
+        glob: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
 
-        pattern = glob_to_sql(lex_glob_pattern(glob))
-        param = str(self.to_search(pattern, SearchType.HOST))
-        return await self._find_klines("WHERE TEXT(ip) LIKE $1", [param], count)
+        where, args = self._ip_glob(glob)
+        return await self._find_klines(where, args, count, before_ts, before_id)
 
     async def find_by_kline(self, kline_id: int) -> Collection[DBKLineKill]:
         query = """
@@ -128,12 +165,3 @@ class KLineKillTable(Table):
 
         return [DBKLineKill(*row) for row in rows]
 
-    async def set_kline(self, kill_id: int, kline_id: int):
-
-        query = """
-            UPDATE kline_kill
-            SET kline_id = $1
-            WHERE id = $2
-        """
-        async with self.pool.acquire() as conn:
-            await conn.execute(query, kline_id, kill_id)
@@ -18,6 +18,7 @@ class KLineRejectTable(KLineKillTable):
         username: str,
         hostname: str,
         ip: Optional[Union[IPv4Address, IPv6Address]],
+        ts: Optional[datetime] = None,
     ):
 
         query = """
@@ -32,7 +33,7 @@ class KLineRejectTable(KLineKillTable):
                 kline_id,
                 ts
             )
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, NOW()::timestamp)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, COALESCE($9, NOW()::TIMESTAMP))
         """
         args = [
             nickname,
@@ -43,6 +44,7 @@ class KLineRejectTable(KLineKillTable):
             str(self.to_search(hostname, SearchType.HOST)),
             ip,
             kline_id,
+            ts,
         ]
         async with self.pool.acquire() as conn:
             await conn.execute(query, *args)
@@ -72,9 +74,17 @@ class KLineRejectTable(KLineKillTable):
             return await conn.fetchval(query, *args)
 
     async def _find_klines(
-        self, where: str, args: Sequence[Any], count: int
+        self,
+        where: str,
+        args: Sequence[Any],
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
 
+        where, args = self._keyset(
+            where, args, before_ts, before_id, "kline.ts", "kline.id"
+        )
         query = f"""
             SELECT kline.id, MIN(kline.ts) AS kline_ts
                 FROM kline_reject
@@ -82,7 +92,7 @@ class KLineRejectTable(KLineKillTable):
                 ON kline_reject.kline_id = kline.id
             {where}
             GROUP BY kline.id
-            ORDER BY kline_ts DESC
+            ORDER BY kline_ts DESC, kline.id DESC
             LIMIT {count}
         """
 
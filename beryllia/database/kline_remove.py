@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import Collection, Optional
 
 from .common import Table
 
@@ -13,14 +13,50 @@ class DBKLineRemove(object):
 
 
 class KLineRemoveTable(Table):
-    async def add(self, id: int, source: Optional[str], oper: Optional[str]):
+    async def add(
+        self,
+        id: int,
+        source: Optional[str],
+        oper: Optional[str],
+        ts: Optional[datetime] = None,
+    ):
 
         query = """
-            INSERT INTO kline_remove (kline_id, source, oper, ts)
-            VALUES ($1, $2, $3, NOW()::TIMESTAMP)
+            WITH remove AS (
+                INSERT INTO kline_remove (kline_id, source, oper, ts)
+                VALUES ($1, $2, $3, COALESCE($4, NOW()::TIMESTAMP))
+                RETURNING kline_id
+            )
+            UPDATE kline
+            SET removed = TRUE
+            FROM remove
+            WHERE kline.id = remove.kline_id
         """
         async with self.pool.acquire() as conn:
-            await conn.execute(query, id, source, oper)
+            await conn.execute(query, id, source, oper, ts)
+
+    async def add_many(
+        self,
+        ids: Collection[int],
+        source: Optional[str],
+        oper: Optional[str],
+        ts: Optional[datetime] = None,
+    ) -> None:
+
+        query = """
+            WITH remove AS (
+                INSERT INTO kline_remove (kline_id, source, oper, ts)
+                SELECT UNNEST($1::INTEGER[]), $2, $3, COALESCE($4, NOW()::TIMESTAMP)
+                ON CONFLICT (kline_id) DO NOTHING
+                RETURNING kline_id
+            )
+            UPDATE kline
+            SET removed = TRUE
+            FROM remove
+            WHERE kline.id = remove.kline_id
+        """
+        async with self.pool.acquire() as conn:
+            await conn.execute(query, list(ids), source, oper, ts)
 
     async def get(self, id: int) -> Optional[DBKLineRemove]:
         query = """
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Collection, Tuple
+from typing import Any, Collection, List, Optional, Sequence, Tuple
 
 from .common import Table
 from ..normalise import SearchType
@@ -7,21 +7,102 @@ from ..util import glob_to_sql, lex_glob_pattern
 
 
 class KLineTagTable(Table):
-    async def add(self, kline_id: int, tag: str, source: str, oper: str):
-        query = """
-            INSERT INTO kline_tag
-                (kline_id, tag, search_tag, source, oper, ts)
-            VALUES ($1, $2, $3, $4, $5, NOW()::TIMESTAMP)
+    async def _add_select(
+        self,
+        select: str,
+        args: Sequence[Any],
+        tag: str,
+        source: str,
+        oper: str,
+        ts: Optional[datetime],
+    ) -> Tuple[int, int]:
+
+        # `select` picks the k-line IDs to tag. returns how many it picked and
+        # how many of those weren't already tagged
+        n = len(args)
+        query = f"""
+            WITH target AS (
+                {select}
+            ), tagged AS (
+                INSERT INTO kline_tag
+                    (kline_id, tag, search_tag, source, oper, ts)
+                SELECT
+                    target.id,
+                    ${n + 1},
+                    ${n + 2},
+                    ${n + 3},
+                    ${n + 4},
+                    COALESCE(${n + 5}, NOW()::TIMESTAMP)
+                FROM target
+                ON CONFLICT DO NOTHING
+                RETURNING kline_id
+            )
+            SELECT
+                (SELECT COUNT(*) FROM target),
+                (SELECT COUNT(*) FROM tagged)
         """
         async with self.pool.acquire() as conn:
-            await conn.execute(
+            row = await conn.fetchrow(
                 query,
-                kline_id,
+                *args,
                 tag,
                 str(self.to_search(tag, SearchType.TAG)),
                 source,
                 oper,
+                ts,
             )
+        return row[0], row[1]
+
+    async def add_many(
+        self,
+        kline_ids: Collection[int],
+        tag: str,
+        source: str,
+        oper: str,
+        ts: Optional[datetime] = None,
+    ) -> Tuple[int, int]:
+
+        select = """
+            SELECT id
+            FROM kline
+            WHERE id = ANY($1::INTEGER[])
+        """
+        return await self._add_select(
+            select, [list(kline_ids)], tag, source, oper, ts
+        )
+
+    async def add_last(
+        self,
+        kline_oper: str,
+        count: int,
+        tag: str,
+        source: str,
+        oper: str,
+        since: Optional[datetime] = None,
+        mask: Optional[str] = None,
+        ts: Optional[datetime] = None,
+    ) -> Tuple[int, int]:
+
+        # the last `count` k-lines `kline_oper` set, optionally only those
+        # set after `since` and/or matching the `mask` glob
+        where = ["oper = $1"]
+        args: List[Any] = [kline_oper]
+        if since is not None:
+            args.append(since)
+            where.append(f"ts >= ${len(args)}")
+        if mask is not None:
+            pattern = glob_to_sql(lex_glob_pattern(mask))
+            args.append(str(self.to_search(pattern, SearchType.MASK)))
+            where.append(f"search_mask LIKE ${len(args)}")
+
+        select = f"""
+            SELECT id
+            FROM kline
+            WHERE {" AND ".join(where)}
+            ORDER BY ts DESC, id DESC
+            LIMIT {count}
+        """
+        return await self._add_select(select, args, tag, source, oper, ts)
 
     async def remove(self, kline_id: int, tag: str):
         query = """
@@ -49,22 +130,35 @@ class KLineTagTable(Table):
             )
 
     async def find_klines(
-        self, tag: str, count: int
+        self,
+        tag: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
     ) -> Collection[Tuple[int, datetime]]:
-        query = """
+
+        pattern = glob_to_sql(lex_glob_pattern(tag))
+        param = str(self.to_search(pattern, SearchType.TAG))
+        where, args = self._keyset(
+            "WHERE kline_tag.search_tag LIKE $1",
+            [param],
+            before_ts,
+            before_id,
+            "kline.ts",
+            "kline.id",
+        )
+        query = f"""
             SELECT kline.id, MIN(kline.ts) AS kline_ts
                 FROM kline_tag
             INNER JOIN kline
                 ON kline_tag.kline_id = kline.id
-            WHERE kline_tag.search_tag LIKE $1
+            {where}
             GROUP BY kline.id
-            ORDER BY kline_ts DESC
-            LIMIT $2
+            ORDER BY kline_ts DESC, kline.id DESC
+            LIMIT {count}
         """
-        pattern = glob_to_sql(lex_glob_pattern(tag))
-        param = str(self.to_search(pattern, SearchType.TAG))
         async with self.pool.acquire() as conn:
-            return await conn.fetch(query, param, count)
+            return await conn.fetch(query, *args)
 
     async def find_tags(self, kline_id: int) -> Collection[str]:
         query = """
@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Sequence
+
+from .common import Table
+from ..normalise import SearchType
+
+
+@dataclass
+class NickServEvent(object):
+    command: str
+    nickname: str
+    # only when it's different to nickname
+    source_account: Optional[str]
+    # the account that was acted upon
+    account: str
+    args: str
+    ts: datetime
+
+
+class NickServEventTable(Table):
+    async def add_many(self, events: Sequence[NickServEvent]) -> None:
+        records = [
+            (
+                event.command,
+                event.nickname,
+                event.source_account,
+                event.account,
+                str(self.to_search(event.account, SearchType.NICK)),
+                event.args,
+                event.ts,
+            )
+            for event in events
+        ]
+        columns = [
+            "command",
+            "nickname",
+            "source_acc",
+            "account",
+            "search_acc",
+            "args",
+            "ts",
+        ]
+
+        async with self.pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                "nickserv_event", records=records, columns=columns
+            )
+
+    async def find_by_account(
+        self, account: str, count: int
+    ) -> Sequence[NickServEvent]:
+
+        query = """
+            SELECT command, nickname, source_acc, account, args, ts
+            FROM nickserv_event
+            WHERE search_acc = $1
+            ORDER BY ts DESC
+            LIMIT $2
+        """
+
+        search_acc = str(self.to_search(account, SearchType.NICK))
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(query, search_acc, count)
+        return [NickServEvent(*row) for row in rows]
@@ -1,9 +1,38 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Optional, Sequence, Tuple
+
 from .common import Table
 from ..normalise import SearchType
+from ..util import CompositeString, CompositeStringText
+from ..util import glob_to_sql, lex_glob_pattern
+
+
+@dataclass
+class DBRegistration(object):
+    nickname: str
+    account: str
+    email: str
+    ts: datetime
+    verified_at: Optional[datetime]
+    dropped_at: Optional[datetime]
 
 
 class RegistrationTable(Table):
-    async def add(self, nickname: str, account: str, email: str) -> int:
+    async def get(self, id: int) -> DBRegistration:
+        query = """
+            SELECT nickname, account, email, ts, verified_at, dropped_at
+            FROM registration
+            WHERE id = $1
+        """
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(query, id)
+
+        return DBRegistration(*row)
+
+    async def add(
+        self, nickname: str, account: str, email: str, ts: Optional[datetime] = None
+    ) -> int:
 
         query = """
             INSERT INTO registration (
@@ -15,7 +44,7 @@ class RegistrationTable(Table):
                 search_email,
                 ts
             )
-            VALUES ($1, $2, $3, $4, $5, $6, NOW()::TIMESTAMP)
+            VALUES ($1, $2, $3, $4, $5, $6, COALESCE($7, NOW()::TIMESTAMP))
             RETURNING id
         """
         args = [
@@ -25,17 +54,176 @@ class RegistrationTable(Table):
             str(self.to_search(account, SearchType.NICK)),
             email,
             str(self.to_search(email, SearchType.EMAIL)),
+            ts,
         ]
 
         async with self.pool.acquire() as conn:
             return await conn.fetchval(query, *args)
 
-    async def verify(self, id: int) -> None:
+    async def verify(self, id: int, ts: Optional[datetime] = None) -> None:
         query = """
             UPDATE registration
-            SET verified_at = NOW()::TIMESTAMP
+            SET verified_at = COALESCE($2, NOW()::TIMESTAMP)
             WHERE id = $1
         """
 
         async with self.pool.acquire() as conn:
-            await conn.execute(query, id)
+            await conn.execute(query, id, ts)
+
+    async def find_unverified(self, account: str, since: datetime) -> Optional[int]:
+        query = """
+            SELECT id
+            FROM registration
+            WHERE search_acc = $1
+            AND verified_at IS NULL
+            AND dropped_at IS NULL
+            AND ts >= $2
+            ORDER BY ts DESC
+            LIMIT 1
+        """
+
+        search_acc = str(self.to_search(account, SearchType.NICK))
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(query, search_acc, since)
+
+    async def drop(self, account: str, ts: Optional[datetime] = None) -> None:
+        query = """
+            UPDATE registration
+            SET dropped_at = COALESCE($2, NOW()::TIMESTAMP)
+            WHERE search_acc = $1
+            AND dropped_at IS NULL
+        """
+
+        search_acc = str(self.to_search(account, SearchType.NICK))
+        async with self.pool.acquire() as conn:
+            await conn.execute(query, search_acc, ts)
+
+    async def rename(self, id: int, account: str) -> None:
+        query = """
+            UPDATE registration
+            SET account = $2, search_acc = $3
+            WHERE id = $1
+        """
+
+        search_acc = str(self.to_search(account, SearchType.NICK))
+        async with self.pool.acquire() as conn:
+            await conn.execute(query, id, account, search_acc)
+
+    async def _find_registrations(
+        self,
+        where: str,
+        args: Sequence[Any],
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        where, args = self._keyset(where, args, before_ts, before_id)
+        query = f"""
+            SELECT id, ts
+            FROM registration
+            {where}
+            ORDER BY ts DESC, id DESC
+            LIMIT {count}
+        """
+
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, *args)
+
+    async def find_by_account(
+        self,
+        account: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        pattern = glob_to_sql(lex_glob_pattern(account))
+        param = str(self.to_search(pattern, SearchType.NICK))
+        return await self._find_registrations(
+            "WHERE search_acc LIKE $1", [param], count, before_ts, before_id
+        )
+
+    async def find_by_nick(
+        self,
+        nickname: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        pattern = glob_to_sql(lex_glob_pattern(nickname))
+        param = str(self.to_search(pattern, SearchType.NICK))
+        return await self._find_registrations(
+            "WHERE search_nick LIKE $1", [param], count, before_ts, before_id
+        )
+
+    async def find_by_email(
+        self,
+        email: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        pattern = glob_to_sql(lex_glob_pattern(email))
+        param = str(self.to_search(pattern, SearchType.EMAIL))
+        return await self._find_registrations(
+            "WHERE search_email LIKE $1", [param], count, before_ts, before_id
+        )
+
+    async def find_by_domain(
+        self,
+        domain: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        # "moc.elpmaxe@%", so that a domain search is a prefix search on the
+        # reversed email, which registration_email_domain indexes
+        reverse = "".join(reversed(f"@{domain}"))
+        pattern = glob_to_sql(CompositeString(CompositeStringText(c) for c in reverse))
+        param = str(self.to_search(pattern, SearchType.EMAIL)) + "%"
+        return await self._find_registrations(
+            "WHERE REVERSE(search_email) LIKE $1",
+            [param],
+            count,
+            before_ts,
+            before_id,
+        )
+
+    async def find_by_mx(
+        self,
+        mx: str,
+        count: int,
+        before_ts: Optional[datetime] = None,
+        before_id: Optional[int] = None,
+    ) -> Sequence[Tuple[int, datetime]]:
+
+        # registrations whose email domain has a matching MX record
+        pattern = glob_to_sql(lex_glob_pattern(mx))
+        param = str(self.to_search(pattern, SearchType.HOST))
+        where, args = self._keyset(
+            """
+            WHERE email_resolve.record_type = 'MX'
+            AND LOWER(email_resolve.record) LIKE $1
+            """,
+            [param],
+            before_ts,
+            before_id,
+            "registration.ts",
+            "registration.id",
+        )
+        query = f"""
+            SELECT DISTINCT registration.id, registration.ts
+            FROM email_resolve
+            INNER JOIN registration
+                ON registration.id = email_resolve.registration_id
+            {where}
+            ORDER BY registration.ts DESC, registration.id DESC
+            LIMIT {count}
+        """
+
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(query, *args)
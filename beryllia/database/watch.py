@@ -0,0 +1,53 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Sequence
+
+from .common import Table
+
+
+@dataclass
+class DBWatch(object):
+    id: int
+    type: str
+    pattern: str
+    reason: str
+    oper: str
+    ts: datetime
+
+
+class WatchTable(Table):
+    async def add(
+        self,
+        type: str,
+        pattern: str,
+        reason: str,
+        oper: str,
+        ts: Optional[datetime] = None,
+    ) -> int:
+
+        query = """
+            INSERT INTO watch (type, pattern, reason, oper, ts)
+            VALUES ($1, $2, $3, $4, COALESCE($5, NOW()::TIMESTAMP))
+            RETURNING id
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(query, type, pattern, reason, oper, ts)
+
+    async def remove(self, id: int) -> bool:
+        query = """
+            DELETE FROM watch
+            WHERE id = $1
+            RETURNING id
+        """
+        async with self.pool.acquire() as conn:
+            return bool(await conn.fetchval(query, id))
+
+    async def list_all(self) -> Sequence[DBWatch]:
+        query = """
+            SELECT id, type, pattern, reason, oper, ts
+            FROM watch
+            ORDER BY id
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(query)
+        return [DBWatch(*row) for row in rows]
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime
+from heapq import heappop, heappush
+from typing import Awaitable, Callable, List, Tuple
+
+from .database import Database
+from .log import LOG
+
+# seconds to wait before trying again after a database error
+RETRY = 10.0
+
+_TYPE_LISTENER = Callable[[int], Awaitable[None]]
+
+
+class KLineExpiry(object):
+    def __init__(self, database: Database):
+        self._database = database
+        self._wake = asyncio.Event()
+        self._listeners: List[_TYPE_LISTENER] = []
+
+        # (expire, kline_id), soonest first
+        self._heap: List[Tuple[datetime, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def add_listener(self, listener: _TYPE_LISTENER) -> None:
+        self._listeners.append(listener)
+
+    def push(self, kline_id: int, expire: datetime) -> None:
+        soonest = self._heap[0] if self._heap else None
+        heappush(self._heap, (expire, kline_id))
+        if soonest is None or (expire, kline_id) < soonest:
+            # we're sleeping until something later than this
+            self._wake.set()
+
+    async def _expire(self, now: datetime) -> None:
+        due: List[Tuple[datetime, int]] = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heappop(self._heap))
+
+        try:
+            expired = await self._database.kline.set_expired([i for _, i in due])
+        except Exception:
+            # put them back to try again
+            for item in due:
+                heappush(self._heap, item)
+            raise
+
+        for kline_id in expired:
+            for listener in self._listeners:
+                try:
+                    await listener(kline_id)
+                except Exception:
+                    LOG.exception("k-line %d expiry listener failed", kline_id)
+
+    async def _load(self) -> None:
+        # k-lines that expired while we weren't running (or that were
+        # replayed from old logs) are long gone, so don't announce them
+        await self._database.kline.set_expired_before(datetime.utcnow())
+        for kline_id, expire in await self._database.kline.list_expiring():
+            heappush(self._heap, (expire, kline_id))
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self._load()
+            except Exception:
+                LOG.exception("failed to load expiring k-lines")
+                await asyncio.sleep(RETRY)
+            else:
+                break
+
+        while True:
+            self._wake.clear()
+            if not self._heap:
+                await self._wake.wait()
+                continue
+
+            expire, _ = self._heap[0]
+            now = datetime.utcnow()
+            if expire > now:
+                try:
+                    await asyncio.wait_for(
+                        self._wake.wait(), (expire - now).total_seconds()
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._expire(now)
+            except Exception:
+                LOG.exception("failed to expire k-lines")
+                await asyncio.sleep(RETRY)
@@ -0,0 +1,111 @@
+import json, logging, sys, time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
+from random import random
+from typing import Dict, Optional
+
+from irctokens import Line
+
+LOG = logging.getLogger("beryllia")
+# raw IRC traffic, at DEBUG
+LOG_IRC = logging.getLogger("beryllia.irc")
+
+# high volume server notice categories that can be sampled, by how the notice
+# text starts
+SNOTE_CATEGORIES = {
+    "cliconn": "*** Notice -- Client connecting:",
+    "cliexit": "*** Notice -- Client exiting:",
+    "nickchg": "*** Notice -- Nick change:",
+    "klinerej": "*** Notice -- Rejecting K-Lined user",
+}
+
+
+def snote_category(line: Line) -> Optional[str]:
+    if (
+        line.command == "NOTICE"
+        and len(line.params) > 1
+        and line.params[0] == "*"
+        and line.source is not None
+        and not "!" in line.source
+    ):
+        for category, start in SNOTE_CATEGORIES.items():
+            if line.params[1].startswith(start):
+                return category
+    return None
+
+
+class SnoteSampler(logging.Filter):
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # category -> fraction of lines to keep
+        self._rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, "snote", None)
+        if category is None or not category in self._rates:
+            return True
+        return random() < self._rates[category]
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if (category := getattr(record, "snote", None)) is not None:
+            out["snote"] = category
+        if record.exc_info:
+            out["exception"] = self.formatException(record.exc_info)
+        return json.dumps(out)
+
+
+class _QueueHandler(QueueHandler):
+    # the stock QueueHandler formats records before queueing them, which would
+    # be on the event loop. our queue never leaves this process, so pass
+    # records as they are and let the listener's thread format them. that
+    # means log args mustn't be changed after logging them
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup(
+    level: str,
+    file: Optional[str],
+    max_bytes: int,
+    backups: int,
+    json_format: bool,
+    sample: Dict[str, float],
+) -> QueueListener:
+
+    handler: logging.Handler
+    if file is not None:
+        handler = RotatingFileHandler(file, maxBytes=max_bytes, backupCount=backups)
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+
+    formatter: logging.Formatter
+    if json_format:
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+    # UTC, like everything else, and so that logs can be replayed
+    formatter.converter = time.gmtime
+    handler.setFormatter(formatter)
+
+    # the event loop only puts records on a queue; a background thread does
+    # the formatting and the (possibly slow) writing
+    queue: "SimpleQueue[logging.LogRecord]" = SimpleQueue()
+    queue_handler = _QueueHandler(queue)
+    # sample before queueing, so dropped lines cost as little as possible
+    queue_handler.addFilter(SnoteSampler(sample))
+
+    LOG.setLevel(level.upper())
+    LOG.addHandler(queue_handler)
+    LOG.propagate = False
+
+    listener = QueueListener(queue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
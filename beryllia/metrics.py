@@ -0,0 +1,216 @@
+import asyncio
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+_TYPE_LABELS = Tuple[Tuple[str, str], ...]
+
+# seconds
+BUCKETS_DEFAULT = [
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+]
+
+
+def _labels(labels: Dict[str, str]) -> _TYPE_LABELS:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: _TYPE_LABELS) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f"{{{inner}}}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric(object):
+    type = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+
+    def samples(self) -> Iterator[Tuple[str, _TYPE_LABELS, float]]:
+        raise NotImplementedError()
+
+    def render(self) -> List[str]:
+        outs = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            outs.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return outs
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[_TYPE_LABELS, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[Tuple[str, _TYPE_LABELS, float]]:
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._functions: Dict[_TYPE_LABELS, Callable[[], float]] = {}
+
+    def set_function(self, function: Callable[[], float], **labels: str) -> None:
+        # read at scrape time, so hot paths don't pay for keeping it current
+        self._functions[_labels(labels)] = function
+
+    def samples(self) -> Iterator[Tuple[str, _TYPE_LABELS, float]]:
+        for labels, function in self._functions.items():
+            yield self.name, labels, function()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        super().__init__(name, help)
+        self._buckets = list(buckets) + [float("inf")]
+        # labels -> (per-bucket counts, sum)
+        self._values: Dict[_TYPE_LABELS, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels(labels)
+        if not key in self._values:
+            self._values[key] = ([0] * len(self._buckets), [0.0])
+
+        counts, total = self._values[key]
+        counts[bisect_left(self._buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def count(self) -> int:
+        # observations across every label set
+        return sum(sum(counts) for counts, _ in self._values.values())
+
+    def samples(self) -> Iterator[Tuple[str, _TYPE_LABELS, float]]:
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bucket, count in zip(self._buckets, counts):
+                cumulative += count
+                le = (("le", _format_value(bucket)),)
+                yield f"{self.name}_bucket", labels + le, cumulative
+            yield f"{self.name}_sum", labels, total[0]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        metric = Gauge(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, buckets: Sequence[float] = BUCKETS_DEFAULT
+    ) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        outs: List[str] = []
+        for metric in self._metrics:
+            outs += metric.render()
+        return "\n".join(outs) + "\n"
+
+
+REGISTRY = Registry()
+
+SNOTES = REGISTRY.counter(
+    "beryllia_snotes_total", "server notices handled, by handler"
+)
+SNOTE_MATCH = REGISTRY.histogram(
+    "beryllia_snote_match_seconds",
+    "time spent matching a server notice against handler patterns",
+)
+DB_QUERY = REGISTRY.histogram(
+    "beryllia_db_query_seconds", "database call latency, by table method"
+)
+DB_ACQUIRE = REGISTRY.histogram(
+    "beryllia_db_acquire_seconds", "time spent waiting for a pooled connection"
+)
+COMMAND = REGISTRY.histogram(
+    "beryllia_command_seconds", "oper command latency, by command"
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "beryllia_queue_depth", "items waiting in internal queues, by queue"
+)
+MAP_SIZE = REGISTRY.gauge(
+    "beryllia_map_size", "entries in in-memory state maps, by map"
+)
+
+
+async def _handle_http(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+
+    try:
+        # we serve the same thing whatever the path, so just drain the request
+        while not (await reader.readline()).strip() == b"":
+            pass
+
+        body = REGISTRY.render().encode("utf8")
+        writer.write(
+            b"HTTP/1.0 200 OK\r\n"
+            b"Content-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: %d\r\n"
+            b"\r\n" % len(body)
+        )
+        writer.write(body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> asyncio.AbstractServer:
+    return await asyncio.start_server(_handle_http, host, port)
@@ -0,0 +1,126 @@
+from asyncio import Event, sleep
+from collections import deque, OrderedDict
+from time import monotonic
+from typing import Awaitable, Callable, Deque, List, Optional, Sequence
+from typing import OrderedDict as TOrderedDict
+
+from irctokens import Line
+
+from .log import LOG
+
+# lower number is sent first
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+PRIORITIES = [PRIORITY_HIGH, PRIORITY_LOW]
+
+# 512 bytes, less "\r\n"
+LINE_MAX = 510
+PACK_SEPARATOR = " | "
+
+
+def _len(s: str) -> int:
+    return len(s.encode("utf8"))
+
+
+def pack_lines(lines: Sequence[str], budget: int) -> List[str]:
+    # join short lines together, up to `budget` bytes, so we spend fewer
+    # messages (and fewer tokens) on small lines
+    outs: List[str] = []
+    for line in lines:
+        if outs and (
+            _len(outs[-1]) + _len(PACK_SEPARATOR) + _len(line.lstrip()) <= budget
+        ):
+            outs[-1] += PACK_SEPARATOR + line.lstrip()
+        else:
+            outs.append(line)
+    return outs
+
+
+class TokenBucket(object):
+    def __init__(self, rate: float, burst: int):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = monotonic()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._tokens = min(
+            float(self._burst), self._tokens + (now - self._last) * self._rate
+        )
+        self._last = now
+
+    def delay(self) -> float:
+        # how long until we've got a whole token to spend
+        self._refill()
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+    def take(self) -> None:
+        self._tokens -= 1
+
+
+class OutputQueue(object):
+    def __init__(
+        self, send: Callable[[Line], Awaitable[None]], rate: float, burst: int
+    ):
+        self._send = send
+        self._bucket = TokenBucket(rate, burst)
+        self._wake = Event()
+
+        # priority -> target -> lines. targets are served round-robin within a
+        # priority, so one target's huge output doesn't starve another target
+        self._queues: List[TOrderedDict[str, Deque[Line]]] = [
+            OrderedDict() for _ in PRIORITIES
+        ]
+
+    def __len__(self) -> int:
+        return sum(len(l) for q in self._queues for l in q.values())
+
+    def queue(self, line: Line, priority: int = PRIORITY_HIGH) -> None:
+        queues = self._queues[priority]
+        target = line.params[0]
+        if not target in queues:
+            queues[target] = deque()
+
+        queues[target].append(line)
+        self._wake.set()
+
+    def _next(self) -> Optional[Line]:
+        for queues in self._queues:
+            if not queues:
+                continue
+
+            target, lines = next(iter(queues.items()))
+            line = lines.popleft()
+            # move this target to the back of the line
+            del queues[target]
+            if lines:
+                queues[target] = lines
+            return line
+        return None
+
+    async def run(self) -> None:
+        while True:
+            if not len(self):
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            # wait for a token *before* picking a line, so anything higher
+            # priority that's queued while we're waiting goes first
+            if (delay := self._bucket.delay()) > 0:
+                await sleep(delay)
+                continue
+
+            line = self._next()
+            if line is None:
+                continue
+
+            self._bucket.take()
+            try:
+                await self._send(line)
+            except Exception:
+                # e.g. we're mid-reconnect. drop the line rather than the queue
+                LOG.exception("failed to send queued line: %s", line.format())
@@ -1,7 +1,18 @@
 from re import compile as re_compile
+from typing import List
+
 from irctokens import Line
 
 RE_EMBEDDEDTAG = re_compile(r"%(\S+)")
+TAGLEN = 32
+
+
+def embedded_tags(reason: str) -> List[str]:
+    # a silly tag in a reason shouldn't cost us the k-line, so skip any that
+    # are too long to store
+    return [
+        tag for m in RE_EMBEDDEDTAG.finditer(reason) if len(tag := m.group(1)) <= TAGLEN
+    ]
 
 
 class IRCParser:
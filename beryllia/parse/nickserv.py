@@ -1,11 +1,18 @@
-from re import compile as re_compile, search as re_search
-from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+from re import compile as re_compile
+from time import monotonic
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Match, Optional
+from typing import Pattern, Tuple
 
 from irctokens import Line
 
 from .common import IRCParser, RE_EMBEDDEDTAG
 from ..database import Database
-from ..util import recursive_mx_resolve
+from ..database.nickserv_event import NickServEvent
+from ..log import LOG
+from ..util import LRUCache, recursive_mx_resolve
 
 RE_COMMAND = re_compile(
     r"^(?P<nickname>\S+)"
@@ -16,23 +23,167 @@ RE_COMMAND = re_compile(
     r"( (?P<args>.*))?$"
 )
 
-_TYPE_HANDLER = Callable[[Any, str, Optional[str], str], Awaitable[None]]
-_HANDLERS: Dict[str, _TYPE_HANDLER] = {}
-
-
-def _handler(command: str) -> Callable[[_TYPE_HANDLER], _TYPE_HANDLER]:
+# how many registration IDs we keep in memory, and how long an unverified
+# registration can wait for a VERIFY before we stop caring
+REGISTRATION_CACHE = 1024
+REGISTRATION_MAX_AGE = timedelta(days=1)
+
+RESOLVE_WORKERS = 4
+RESOLVE_ATTEMPTS = 3
+# seconds, doubled for each retry
+RESOLVE_BACKOFF = 30.0
+# how many recent DNS walks we average latency over
+RESOLVE_LATENCY_SAMPLES = 100
+
+# how many NickServ events we buffer before writing them out, and how often,
+# in seconds, we write them out regardless
+EVENT_BATCH = 32
+EVENT_FLUSH = 5.0
+# nickserv_event column lengths. one over-long value would fail the COPY for
+# its whole batch, so we truncate before buffering
+EVENT_COMMAND_MAX = 32
+EVENT_NICK_MAX = 16
+EVENT_ARGS_MAX = 512
+
+_TYPE_HANDLER = Callable[[Any, str, Optional[str], Match], Awaitable[None]]
+# command -> (args pattern, handler). commands without a handler are only
+# recorded in the nickserv_event table
+_HANDLERS: Dict[str, Tuple[Pattern, Optional[_TYPE_HANDLER]]] = {}
+
+
+def _handler(command: str, pattern: str) -> Callable[[_TYPE_HANDLER], _TYPE_HANDLER]:
     def _inner(func: _TYPE_HANDLER) -> _TYPE_HANDLER:
-        _HANDLERS[command] = func
+        _HANDLERS[command] = (re_compile(pattern), func)
         return func
 
     return _inner
 
 
+def _event(command: str, pattern: str) -> None:
+    _HANDLERS[command] = (re_compile(pattern), None)
+
+
+_event("GROUP", r"^(?P<nick>\S+) to (?P<account>\S+)$")
+_event("UNGROUP", r"^(?P<nick>\S+)$")
+_event("SET:EMAIL", r"^(?P<account>\S+) \((?P<old_email>\S+) -> (?P<email>\S+)\)")
+_event("FREEZE:OFF", r"^(?P<account>\S+)$")
+_event("VHOST:ASSIGN", r"^(?P<vhost>\S+) to (?P<account>\S+)$")
+_event("VHOST:REMOVE", r"^(?P<account>\S+)$")
+
+
 class NickServParser(IRCParser):
-    def __init__(self, database: Database):
+    def __init__(
+        self,
+        database: Database,
+        resolve: bool = True,
+        clock: Callable[[], datetime] = datetime.utcnow,
+    ):
         super().__init__()
         self._database = database
-        self._registration_ids: Dict[str, int] = {}
+        # whether to resolve registration email domains
+        self._resolve = resolve
+        # when replaying old messages, "now" is when the message was sent
+        self._clock = clock
+        self._registration_ids: LRUCache[str, int] = LRUCache(
+            REGISTRATION_CACHE, REGISTRATION_MAX_AGE
+        )
+
+        # (registration id, email, attempt)
+        self._resolve_queue: "asyncio.Queue[Tuple[int, str, int]]" = asyncio.Queue()
+        self._resolve_latency: Deque[float] = deque(maxlen=RESOLVE_LATENCY_SAMPLES)
+
+        self._events: List[NickServEvent] = []
+
+    def snapshot(self) -> LRUCache[str, int]:
+        # our in-memory state, to put back with `restore` if the database
+        # writes it came from are rolled back
+        return self._registration_ids.copy()
+
+    def restore(self, state: LRUCache[str, int]) -> None:
+        self._registration_ids = state
+
+    @property
+    def registration_ids_size(self) -> int:
+        return len(self._registration_ids)
+
+    @property
+    def events_waiting(self) -> int:
+        return len(self._events)
+
+    @property
+    def resolve_queue_depth(self) -> int:
+        return self._resolve_queue.qsize()
+
+    @property
+    def resolve_latency(self) -> Optional[float]:
+        # mean seconds per recursive DNS walk, over recent walks
+        if not self._resolve_latency:
+            return None
+        return sum(self._resolve_latency) / len(self._resolve_latency)
+
+    async def run(self) -> None:
+        await asyncio.gather(
+            self._event_flusher(),
+            *(self._resolve_worker() for _ in range(RESOLVE_WORKERS)),
+        )
+
+    async def _event_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(EVENT_FLUSH)
+            try:
+                await self.flush_events()
+            except Exception:
+                # they're kept for the next flush
+                LOG.exception("failed to write NickServ events")
+
+    async def flush_events(self) -> None:
+        if not self._events:
+            return
+
+        events, self._events = self._events, []
+        try:
+            await self._database.nickserv_event.add_many(events)
+        except Exception:
+            # put them back, ahead of anything buffered while we were writing
+            self._events[:0] = events
+            raise
+
+    def discard_events(self) -> None:
+        self._events.clear()
+
+    async def _resolve_worker(self) -> None:
+        while True:
+            registration_id, email, attempt = await self._resolve_queue.get()
+            try:
+                complete = await self._resolve_email(registration_id, email)
+            except Exception:
+                # DNS failures don't raise, so this is something asking again
+                # won't fix
+                LOG.exception("failed to save resolved email %d", registration_id)
+                complete = True
+            finally:
+                self._resolve_queue.task_done()
+
+            if not complete and attempt < RESOLVE_ATTEMPTS:
+                # a DNS timeout or SERVFAIL; try again later
+                asyncio.get_running_loop().call_later(
+                    RESOLVE_BACKOFF * 2 ** (attempt - 1),
+                    self._resolve_queue.put_nowait,
+                    (registration_id, email, attempt + 1),
+                )
+
+    async def _registration_id(self, account: str) -> Optional[int]:
+        if (registration_id := self._registration_ids.get(account)) is not None:
+            return registration_id
+
+        # not in memory, maybe because we've restarted since the REGISTER
+        since = self._clock() - REGISTRATION_MAX_AGE
+        registration_id = await self._database.registration.find_unverified(
+            account, since
+        )
+        if registration_id is not None:
+            self._registration_ids.set(account, registration_id)
+        return registration_id
 
     async def handle(self, line: Line) -> None:
         message = line.params[1]
@@ -44,103 +195,119 @@ class NickServParser(IRCParser):
         if not command in _HANDLERS:
             return
 
+        pattern, func = _HANDLERS[command]
+        args = match.group("args") or ""
+        args_match = pattern.search(args)
         nickname = match.group("nickname")
         account = match.group("account")
-        args = match.group("args")
 
-        func = _HANDLERS[command]
-        await func(self, nickname, account, args)
+        # args we can't parse are still recorded, just against whoever did it
+        target = account or nickname
+        if args_match is not None:
+            target = args_match.groupdict().get("account") or target
+
+        self._events.append(
+            NickServEvent(
+                command[:EVENT_COMMAND_MAX],
+                nickname[:EVENT_NICK_MAX],
+                account and account[:EVENT_NICK_MAX],
+                target[:EVENT_NICK_MAX],
+                args[:EVENT_ARGS_MAX],
+                self._clock(),
+            )
+        )
+
+        if func is not None and args_match is not None:
+            await func(self, nickname, account, args_match)
 
-    async def _resolve_email(self, registration_id: int, email: str) -> None:
+        if len(self._events) >= EVENT_BATCH:
+            await self.flush_events()
+
+    async def _resolve_email(self, registration_id: int, email: str) -> bool:
+        # returns False if we should try again later
         email_parts = email.split("@", 1)
         if not len(email_parts) == 2:
             # log a warning?
-            return
+            return True
 
         _, email_domain = email_parts
-        resolved = await recursive_mx_resolve(email_domain)
+        start = monotonic()
+        resolved, complete = await recursive_mx_resolve(email_domain)
+        self._resolve_latency.append(monotonic() - start)
 
-        resolved_ids: List[int] = []
-        for record_parent, record_type, record in resolved:
-            if record_parent is not None:
-                record_parent = resolved_ids[record_parent]
+        # save what we got even if it's incomplete, in case this is our last
+        # attempt. a later attempt replaces it
+        await self._database.email_resolve.set(registration_id, resolved)
+        return complete
 
-            record_id = await self._database.email_resolve.add(
-                registration_id, record_parent, record_type, record
-            )
-            resolved_ids.append(record_id)
-
-    @_handler("REGISTER")
+    @_handler("REGISTER", r"^(?P<account>\S+) to (?P<email>\S+)$")
     async def _handle_REGISTER(
-        self, nickname: str, _account: Optional[str], args: str
+        self, nickname: str, _account: Optional[str], match: Match
     ) -> None:
 
-        match = re_search("^(?P<account>\S+) to (?P<email>\S+)$", args)
-        if match is None:
-            return
-
         account = match.group("account")
         email = match.group("email")
 
         registration_id = await self._database.registration.add(
-            nickname, account, email
+            nickname, account, email, self._clock()
         )
-        self._registration_ids[account] = registration_id
+        self._registration_ids.set(account, registration_id)
 
-        await self._resolve_email(registration_id, email)
+        if self._resolve:
+            # resolving can take a while, don't hold up parsing other messages
+            self._resolve_queue.put_nowait((registration_id, email, 1))
 
-    @_handler("DROP")
+    @_handler("DROP", r"^(?P<account>\S+)$")
     async def _handle_DROP(
-        self, nickname: str, account: Optional[str], args: str
+        self, nickname: str, account: Optional[str], match: Match
     ) -> None:
 
-        if not args in self._registration_ids:
-            return
-
-        del self._registration_ids[args]
+        account = match.group("account")
+        self._registration_ids.pop(account)
+        # so `_registration_id` can't find it in the database either
+        await self._database.registration.drop(account, self._clock())
 
-    @_handler("SET:ACCOUNTNAME")
+    @_handler("SET:ACCOUNTNAME", r"^(?P<new_account>\S+)$")
     async def _handle_SET_ACCOUNTNAME(
-        self, nickname: str, account: Optional[str], args: str
+        self, nickname: str, account: Optional[str], match: Match
     ) -> None:
 
-        if not account in self._registration_ids:
+        # account is only given when it's different to nickname
+        account = account or nickname
+        if (registration_id := await self._registration_id(account)) is None:
             return
 
-        registration_id = self._registration_ids.pop(account)
-        self._registration_ids[args] = registration_id
+        new_account = match.group("new_account")
+        self._registration_ids.pop(account)
+        self._registration_ids.set(new_account, registration_id)
+        await self._database.registration.rename(registration_id, new_account)
 
-    @_handler("VERIFY:REGISTER")
+    @_handler("VERIFY:REGISTER", r"^(?P<account>\S+) ")
     async def _handle_VERIFY_REGISTER(
-        self, nickname: str, _account: Optional[str], args: str
+        self, nickname: str, _account: Optional[str], match: Match
     ) -> None:
 
-        match = re_search(r"^(?P<account>\S+) ", args)
-        if match is None:
-            return
-
         account = match.group("account")
-        if not account in self._registration_ids:
+        if (registration_id := await self._registration_id(account)) is None:
             return
 
-        registration_id = self._registration_ids[account]
-        await self._database.registration.verify(registration_id)
+        self._registration_ids.pop(account)
+        await self._database.registration.verify(registration_id, self._clock())
 
-    @_handler("FREEZE:ON")
+    @_handler("FREEZE:ON", r"(?P<account>\S+) \(reason: (?P<reason>.*)\)$")
     async def _handle_FREEZE_ON(
-        self, soper: str, soper_account: Optional[str], args: str
+        self, soper: str, soper_account: Optional[str], match: Match
     ) -> None:
 
-        match = re_search(r"(?P<account>\S+) \(reason: (?P<reason>.*)\)$", args)
-        if match is None:
-            return
-
         soper = soper_account or soper
 
         account = match.group("account")
         reason = match.group("reason")
 
-        freeze_id = await self._database.account_freeze.add(account, soper, reason)
+        now = self._clock()
+        freeze_id = await self._database.account_freeze.add(
+            account, soper, reason, now
+        )
 
         tags = list(RE_EMBEDDEDTAG.finditer(reason))
         for tag_match in tags:
@@ -148,4 +315,4 @@ class NickServParser(IRCParser):
             if await self._database.freeze_tag.exists(freeze_id, tag):
                 continue
 
-            await self._database.freeze_tag.add(freeze_id, tag, soper)
+            await self._database.freeze_tag.add(freeze_id, tag, soper, now)
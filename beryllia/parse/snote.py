@@ -1,6 +1,7 @@
 from datetime import datetime
 from ipaddress import ip_address, IPv4Address, IPv6Address
 from re import compile as re_compile, X as re_X
+from time import perf_counter
 from typing import (
     Any,
     Awaitable,
@@ -10,17 +11,28 @@ from typing import (
     Match,
     Optional,
     Pattern,
+    Sequence,
     Tuple,
     Union,
 )
 
 from irctokens import Line
 
-from .common import IRCParser, RE_EMBEDDEDTAG
+from .common import embedded_tags, IRCParser
+from ..connrate import ConnRate, ip_prefix
+from ..sketch import HeavyHitters
+from ..watch import Watchlist
 from ..database import Database
 from ..database.cliconn import Cliconn
+from ..database.kline import DBKLine
+from ..database.watch import DBWatch
+from ..metrics import SNOTE_MATCH, SNOTES
+
+RE_DIGITS = re_compile(r"\d+")
 
 _TYPE_HANDLER = Callable[[Any, str, Match], Awaitable[None]]
+# (nick -> cliconn, nick -> k-line mask they're waiting to exit with)
+_TYPE_STATE = Tuple[Dict[str, Tuple[int, Cliconn]], Dict[str, str]]
 _HANDLERS: List[Tuple[Pattern, _TYPE_HANDLER]] = []
 
 
@@ -37,27 +49,79 @@ class SnoteParser(IRCParser):
         self,
         database: Database,
         kline_reject_max: int,
-        kline_new: Callable[[int], Awaitable[None]],
+        kline_new: Callable[[int, DBKLine], Awaitable[None]],
+        clock: Callable[[], datetime] = datetime.utcnow,
+        watch_hit: Optional[
+            Callable[[int, Cliconn, Sequence[DBWatch]], Awaitable[None]]
+        ] = None,
     ):
         super().__init__()
 
         self._database = database
         self._kline_reject_max = kline_reject_max
         self._kline_new = kline_new
+        # when replaying old snotes, "now" is when the snote was sent
+        self._clock = clock
+        self._watch_hit = watch_hit
 
         self._cliconns: Dict[str, Tuple[int, Cliconn]] = {}
         self._kline_waiting_exit: Dict[str, str] = {}
+        # drained to the database every minute
+        self.conn_rate = ConnRate()
+        # what's dominating recent connection attempts, for `!top`
+        self.heavy = HeavyHitters(["host", "ip", "real", "user"])
+        # replaced whenever watches are added or removed
+        self.watchlist = Watchlist([])
+
+    def snapshot(self) -> _TYPE_STATE:
+        # our in-memory state, to put back with `restore` if the database
+        # writes it came from are rolled back
+        return dict(self._cliconns), dict(self._kline_waiting_exit)
+
+    def restore(self, state: _TYPE_STATE) -> None:
+        self._cliconns, self._kline_waiting_exit = state
+
+    @property
+    def cliconns_size(self) -> int:
+        return len(self._cliconns)
+
+    @property
+    def kline_waiting_exit_size(self) -> int:
+        return len(self._kline_waiting_exit)
+
+    def _heavy_add(
+        self,
+        ts: datetime,
+        username: str,
+        hostname: str,
+        ip: Optional[Union[IPv4Address, IPv6Address]],
+        realname: Optional[str] = None,
+    ) -> None:
+
+        # digits collapsed, so "~abc123" and "~abc456" count as one ident
+        values = {"host": hostname, "user": RE_DIGITS.sub("*", username)}
+        if ip is not None:
+            values["ip"] = str(ip_prefix(ip))
+        if realname is not None:
+            values["real"] = realname
+        self.heavy.add(ts, values)
 
     async def handle(self, line: Line) -> None:
         message = line.params[1]
 
+        start = perf_counter()
         for pattern, func in _HANDLERS:
             match = pattern.search(message)
             if match is None:
                 continue
 
+            SNOTE_MATCH.observe(perf_counter() - start)
+            SNOTES.inc(handler=func.__name__)
             await func(self, line.hostmask.nickname, match)
             break
+        else:
+            SNOTE_MATCH.observe(perf_counter() - start)
+            SNOTES.inc(handler="none")
 
     @_handler(
         r"""
@@ -99,11 +163,18 @@ class SnoteParser(IRCParser):
             account,
             ip,
             server,
-            datetime.utcnow(),
+            self._clock(),
         )
+        self.conn_rate.add(server, ip, cliconn.ts)
+        self._heavy_add(cliconn.ts, username, hostname, ip, realname)
         cliconn_id = await self._database.cliconn.add(cliconn)
         self._cliconns[nickname] = (cliconn_id, cliconn)
 
+        if self._watch_hit is not None and (
+            watches := self.watchlist.match(cliconn)
+        ):
+            await self._watch_hit(cliconn_id, cliconn, watches)
+
     @_handler(
         r"""
         ^
@@ -134,19 +205,22 @@ class SnoteParser(IRCParser):
         if nickname in self._cliconns:
             cliconn_id, _ = self._cliconns.pop(nickname)
 
+        now = self._clock()
         await self._database.cliexit.add(
-            cliconn_id, nickname, username, hostname, ip, reason, server
+            cliconn_id, nickname, username, hostname, ip, reason, server, now
         )
 
         if not nickname in self._kline_waiting_exit:
             return
 
         mask = self._kline_waiting_exit.pop(nickname)
-        kline_id = await self._database.kline.find_active(mask)
+        kline_id = await self._database.kline.find_active(mask, now)
         if kline_id is None:
             return
 
-        await self._database.kline_kill.add(kline_id, nickname, username, hostname, ip)
+        await self._database.kline_kill.add(
+            kline_id, nickname, username, hostname, ip, now
+        )
 
     @_handler(
         r"""
@@ -172,11 +246,13 @@ class SnoteParser(IRCParser):
         if not (ip_str := match.group("ip")) == "0":
             ip = ip_address(ip_str)
 
-        kline_id = await self._database.kline.find_active(mask)
+        now = self._clock()
+        self._heavy_add(now, username, hostname, ip)
+        kline_id = await self._database.kline.find_active(mask, now)
         if kline_id is None:
             return
 
-        await self._database.kline.reject_hit(kline_id)
+        await self._database.kline.reject_hit(kline_id, now)
 
         found = await self._database.kline_reject.find(
             kline_id, nickname, username, hostname
@@ -189,7 +265,7 @@ class SnoteParser(IRCParser):
             return
 
         await self._database.kline_reject.add(
-            kline_id, nickname, username, hostname, ip
+            kline_id, nickname, username, hostname, ip, now
         )
 
     @_handler(
@@ -214,7 +290,7 @@ class SnoteParser(IRCParser):
         new_nick = match.group("new_nick")
         cliconn_id, cliconn = self._cliconns.pop(old_nick)
         self._cliconns[new_nick] = (cliconn_id, cliconn)
-        await self._database.nick_change.add(cliconn_id, new_nick)
+        await self._database.nick_change.add(cliconn_id, new_nick, self._clock())
 
     @_handler(
         r"""
@@ -259,30 +335,19 @@ class SnoteParser(IRCParser):
         duration = match.group("duration")
         reason = match.group("reason")
 
-        old_id = await self._database.kline.find_active(mask)
-        kline_id = await self._database.kline.add(
-            source, oper, mask, int(duration) * 60, reason
+        # if an existing k-line is being extended/updated by an oper, this
+        # also moves kills and rejects of the first k-line over to this one
+        kline_id, kline = await self._database.kline.add(
+            source,
+            oper,
+            mask,
+            int(duration) * 60,
+            reason,
+            self._kline_reject_max,
+            embedded_tags(reason),
+            self._clock(),
         )
-
-        # TODO: just pass a KLine object to _kline_new
-        await self._kline_new(kline_id)
-
-        tags = list(RE_EMBEDDEDTAG.finditer(reason))
-        for tag_match in tags:
-            tag = tag_match.group(1)
-            if await self._database.kline_tag.exists(kline_id, tag):
-                continue
-
-            await self._database.kline_tag.add(kline_id, tag, source, oper)
-
-        # if an existing k-line is being extended/updated by an oper, update
-        # kills affected by the first k-line
-        if old_id is None:
-            return
-
-        kills = await self._database.kline_kill.find_by_kline(old_id)
-        for kill in kills:
-            await self._database.kline_kill.set_kline(kill.id, kline_id)
+        await self._kline_new(kline_id, kline)
 
     @_handler(
         r"""
@@ -303,11 +368,12 @@ class SnoteParser(IRCParser):
         oper = match.group("oper")
         mask = match.group("mask")
 
-        id = await self._database.kline.find_active(mask)
+        now = self._clock()
+        id = await self._database.kline.find_active(mask, now)
         if id is None:
             return
 
         try:
-            await self._database.kline_remove.add(id, source, oper)
+            await self._database.kline_remove.add(id, source, oper, now)
         except Exception:
             pass
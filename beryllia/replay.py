@@ -0,0 +1,211 @@
+import json, mmap, os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from re import compile as re_compile
+from time import monotonic
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional
+from typing import Sequence, Tuple
+
+import asyncpg
+from irctokens import Line, tokenise
+
+from .config import Config
+from .database import Database
+from .database.common import TimedPool
+from .database.kline import DBKLine
+from .log import LOG
+from .normalise import RFC1459SearchNormaliser
+from .parse.nickserv import NickServParser
+from .parse.snote import SnoteParser
+from .util import parse_server_time
+
+# lines per transaction
+BATCH = 1000
+# log progress every this many lines
+PROGRESS = 100_000
+
+# our own non-JSON log format
+RE_LOGLINE = re_compile(
+    r"^(?P<ts>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ \S+ beryllia\.irc < (?P<line>.*)$"
+)
+
+# (original text, timestamp, handler, line)
+_TYPE_BATCH = List[Tuple[str, datetime, Callable[[Line], Awaitable[None]], Line]]
+
+
+class _ConnectionPool(TimedPool):
+    # always hands out the same connection, so a whole batch of lines shares
+    # one transaction rather than paying for a commit per insert
+    def __init__(self, conn: asyncpg.Connection):
+        self._conn = conn
+        self.slowlog = None
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        yield self._conn
+
+
+class _ReplayClock(object):
+    def __init__(self):
+        self.now = datetime.utcnow()
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+def _parse(text: str) -> Optional[Tuple[datetime, Line]]:
+    # accepts our own log output (plain or JSON) or raw IRC lines with a
+    # server-time tag, optionally prefixed with "< "
+    ts: Optional[datetime] = None
+    if text.startswith("{"):
+        try:
+            record = json.loads(text)
+            ts = datetime.strptime(record["ts"][:19], "%Y-%m-%d %H:%M:%S")
+            text = record["message"]
+        except (ValueError, KeyError):
+            return None
+    elif (match := RE_LOGLINE.search(text)) is not None:
+        ts = datetime.strptime(match.group("ts"), "%Y-%m-%d %H:%M:%S")
+        text = match.group("line")
+
+    if text.startswith("< "):
+        text = text[2:]
+    elif text.startswith("> "):
+        # something we sent
+        return None
+
+    try:
+        line = tokenise(text)
+    except ValueError:
+        return None
+
+    if line.tags is not None and "time" in line.tags:
+        ts = parse_server_time(line.tags["time"]) or ts
+    if ts is None:
+        return None
+    return ts, line
+
+
+def _read_lines(filename: str) -> Iterator[str]:
+    if not os.path.getsize(filename):
+        # can't mmap an empty file
+        return
+
+    with open(filename, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as map:
+            for raw in iter(map.readline, b""):
+                yield raw.rstrip(b"\r\n").decode("utf8", errors="replace")
+
+
+async def _kline_new(kline_id: int, kline: DBKLine) -> None:
+    # no log channel to announce to
+    pass
+
+
+async def _replay_batch(
+    conn: asyncpg.Connection,
+    clock: _ReplayClock,
+    snote: SnoteParser,
+    nickserv: NickServParser,
+    database: Database,
+    batch: _TYPE_BATCH,
+) -> None:
+
+    # the whole batch in one transaction, with no per-line savepoint round
+    # trips. parsers keep some state in memory (e.g. nick -> cliconn id) that
+    # a rollback wouldn't undo, so keep a copy to go back to
+    snote_state = snote.snapshot()
+    nickserv_state = nickserv.snapshot()
+    try:
+        async with conn.transaction():
+            for _, ts, handle, line in batch:
+                clock.now = ts
+                await handle(line)
+            await nickserv.flush_events()
+            await snote.conn_rate.flush(database.conn_rate)
+        return
+    except Exception:
+        # back to how things were before the batch. buffered rows from the
+        # failed attempt will be buffered again
+        snote.restore(snote_state)
+        nickserv.restore(nickserv_state)
+        nickserv.discard_events()
+        snote.conn_rate.clear()
+
+    # something failed. go again with a savepoint (and a copy of parser
+    # state) per line, so only the bad line is skipped rather than the whole
+    # batch. that's slow, but only for batches with a bad line in them
+    async with conn.transaction():
+        for text, ts, handle, line in batch:
+            clock.now = ts
+            snote_state = snote.snapshot()
+            nickserv_state = nickserv.snapshot()
+            await conn.execute("SAVEPOINT replay_line")
+            try:
+                await handle(line)
+                await conn.execute("RELEASE SAVEPOINT replay_line")
+            except Exception:
+                LOG.exception("failed to replay line: %s", text)
+                await conn.execute("ROLLBACK TO SAVEPOINT replay_line")
+                snote.restore(snote_state)
+                nickserv.restore(nickserv_state)
+        await nickserv.flush_events()
+        await snote.conn_rate.flush(database.conn_rate)
+
+
+async def replay(config: Config, filenames: Sequence[str]) -> None:
+    conn = await asyncpg.connect(
+        user=config.db_user,
+        password=config.db_pass,
+        host=config.db_host,
+        database=config.db_name,
+    )
+    # we can always replay again if we crash part way through
+    await conn.execute("SET synchronous_commit TO OFF")
+
+    database = Database(_ConnectionPool(conn), RFC1459SearchNormaliser())
+    clock = _ReplayClock()
+    snote = SnoteParser(database, config.rejects, _kline_new, clock)
+    nickserv = NickServParser(database, resolve=False, clock=clock)
+
+    start = monotonic()
+    total = 0
+    batch: _TYPE_BATCH = []
+
+    for filename in filenames:
+        for text in _read_lines(filename):
+            if (parsed := _parse(text)) is None:
+                continue
+
+            ts, line = parsed
+            if (
+                line.command == "NOTICE"
+                and line.params[0] == "*"
+                and line.source is not None
+                and not "!" in line.source
+            ):
+                handle = snote.handle
+            elif line.command == "PRIVMSG" and line.hostmask.nickname == "NickServ":
+                handle = nickserv.handle
+            else:
+                continue
+
+            batch.append((text, ts, handle, line))
+            total += 1
+            if len(batch) == BATCH:
+                await _replay_batch(conn, clock, snote, nickserv, database, batch)
+                batch.clear()
+            if not total % PROGRESS:
+                LOG.info("replayed %d lines, up to %s", total, ts)
+
+    if batch:
+        await _replay_batch(conn, clock, snote, nickserv, database, batch)
+    await conn.close()
+
+    elapsed = monotonic() - start
+    LOG.info(
+        "replayed %d lines in %.1fs (%.0f lines/s)",
+        total,
+        elapsed,
+        total / max(elapsed, 0.001),
+    )
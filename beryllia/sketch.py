@@ -0,0 +1,125 @@
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from typing import Counter as TCounter
+from typing import Deque, Dict, List, Tuple
+
+# most keys each sketch keeps a count for
+SKETCH_SIZE = 1000
+# how far back `HeavyHitters.top` can look
+WINDOW_MAX = timedelta(hours=1)
+
+
+class SpaceSaving(object):
+    # Metwally et al's space-saving sketch. once full, a new key takes over
+    # the smallest counter and inherits its count, which becomes that key's
+    # error bound. counters are bucketed by count so that's O(1)
+    def __init__(self, size: int):
+        self._size = size
+        self._counts: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        # count -> keys with that count, oldest first
+        self._buckets: Dict[int, Dict[str, None]] = {}
+        self._min = 0
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def missing(self) -> int:
+        # most a key we don't have a counter for could have been seen. that's
+        # 0 until we're full, then anything evicted had at most our minimum
+        return self._min if len(self._counts) >= self._size else 0
+
+    def _move(self, key: str, old: int, new: int) -> None:
+        if old:
+            bucket = self._buckets[old]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[old]
+                if old == self._min:
+                    self._min = new
+        self._buckets.setdefault(new, {})[key] = None
+        self._counts[key] = new
+
+    def add(self, key: str) -> None:
+        if (count := self._counts.get(key)) is not None:
+            self._move(key, count, count + 1)
+        elif len(self._counts) < self._size:
+            self._errors[key] = 0
+            self._move(key, 0, 1)
+            self._min = 1
+        else:
+            smallest = self._min
+            evicted = next(iter(self._buckets[smallest]))
+            del self._buckets[smallest][evicted]
+            del self._counts[evicted]
+            del self._errors[evicted]
+            if not self._buckets[smallest]:
+                del self._buckets[smallest]
+                self._min = smallest + 1
+            self._errors[key] = smallest
+            self._buckets.setdefault(smallest + 1, {})[key] = None
+            self._counts[key] = smallest + 1
+
+    def items(self) -> List[Tuple[str, int, int]]:
+        # (key, count, error)
+        return [(key, count, self._errors[key]) for key, count in self._counts.items()]
+
+
+class HeavyHitters(object):
+    # a space-saving sketch per field per minute, so we can answer "top N in
+    # the last X minutes" by merging just those minutes
+    def __init__(self, fields: List[str], size: int = SKETCH_SIZE):
+        self._fields = fields
+        self._size = size
+        # (minute, field -> sketch), oldest first
+        self._minutes: Deque[Tuple[datetime, Dict[str, SpaceSaving]]] = deque()
+
+    @property
+    def fields(self) -> List[str]:
+        return self._fields
+
+    def add(self, ts: datetime, values: Dict[str, str]) -> None:
+        minute = ts.replace(second=0, microsecond=0)
+        if not self._minutes or self._minutes[-1][0] < minute:
+            sketches = {field: SpaceSaving(self._size) for field in self._fields}
+            self._minutes.append((minute, sketches))
+            while self._minutes[0][0] <= minute - WINDOW_MAX:
+                self._minutes.popleft()
+
+        # snotes (especially replayed ones) can be a little out of order; lump
+        # those in with the newest minute
+        _, sketches = self._minutes[-1]
+        for field, value in values.items():
+            sketches[field].add(value)
+
+    def top(
+        self, field: str, window: timedelta, now: datetime, count: int
+    ) -> List[Tuple[str, int, int]]:
+
+        # (key, count, error), biggest first. errors add up across minutes
+        counts: TCounter[str] = Counter()
+        errors: TCounter[str] = Counter()
+        # a key a full sketch doesn't have could still have been seen up to
+        # that sketch's minimum times that minute, so count it as if it was,
+        # keeping counts an upper bound and count - error a lower bound. we
+        # add every sketch's minimum and take back those that did have it
+        missing = 0
+        present: TCounter[str] = Counter()
+        since = now - window
+        for minute, sketches in reversed(self._minutes):
+            if minute + timedelta(minutes=1) <= since:
+                break
+            sketch = sketches[field]
+            sketch_missing = sketch.missing()
+            missing += sketch_missing
+            for key, key_count, error in sketch.items():
+                counts[key] += key_count
+                errors[key] += error
+                present[key] += sketch_missing
+
+        if missing:
+            for key in counts:
+                counts[key] += missing - present[key]
+                errors[key] += missing - present[key]
+
+        return [(key, n, errors[key]) for key, n in counts.most_common(count)]
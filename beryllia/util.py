@@ -1,18 +1,23 @@
-import re, traceback
+import re
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from enum import Enum
 from ipaddress import ip_address, IPv4Address, IPv6Address
 from ipaddress import ip_network, IPv4Network, IPv6Network
 
-from typing import Deque, List, Optional, Sequence, Set, Tuple, Type, Union
+from typing import Deque, Dict, Generic, List, Optional, Sequence, Set, Tuple
+from typing import Type, TypeVar, Union
+from typing import OrderedDict as TOrderedDict
 
 from ircrobots import Server
-from irctokens import build
+from irctokens import build, Line
 
 from ircchallenge import Challenge
 from ircrobots.matching import ANY, Response, SELF
 from ircstates.numerics import RPL_ENDOFRSACHALLENGE2, RPL_RSACHALLENGE2
 
+from .log import LOG
+
 from aiodns import DNSResolver
 from aiodns.error import DNSError
 from pycares import (
@@ -21,6 +26,7 @@ from pycares import (
     ares_query_mx_result,
     ares_query_txt_result,
 )
+from pycares.errno import ARES_ENODATA, ARES_ENOTFOUND
 
 # not in ircstates.numerics
 RPL_STATS = "249"
@@ -28,6 +34,8 @@ RPL_ENDOFSTATS = "219"
 
 RE_OPERNAME = re.compile(r"^is opered as (\S+)(?:,|$)")
 
+HEXDIGITS = set("0123456789abcdefABCDEF")
+
 SECONDS_MINUTES = 60
 SECONDS_HOURS = SECONDS_MINUTES * 60
 SECONDS_DAYS = SECONDS_HOURS * 24
@@ -105,12 +113,43 @@ def pretty_delta(delta: timedelta, max_units: int = 2, long: bool = False) -> st
     return (" " if long else "").join(outs)
 
 
+RE_DURATION = re.compile(r"(\d+)([wdhms])")
+
+
+def try_parse_duration(duration: str) -> Optional[timedelta]:
+    # "1h", "2d12h", "30m"
+    parts = RE_DURATION.findall(duration)
+    if not parts or "".join(n + u for n, u in parts) != duration:
+        return None
+
+    units = {time_unit.short: time_unit.seconds for time_unit in TIME_UNITS}
+    seconds = sum(int(n) * units[u] for n, u in parts)
+    return timedelta(seconds=seconds)
+
+
+def try_parse_ids(ids: str, max_ids: int) -> Optional[Sequence[int]]:
+    # "1,2,5-9". repeats are dropped, keeping the order they were given in
+    outs: Dict[int, None] = {}
+    for part in ids.split(","):
+        start, sep, end = part.partition("-")
+        if not start.isdecimal() or (sep and not end.isdecimal()):
+            return None
+        start_i, end_i = int(start), int(end or start)
+        if end_i < start_i:
+            return None
+        for kline_id in range(start_i, end_i + 1):
+            outs[kline_id] = None
+            if len(outs) > max_ids:
+                return None
+    return list(outs)
+
+
 async def oper_up(server: Server, oper_name: str, oper_file: str, oper_pass: str):
 
     try:
         challenge = Challenge(keyfile=oper_file, password=oper_pass)
     except Exception:
-        traceback.print_exc()
+        LOG.exception("failed to load oper challenge key")
     else:
         await server.send(build("CHALLENGE", [oper_name]))
         challenge_text = Response(RPL_RSACHALLENGE2, [SELF, ANY])
@@ -174,10 +213,10 @@ STATS_KLINE_END = Response(RPL_ENDOFSTATS, [SELF, "k"])
 STATS_NOPRIVS = Response(ERR_NOPRIVS, [SELF, ANY])
 
 
-async def get_klines(server: Server) -> Optional[Set[str]]:
+async def get_klines(server: Server) -> Optional[Dict[str, str]]:
     await server.send(build("STATS", ["g"]))
     await server.send(build("STATS", ["k"]))
-    masks: Set[str] = set()
+    masks: Dict[str, str] = {}
 
     wait = 2
     while True:
@@ -195,12 +234,40 @@ async def get_klines(server: Server) -> Optional[Set[str]]:
         elif stats_line.command == RPL_STATSKLINE:
             user = stats_line.params[4]
             host = stats_line.params[2]
-            masks.add(f"{user}@{host}")
+            masks[f"{user}@{host}"] = stats_line.params[5]
         elif (wait := wait - 1) == 0:
             break
     return masks
 
 
+RE_STATSKLINE_REASON = re.compile(
+    r"^Temporary K-line (?P<duration>\d+) min\. - (?P<reason>.*?)"
+    r"(?: \((?P<set>[^)]*)\))?$"
+)
+
+
+def parse_stats_kline_reason(
+    reason: str,
+) -> Optional[Tuple[int, str, Optional[datetime]]]:
+    # temporary k-lines have their duration baked in to their STATS reason,
+    # and the date they were set (e.g. "(2026/10/19 06.20)", in the ircd's
+    # time, which we assume is UTC) tacked on to the end of the user reason
+    user_reason, sep, oper_reason = reason.partition("|")
+    match = RE_STATSKLINE_REASON.search(user_reason)
+    if match is None:
+        return None
+
+    ts: Optional[datetime] = None
+    if (set_ := match.group("set")) is not None:
+        try:
+            ts = datetime.strptime(set_, "%Y/%m/%d %H.%M")
+        except ValueError:
+            pass
+
+    duration = int(match.group("duration")) * 60
+    return duration, match.group("reason") + sep + oper_reason, ts
+
+
 def try_parse_ip(ip: str) -> Optional[Union[IPv4Address, IPv6Address]]:
 
     try:
@@ -217,6 +284,52 @@ def try_parse_cidr(cidr: str) -> Optional[Union[IPv4Network, IPv6Network]]:
         return None
 
 
+def ip_glob_to_cidr(
+    glob: str,
+) -> Tuple[Optional[Union[IPv4Network, IPv6Network]], bool]:
+    # the smallest CIDR covering everything an IP glob could match, from the
+    # octets/hextets before the first wildcard, and whether the glob matches
+    # exactly that CIDR (e.g. "198.51.*" or "198.51.*.*")
+    if ":" in glob:
+        separator, width, size = ":", 16, 8
+        if "::" in glob:
+            # can't tell where the compressed zeros are
+            return None, False
+    else:
+        separator, width, size = ".", 8, 4
+
+    parts = glob.split(separator)
+    if len(parts) > size:
+        return None, False
+
+    known: List[int] = []
+    for part in parts:
+        if separator == "." and part.isdecimal() and int(part) <= 255:
+            known.append(int(part))
+        elif separator == ":" and 0 < len(part) <= 4 and set(part) <= HEXDIGITS:
+            known.append(int(part, 16))
+        else:
+            break
+
+    if not known:
+        return None, False
+
+    value = 0
+    for index, part_value in enumerate(known):
+        value |= part_value << (width * (size - index - 1))
+    prefix = width * len(known)
+
+    cidr: Union[IPv4Network, IPv6Network]
+    if separator == ".":
+        cidr = IPv4Network((value, prefix))
+    else:
+        cidr = IPv6Network((value, prefix))
+
+    rest = parts[len(known) :]
+    exact = bool(rest) and all(part == "*" for part in rest)
+    return cidr, exact
+
+
 def forgettz(d):
     if d.tzinfo is not None:
         return d.astimezone(tz=timezone.utc).replace(tzinfo=None)
@@ -224,6 +337,26 @@ def forgettz(d):
         return d
 
 
+SERVER_TIME_FORMATS = ["%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"]
+
+
+def parse_server_time(value: str) -> Optional[datetime]:
+    # IRCv3 server-time tag value, always UTC
+    for ts_format in SERVER_TIME_FORMATS:
+        try:
+            return datetime.strptime(value, ts_format)
+        except ValueError:
+            pass
+    return None
+
+
+def line_time(line: Line) -> datetime:
+    if line.tags is not None and "time" in line.tags:
+        if (ts := parse_server_time(line.tags["time"])) is not None:
+            return ts
+    return datetime.utcnow()
+
+
 TS_FORMATS = [
     # ISO8601 without timezone
     "%Y-%m-%d %H:%M",
@@ -244,6 +377,42 @@ def try_parse_ts(ts: str) -> Optional[datetime]:
         return None
 
 
+def _try_parse_bound(bound: str) -> Optional[Tuple[datetime, datetime]]:
+    # a timestamp covers its minute, a date covers its day
+    if (ts := try_parse_ts(bound)) is not None:
+        return ts, ts + timedelta(minutes=1)
+    try:
+        date = datetime.strptime(bound, "%Y-%m-%d")
+    except ValueError:
+        return None
+    return date, date + timedelta(days=1)
+
+
+def try_parse_ts_range(
+    ts_range: str, fudge: timedelta = timedelta(minutes=1)
+) -> Optional[Tuple[datetime, datetime]]:
+
+    # "start..end", both inclusive, or a single timestamp or date. returns a
+    # half-open [start, end) range. a single timestamp is widened by `fudge`
+    # either side, as people are often a minute out
+    start_s, sep, end_s = ts_range.partition("..")
+    if not sep:
+        if (bound := _try_parse_bound(ts_range.strip())) is None:
+            return None
+        start, end = bound
+        if try_parse_ts(ts_range.strip()) is not None:
+            start, end = start - fudge, end + fudge
+        return start, end
+
+    start_bound = _try_parse_bound(start_s.strip())
+    end_bound = _try_parse_bound(end_s.strip())
+    if start_bound is None or end_bound is None:
+        return None
+    elif end_bound[1] <= start_bound[0]:
+        return None
+    return start_bound[0], end_bound[1]
+
+
 class CompositeStringType(Enum):
     TEXT = 1
     SYMBOL = 2
@@ -352,9 +521,24 @@ def colourise(s: str):
     return f"\x03{str(colour).zfill(2)}{s}\x03"
 
 
+SPARKS = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(values: Sequence[int]) -> str:
+    top = max(values, default=0) or 1
+    return "".join(SPARKS[value * (len(SPARKS) - 1) // top] for value in values)
+
+
+# DNS errors that are an answer, rather than a reason to ask again
+DNS_DEFINITIVE = {ARES_ENODATA, ARES_ENOTFOUND}
+
+
 async def recursive_mx_resolve(
     email_domain: str,
-) -> Sequence[Tuple[Optional[int], str, str]]:
+) -> Tuple[Sequence[Tuple[Optional[int], str, str]], bool]:
+
+    # returns the records we found, and whether every lookup got an answer
+    # (even if that answer was "no such record")
 
     resolver = DNSResolver()
 
@@ -368,13 +552,16 @@ async def recursive_mx_resolve(
         (None, "TXT", f"_dmarc.{email_domain}"),
     ]
     resolved: List[Tuple[Optional[int], str, str]] = []
+    complete = True
 
     while to_resolve:
         record_parent, record_type, name = to_resolve.pop(0)
         try:
             resolves = await resolver.query(name, record_type)
-        except DNSError:
-            # log an error?
+        except DNSError as e:
+            if not e.args or not e.args[0] in DNS_DEFINITIVE:
+                # timeout, SERVFAIL etc
+                complete = False
             continue
 
         for resolve in resolves:
@@ -397,4 +584,46 @@ async def recursive_mx_resolve(
             to_resolve.append((record_parent_new, "A", resolve.host))
             to_resolve.append((record_parent_new, "AAAA", resolve.host))
 
-    return resolved
+    return resolved, complete
+
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    def __init__(self, size: int, max_age: timedelta):
+        self._size = size
+        self._max_age = max_age
+        self._items: TOrderedDict[K, Tuple[datetime, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: K) -> Optional[V]:
+        if not key in self._items:
+            return None
+
+        ts, value = self._items[key]
+        if datetime.utcnow() - ts > self._max_age:
+            del self._items[key]
+            return None
+
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        self._items[key] = (datetime.utcnow(), value)
+        self._items.move_to_end(key)
+        while len(self._items) > self._size:
+            self._items.popitem(last=False)
+
+    def pop(self, key: K) -> Optional[V]:
+        value = self.get(key)
+        self._items.pop(key, None)
+        return value
+
+    def copy(self) -> "LRUCache[K, V]":
+        out: LRUCache[K, V] = LRUCache(self._size, self._max_age)
+        out._items = self._items.copy()
+        return out
@@ -0,0 +1,191 @@
+from collections import deque
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network
+from re import compile as re_compile, escape as re_escape
+from typing import Any, Deque, Dict, Generic, Iterator, List, Optional, Pattern
+from typing import Sequence, Set, Tuple, TypeVar, Union
+
+from ircstates import casefold, CaseMap
+
+from .database.cliconn import Cliconn
+from .database.watch import DBWatch
+from .util import CompositeStringType, lex_glob_pattern, try_parse_cidr
+
+# watch types matched as globs, and which cliconn attribute they match
+GLOB_TYPES = {
+    "nick": "nickname",
+    "user": "username",
+    "host": "hostname",
+    "real": "realname",
+}
+WATCH_TYPES = set(GLOB_TYPES) | {"cidr", "account"}
+# globs whose longest literal run is shorter than this can't usefully be
+# prefiltered, so go in the grouped regex instead
+LITERAL_MIN = 3
+
+T = TypeVar("T")
+
+
+def _fold(s: str) -> str:
+    return casefold(CaseMap.RFC1459, s)
+
+
+def _glob_parts(glob: str) -> Tuple[str, List[str]]:
+    # (regex, literal runs between wildcards)
+    regex = ""
+    literals = [""]
+    escaped = False
+    # fold after lexing, as RFC1459 folds our escape character
+    for part in lex_glob_pattern(glob):
+        if part.type == CompositeStringType.SYMBOL:
+            regex += ".*" if part.text == "*" else "."
+            literals.append("")
+        elif part.text == "\\" and not escaped:
+            escaped = True
+            continue
+        else:
+            text = _fold(part.text)
+            regex += re_escape(text)
+            literals[-1] += text
+        escaped = False
+    return regex, [literal for literal in literals if literal]
+
+
+class AhoCorasick(Generic[T]):
+    # finds every added word in a string in one pass, however many words
+    # there are
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[T]] = [[]]
+
+    def add(self, word: str, value: T) -> None:
+        node = 0
+        for char in word:
+            if (next_node := self._goto[node].get(char)) is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = next_node
+        self._out[node].append(value)
+
+    def build(self) -> None:
+        # breadth first, so a node's fail target is always finished first
+        queue: Deque[int] = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] += self._out[self._fail[child]]
+                queue.append(child)
+
+    def search(self, text: str) -> Iterator[T]:
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            yield from self._out[node]
+
+
+class CIDRTrie(Generic[T]):
+    # a binary radix tree per address family. looking an IP up walks at most
+    # 32 (or 128) nodes, collecting every CIDR that contains it
+    def __init__(self):
+        self._roots: Dict[int, List[Any]] = {4: [None, None, []], 6: [None, None, []]}
+
+    def add(self, cidr: Union[IPv4Network, IPv6Network], value: T) -> None:
+        node = self._roots[cidr.version]
+        bits = int(cidr.network_address)
+        for i in range(cidr.prefixlen):
+            bit = (bits >> (cidr.max_prefixlen - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, []]
+            node = node[bit]
+        node[2].append(value)
+
+    def search(self, ip: Union[IPv4Address, IPv6Address]) -> List[T]:
+        node = self._roots[ip.version]
+        outs = list(node[2])
+        bits = int(ip)
+        for i in range(ip.max_prefixlen):
+            node = node[(bits >> (ip.max_prefixlen - 1 - i)) & 1]
+            if node is None:
+                break
+            outs += node[2]
+        return outs
+
+
+class _GlobSet(object):
+    def __init__(self, watches: Sequence[DBWatch]):
+        self._automaton: AhoCorasick[int] = AhoCorasick()
+        self._regexes: List[Pattern] = []
+        self._watches = list(watches)
+        # globs we couldn't prefilter, e.g. "*" or "?a*"
+        self._short: List[int] = []
+
+        for index, watch in enumerate(self._watches):
+            regex, literals = _glob_parts(watch.pattern)
+            self._regexes.append(re_compile(regex))
+            longest = max(literals, key=len, default="")
+            if len(longest) >= LITERAL_MIN:
+                self._automaton.add(longest, index)
+            else:
+                self._short.append(index)
+        self._automaton.build()
+
+        # one pass to tell whether any short glob matches at all, which
+        # usually none will
+        self._short_any: Optional[Pattern] = None
+        if self._short:
+            short = "|".join(f"(?:{self._regexes[i].pattern})" for i in self._short)
+            self._short_any = re_compile(short)
+
+    def match(self, value: str) -> List[DBWatch]:
+        value = _fold(value)
+        indexes: Set[int] = set(self._automaton.search(value))
+        if self._short_any is not None and self._short_any.fullmatch(value):
+            indexes.update(self._short)
+        return [
+            self._watches[i]
+            for i in sorted(indexes)
+            if self._regexes[i].fullmatch(value)
+        ]
+
+
+class Watchlist(object):
+    # every watch pattern compiled together, so that checking a new
+    # connection costs about the same with 10 watches as with 10,000
+    def __init__(self, watches: Sequence[DBWatch]):
+        self._count = len(watches)
+
+        globs: Dict[str, List[DBWatch]] = {type: [] for type in GLOB_TYPES}
+        self._cidrs: CIDRTrie[DBWatch] = CIDRTrie()
+        self._accounts: Dict[str, List[DBWatch]] = {}
+        for watch in watches:
+            if watch.type in globs:
+                globs[watch.type].append(watch)
+            elif watch.type == "cidr":
+                if (cidr := try_parse_cidr(watch.pattern)) is not None:
+                    self._cidrs.add(cidr, watch)
+            elif watch.type == "account":
+                self._accounts.setdefault(_fold(watch.pattern), []).append(watch)
+
+        self._globs = {type: _GlobSet(w) for type, w in globs.items() if w}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def match(self, cliconn: Cliconn) -> List[DBWatch]:
+        outs: List[DBWatch] = []
+        for type, globs in self._globs.items():
+            outs += globs.match(getattr(cliconn, GLOB_TYPES[type]))
+        if cliconn.ip is not None:
+            outs += self._cidrs.search(cliconn.ip)
+        if cliconn.account is not None:
+            outs += self._accounts.get(_fold(cliconn.account), [])
+        return outs
@@ -8,6 +8,9 @@
 
 BEGIN;
 
+-- for infix (`*foo*`) nick searches
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 CREATE TABLE kline (
     id           SERIAL PRIMARY KEY,
     mask         VARCHAR(92)  NOT NULL,
@@ -18,12 +21,29 @@ CREATE TABLE kline (
     reason       VARCHAR(260) NOT NULL,
     ts           TIMESTAMP    NOT NULL,
     expire       TIMESTAMP    NOT NULL,
-    last_reject  TIMESTAMP
+    expired      BOOLEAN      NOT NULL  DEFAULT FALSE,
+    -- mirrors the existence of a kline_remove row
+    removed      BOOLEAN      NOT NULL  DEFAULT FALSE,
+    last_reject  TIMESTAMP,
+    search_reason TSVECTOR    NOT NULL
+        GENERATED ALWAYS AS (TO_TSVECTOR('english', reason)) STORED
 );
 -- for retention period bulk deletion
 CREATE INDEX kline_expire ON kline(expire);
+-- for `!kcheck reason` keyword searches
+CREATE INDEX kline_search_reason ON kline USING GIN (search_reason);
 -- for database.kline.find()
 CREATE INDEX kline_mask   ON kline(mask);
+-- for database.kline.find_active() and list_active(). only covers k-lines
+-- that are still in force, so stays small however much history we keep
+CREATE INDEX kline_active_mask ON kline(mask, ts DESC)
+    WHERE NOT removed AND NOT expired;
+-- for database.kline.list_expiring()
+CREATE INDEX kline_expiring    ON kline(expire)        WHERE NOT expired;
+-- for `!kcheck ts` ranges
+CREATE INDEX kline_ts          ON kline(ts);
+-- for `!ktaglast`, an oper's most recent k-lines
+CREATE INDEX kline_oper_ts     ON kline(oper, ts DESC);
 
 CREATE TABLE kline_remove (
     kline_id INTEGER     NOT NULL  PRIMARY KEY  REFERENCES kline (id)  ON DELETE CASCADE,
@@ -52,7 +72,8 @@ CREATE INDEX kline_kill_kline_id    ON kline_kill(kline_id);
 CREATE INDEX kline_kill_search_nick ON kline_kill(search_nick);
 CREATE INDEX kline_kill_search_user ON kline_kill(search_user);
 CREATE INDEX kline_kill_search_host ON kline_kill(search_host);
-CREATE INDEX kline_kill_ip          ON kline_kill(ip);
+-- GiST so CIDR containment (ip <<= $1) is an index range scan
+CREATE INDEX kline_kill_ip          ON kline_kill USING GIST (ip inet_ops);
 
 CREATE TABLE kline_reject (
     id          SERIAL PRIMARY KEY,
@@ -73,7 +94,7 @@ CREATE INDEX kline_reject_kline_id    ON kline_reject(kline_id);
 CREATE INDEX kline_reject_search_nick ON kline_reject(search_nick);
 CREATE INDEX kline_reject_search_user ON kline_reject(search_user);
 CREATE INDEX kline_reject_search_host ON kline_reject(search_host);
-CREATE INDEX kline_reject_ip          ON kline_reject(ip);
+CREATE INDEX kline_reject_ip          ON kline_reject USING GIST (ip inet_ops);
 
 CREATE TABLE kline_tag (
     kline_id    INTEGER      NOT NULL  REFERENCES kline (id)  ON DELETE CASCADE,
@@ -101,15 +122,25 @@ CREATE TABLE cliconn (
     search_acc  VARCHAR(16),
     ip          INET,
     server      VARCHAR(92) NOT NULL,
-    ts          TIMESTAMP   NOT NULL
+    ts          TIMESTAMP   NOT NULL,
+    -- filled in when we see the connection exit
+    exit_ts     TIMESTAMP,
+    -- seconds
+    duration    INTEGER,
+    quit_reason VARCHAR(260)
 );
 -- for retention period bulk deletion
 CREATE INDEX cliconn_ts          ON cliconn(ts);
 -- for `!cliconn` searches
-CREATE INDEX cliconn_search_nick ON cliconn(search_nick);
+-- varchar_pattern_ops so `foo*` is an index range scan whatever the collation
+CREATE INDEX cliconn_search_nick ON cliconn(search_nick varchar_pattern_ops, ts DESC);
+CREATE INDEX cliconn_search_nick_trgm ON cliconn USING GIN (search_nick gin_trgm_ops);
 CREATE INDEX cliconn_search_user ON cliconn(search_user);
 CREATE INDEX cliconn_search_host ON cliconn(search_host);
-CREATE INDEX cliconn_ip          ON cliconn(ip);
+CREATE INDEX cliconn_ip          ON cliconn USING GIST (ip inet_ops);
+-- for `!cliconn short` and `!cliconn quit` searches
+CREATE INDEX cliconn_duration    ON cliconn(duration, ts DESC) WHERE duration IS NOT NULL;
+CREATE INDEX cliconn_quit_trgm   ON cliconn USING GIN (quit_reason gin_trgm_ops);
 
 CREATE TABLE cliexit (
     id           SERIAL       PRIMARY KEY,
@@ -128,6 +159,37 @@ CREATE TABLE cliexit (
 -- for retention period bulk deletion
 CREATE INDEX cliexit_ts ON cliexit(ts);
 
+-- patterns `!watch` alerts on when a new connection matches. all loaded into
+-- memory, so no indexes
+CREATE TABLE watch (
+    id       SERIAL        PRIMARY KEY,
+    type     VARCHAR(8)    NOT NULL,
+    pattern  VARCHAR(92)   NOT NULL,
+    reason   VARCHAR(260)  NOT NULL,
+    oper     VARCHAR(16)   NOT NULL,
+    ts       TIMESTAMP     NOT NULL
+);
+
+-- per-minute connection counts, for `!connrate`. the primary keys double as
+-- the "this key over this time range" index
+CREATE TABLE conn_rate_server (
+    ts      TIMESTAMP    NOT NULL,
+    server  VARCHAR(92)  NOT NULL,
+    count   INTEGER      NOT NULL,
+    PRIMARY KEY (server, ts)
+);
+-- for retention period bulk deletion
+CREATE INDEX conn_rate_server_ts ON conn_rate_server(ts);
+-- IPv4 /24s and IPv6 /64s
+CREATE TABLE conn_rate_prefix (
+    ts      TIMESTAMP    NOT NULL,
+    prefix  CIDR         NOT NULL,
+    count   INTEGER      NOT NULL,
+    PRIMARY KEY (prefix, ts)
+);
+-- for retention period bulk deletion
+CREATE INDEX conn_rate_prefix_ts ON conn_rate_prefix(ts);
+
 CREATE TABLE nick_change (
     id           SERIAL       PRIMARY KEY,
     cliconn_id   INTEGER      NOT NULL  REFERENCES cliconn (id)  ON DELETE CASCADE,
@@ -137,7 +199,9 @@ CREATE TABLE nick_change (
 );
 -- for `!cliconn` searches
 CREATE INDEX nick_change_cliconn_id ON nick_change(cliconn_id);
-CREATE INDEX nick_change_nickname   ON nick_change(nickname);
+-- carries cliconn_id so `!cliconn nick`'s semi-join needn't visit the table
+CREATE INDEX nick_change_search_nick ON nick_change(search_nick varchar_pattern_ops, cliconn_id);
+CREATE INDEX nick_change_search_nick_trgm ON nick_change USING GIN (search_nick gin_trgm_ops);
 
 CREATE TABLE registration (
     id            SERIAL        PRIMARY KEY,
@@ -148,8 +212,18 @@ CREATE TABLE registration (
     email         VARCHAR(256)  NOT NULL,
     search_email  VARCHAR(256)  NOT NULL,
     verified_at   TIMESTAMP,
+    dropped_at    TIMESTAMP,
     ts            TIMESTAMP     NOT NULL
 );
+-- for finding the registration that a VERIFY is for
+CREATE INDEX registration_search_acc ON registration(search_acc, ts DESC)
+    WHERE verified_at IS NULL AND dropped_at IS NULL;
+-- for `!regcheck`
+CREATE INDEX registration_account ON registration(search_acc varchar_pattern_ops, ts DESC);
+CREATE INDEX registration_nick    ON registration(search_nick varchar_pattern_ops, ts DESC);
+CREATE INDEX registration_email   ON registration(search_email varchar_pattern_ops, ts DESC);
+-- `!regcheck domain` is a prefix search on the reversed email
+CREATE INDEX registration_email_domain ON registration(REVERSE(search_email) varchar_pattern_ops);
 
 CREATE TABLE email_resolve (
     id               SERIAL        PRIMARY KEY,
@@ -158,14 +232,26 @@ CREATE TABLE email_resolve (
     record_type      VARCHAR(16)   NOT NULL,
     record           VARCHAR(256)  NOT NULL
 );
+CREATE INDEX email_resolve_registration_id ON email_resolve(registration_id);
+-- for `!regcheck mx`
+CREATE INDEX email_resolve_mx ON email_resolve(LOWER(record) varchar_pattern_ops)
+    WHERE record_type = 'MX';
 
 CREATE TABLE account_freeze (
     id       SERIAL        PRIMARY KEY,
-    account  VARCHAR(16)   NOT NULL,
-    soper    VARCHAR(16)   NOT NULL,
-    reason   VARCHAR(256)  NOT NULL,
-    ts       TIMESTAMP     NOT NULL
+    account     VARCHAR(16)   NOT NULL,
+    search_acc  VARCHAR(16)   NOT NULL,
+    soper       VARCHAR(16)   NOT NULL,
+    reason      VARCHAR(256)  NOT NULL,
+    ts          TIMESTAMP     NOT NULL,
+    search_reason TSVECTOR NOT NULL
+        GENERATED ALWAYS AS (TO_TSVECTOR('english', reason)) STORED
 );
+-- for `!fcheck`
+CREATE INDEX account_freeze_search_acc ON account_freeze(search_acc varchar_pattern_ops, ts DESC);
+CREATE INDEX account_freeze_soper      ON account_freeze(soper, ts DESC);
+CREATE INDEX account_freeze_search_reason ON account_freeze
+    USING GIN (search_reason);
 
 CREATE TABLE freeze_tag (
     freeze_id   INTEGER      NOT NULL  REFERENCES account_freeze (id)  ON DELETE CASCADE,
@@ -175,6 +261,22 @@ CREATE TABLE freeze_tag (
     ts          TIMESTAMP    NOT NULL,
     PRIMARY KEY (freeze_id, search_tag)
 );
+-- for `!fcheck tag`
+CREATE INDEX freeze_tag_search_tag ON freeze_tag(search_tag);
+
+-- append-only audit log of NickServ commands
+CREATE TABLE nickserv_event (
+    id          BIGSERIAL     PRIMARY KEY,
+    command     VARCHAR(32)   NOT NULL,
+    nickname    VARCHAR(16)   NOT NULL,
+    source_acc  VARCHAR(16),
+    account     VARCHAR(16)   NOT NULL,
+    search_acc  VARCHAR(16)   NOT NULL,
+    args        VARCHAR(512)  NOT NULL,
+    ts          TIMESTAMP     NOT NULL
+);
+-- for account history searches
+CREATE INDEX nickserv_event_search_acc ON nickserv_event(search_acc, ts DESC);
 
 CREATE TABLE statsp (
     oper VARCHAR(16) NOT NULL,
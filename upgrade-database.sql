@@ -0,0 +1,13 @@
+-- bring a database made with an older make-database.sql up to date. safe to
+-- run more than once
+
+-- kline.removed mirrors the existence of a kline_remove row, and the active
+-- k-line queries rely on it, so k-lines removed before it existed need it set
+ALTER TABLE kline ADD COLUMN IF NOT EXISTS
+    removed BOOLEAN NOT NULL DEFAULT FALSE;
+UPDATE kline SET removed = TRUE
+WHERE NOT removed
+AND id IN (SELECT kline_id FROM kline_remove);
+DROP INDEX IF EXISTS kline_active_mask;
+CREATE INDEX kline_active_mask ON kline(mask, ts DESC)
+    WHERE NOT removed AND NOT expired;